@@ -1,7 +1,7 @@
 """
 Flask主应用
 """
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
 from flask_cors import CORS
 from functools import wraps
 from config import config
@@ -9,9 +9,21 @@ from database import db_manager
 from services import stock_service, position_service, ai_service, template_service
 from services.watchlist_service import watchlist_service
 from services.scheduler_service import scheduler_service
+from services.ingest_lease_service import IngestLeaseService
+from services.security_master import security_master
+from services.stock_search import stock_search
+from services.data_versions import data_versions
+from services.quote_hub import quote_hub
+from services.ai_job_queue import ai_job_queue, AIJobRejected
+from services.ai_response_cache import ai_response_cache
 from services.db_browser_service import db_browser_service
 from services.user_service import user_service
 from utils.logger import app_logger
+from utils.rate_limiter import rate_limiter
+from utils.ttl_cache import TTLCache
+from datetime import datetime, timezone
+import hashlib
+import math
 import traceback
 
 app = Flask(__name__)
@@ -19,6 +31,9 @@ app.config['SECRET_KEY'] = config.SECRET_KEY
 app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24小时
 CORS(app)
 
+# K线/指标接口的响应缓存：(接口, 股票, 参数...) -> (数据版本, JSON文本)
+response_cache = TTLCache(maxsize=config.RESPONSE_CACHE_SIZE, ttl=config.RESPONSE_CACHE_TTL)
+
 app_logger.info("Flask应用启动成功")
 
 
@@ -59,6 +74,89 @@ def admin_required(f):
     return decorated_function
 
 
+def quota_exceeded(quota):
+    """Tushare配额不足的429响应（带Retry-After）"""
+    retry_after = max(1, math.ceil(quota.retry_after))
+    resp = jsonify({'success': False, 'message': f'数据接口调用过于频繁，请{retry_after}秒后重试'})
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp, 429
+
+
+def tushare_quota(f):
+    """Tushare配额不足时立即返回429，不阻塞Web线程
+    
+    请求内的接口调用不等待令牌；任一调用被限流时返回429和Retry-After。
+    只用于没有写库副作用的接口，写库的接口需在写库前自行检查配额（见 add_watchlist）
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with rate_limiter.non_blocking() as quota:
+            response = f(*args, **kwargs)
+        if quota.rejected:
+            return quota_exceeded(quota)
+        return response
+    return decorated_function
+
+
+
+def ai_job_rejected(error):
+    """AI任务队列已满或用户并发过多时返回429"""
+    resp = jsonify({'success': False, 'message': str(error)})
+    resp.headers['Retry-After'] = str(error.retry_after)
+    return resp, 429
+
+
+def wait_ai_job(job_id):
+    """同步请求最多等待 AI_SYNC_WAIT_SECONDS 秒，避免Web线程在整个大模型调用期间阻塞
+    
+    Returns:
+        tuple: (任务状态, None)；仍未完成时为 (None, 202响应)，客户端通过 /api/ai/jobs/<job_id> 轮询结果
+    """
+    job = ai_job_queue.wait(job_id, timeout=config.AI_SYNC_WAIT_SECONDS)
+    if job is None:
+        return None, (jsonify({'success': False, 'message': '任务不存在或已过期'}), 404)
+    if job['status'] in ('queued', 'running'):
+        return None, (jsonify({'success': True, 'data': {'job_id': job_id, 'status': job['status']}}), 202)
+    return job, None
+
+
+def versioned_json(key, stock_code, build):
+    """按股票数据版本缓存JSON响应，并支持 ETag / Last-Modified 条件请求
+    
+    数据未变化时：浏览器带 If-None-Match/If-Modified-Since 的请求直接返回304，
+    其他请求返回缓存的JSON文本，都不查询数据库、不重新序列化
+    
+    Args:
+        key: 缓存键（接口名和请求参数组成的元组）
+        stock_code: 股票代码，写入新K线/指标后其数据版本变化
+        build: 缓存未命中时生成data的函数
+    """
+    version = data_versions.get(stock_service.normalize_stock_code(stock_code))
+    etag = hashlib.sha1(repr((key, version)).encode()).hexdigest()[:20]
+    last_modified = datetime.fromtimestamp(int(version), timezone.utc) if version else None
+    
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(last_modified and request.if_modified_since
+                            and request.if_modified_since >= last_modified)
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        cached = response_cache.get(key)
+        if response_cache.missing(cached) or cached[0] != version:
+            cached = (version, app.json.dumps({'success': True, 'data': build()}))
+            response_cache.set(key, cached)
+        response = app.response_class(cached[1], mimetype='application/json')
+    
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # 需要登录的数据：浏览器可以缓存，但每次使用前都要向服务器验证
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 # ========== 认证路由 ==========
 @app.route('/login')
 def login_page():
@@ -292,6 +390,49 @@ def delete_model(model_id):
         return jsonify({'success': False, 'message': f'删除失败: {str(e)}'})
 
 
+@app.route('/api/admin/rate-limits', methods=['GET'])
+@admin_required
+def get_rate_limits():
+    """Tushare接口限流统计（调用次数、等待时长、拒绝次数）"""
+    return jsonify({'success': True, 'data': {
+        'quotas': rate_limiter.quotas,
+        'default_quota': rate_limiter.default_quota,
+        'endpoints': rate_limiter.stats()
+    }})
+
+
+@app.route('/api/admin/caches', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    """进程内缓存统计（条目数、命中、未命中、淘汰次数）"""
+    return jsonify({'success': True, 'data': {
+        'stock_info': stock_service.info_cache.stats(),
+        'responses': response_cache.stats(),
+        'security_master': security_master.status(),
+        'ai_responses': ai_response_cache.status(),
+        'prompt_expansions': ai_service.expansion_cache.stats()
+    }})
+
+
+@app.route('/api/admin/ai_jobs', methods=['GET'])
+@admin_required
+def get_ai_job_stats():
+    """AI任务队列状态（排队、运行中、累计提交/拒绝/失败次数）及OpenRouter请求统计"""
+    data = ai_job_queue.status()
+    data['http'] = ai_service.http_status()
+    return jsonify({'success': True, 'data': data})
+
+
+@app.route('/api/admin/scheduler', methods=['GET'])
+@admin_required
+def get_scheduler_status():
+    """定时任务通道状态（运行中的任务、运行次数、合并次数、耗时），以及独立采集进程的分片情况"""
+    data = scheduler_service.status()
+    data['mode'] = config.SCHEDULER_MODE
+    data['ingest_workers'] = IngestLeaseService.cluster_status()
+    return jsonify({'success': True, 'data': data})
+
+
 # ========== 主页路由 ==========
 @app.route('/')
 @login_required
@@ -337,7 +478,11 @@ def get_watchlist():
 @app.route('/api/watchlist', methods=['POST'])
 @login_required
 def add_watchlist():
-    """添加自选股"""
+    """添加自选股
+    
+    先查询股票信息（只读），配额不足时在写库前返回429；
+    写库后的K线拉取被限流时不影响本次结果，由定时任务补齐
+    """
     try:
         user_id = session['user_id']
         data = request.json
@@ -346,7 +491,11 @@ def add_watchlist():
         if not stock_code:
             return jsonify({'success': False, 'message': '股票代码不能为空'}), 400
         
-        result = watchlist_service.add_to_watchlist(user_id, stock_code)
+        with rate_limiter.non_blocking() as quota:
+            stock_service.get_stock_info(stock_code)
+            if quota.rejected:
+                return quota_exceeded(quota)
+            result = watchlist_service.add_to_watchlist(user_id, stock_code)
         if result:
             return jsonify({'success': True, 'message': '添加成功'})
         else:
@@ -372,8 +521,24 @@ def delete_watchlist(stock_code):
 
 
 # ========== 股票数据API ==========
+@app.route('/api/stock/search', methods=['GET'])
+@login_required
+def search_stock():
+    """按代码、名称或拼音缩写模糊搜索股票/指数/ETF（本地索引，不调用接口）"""
+    try:
+        query = request.args.get('q', '').strip()
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        if not query:
+            return jsonify({'success': True, 'data': []})
+        security_master.ensure_loaded()
+        return jsonify({'success': True, 'data': stock_search.search(query, limit)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 @app.route('/api/stock/info/<stock_code>', methods=['GET'])
 @login_required
+@tushare_quota
 def get_stock_info(stock_code):
     """获取股票基本信息"""
     try:
@@ -389,15 +554,24 @@ def get_stock_info(stock_code):
 @app.route('/api/stock/data/<stock_code>', methods=['GET'])
 @login_required
 def get_stock_data(stock_code):
-    """获取股票K线数据（仅从数据库读取，不触发API调用）"""
+    """获取股票K线数据（仅从数据库读取，不触发API调用）
+    
+    format=columns 时返回列式数据 {列名: [值, ...]}，省去逐行构建字典；
+    响应按数据版本缓存，支持ETag/304
+    """
     try:
         period = request.args.get('period', 'daily')
         days = int(request.args.get('days', 60))
+        columns = request.args.get('format') == 'columns'
         
         # 从数据库获取数据（不再自动触发API更新）
-        data = stock_service.get_stock_data_from_db(stock_code, period, days)
+        def build():
+            if columns:
+                arrays = stock_service.get_kline_arrays(stock_code, period, days)
+                return stock_service.kline_arrays_to_columns(arrays)
+            return stock_service.get_stock_data_from_db(stock_code, period, days)
         
-        return jsonify({'success': True, 'data': data})
+        return versioned_json(('data', stock_code, period, days, columns), stock_code, build)
     except Exception as e:
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -406,22 +580,23 @@ def get_stock_data(stock_code):
 @app.route('/api/stock/indicators/<stock_code>', methods=['GET'])
 @login_required
 def get_stock_indicators(stock_code):
-    """获取股票技术指标"""
+    """获取股票技术指标（响应按数据版本缓存，支持ETag/304）"""
     try:
         days = int(request.args.get('days', 60))
-        indicators = stock_service.get_indicators_from_db(stock_code, days)
-        
-        return jsonify({'success': True, 'data': indicators})
+        return versioned_json(('indicators', stock_code, days), stock_code,
+                              lambda: stock_service.get_indicators_from_db(stock_code, days))
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
 @app.route('/api/stock/update/<stock_code>', methods=['POST'])
 @login_required
+@tushare_quota
 def update_stock_data(stock_code):
-    """更新股票数据"""
+    """更新股票数据（默认增量，?full=1 时全量回补）"""
     try:
-        result = stock_service.update_stock_data(stock_code)
+        full = request.args.get('full') in ('1', 'true')
+        result = stock_service.update_stock_data(stock_code, full=full)
         if result:
             return jsonify({'success': True, 'message': '数据更新成功'})
         else:
@@ -445,6 +620,41 @@ def get_realtime_price(stock_code):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+
+@app.route('/api/stock/realtime/stream', methods=['GET'])
+@login_required
+def stream_realtime_prices():
+    """实时行情推送（Server-Sent Events），?codes=688385,000001
+    
+    连接后先推送当前行情，之后行情写入时推送变化的股票；无数据时定期发送注释行保活
+    """
+    codes = [code.strip() for code in request.args.get('codes', '').split(',') if code.strip()]
+    if not codes:
+        return jsonify({'success': False, 'message': '请提供股票代码'}), 400
+    if len(codes) > config.QUOTE_STREAM_MAX_CODES:
+        return jsonify({'success': False, 'message': f'最多订阅{config.QUOTE_STREAM_MAX_CODES}只股票'}), 400
+    ts_codes = list(dict.fromkeys(stock_service.normalize_stock_code(code) for code in codes))
+
+    def event(quote):
+        return f"event: quote\ndata: {app.json.dumps(quote)}\n\n"
+
+    def generate():
+        sub = quote_hub.subscribe(ts_codes)
+        try:
+            yield "retry: 5000\n\n"
+            for quote in quote_hub.snapshot(ts_codes, sub).values():
+                yield event(quote)
+            while True:
+                quote = sub.get(timeout=config.QUOTE_STREAM_HEARTBEAT_SECONDS)
+                yield event(quote) if quote is not None else ": keep-alive\n\n"
+        finally:
+            quote_hub.unsubscribe(sub)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 关闭Nginx缓冲
+    return response
+
 # ========== AI对话API ==========
 @app.route('/api/chat/models', methods=['GET'])
 @login_required
@@ -472,7 +682,11 @@ def get_chat_history(stock_code):
 @app.route('/api/chat/send', methods=['POST'])
 @login_required
 def send_chat():
-    """发送聊天消息（支持图片）"""
+    """发送聊天消息（支持图片）
+    
+    stream 为 true 时以SSE流式返回AI回复；async 为 true 时立即返回任务ID；
+    否则最多等待 AI_SYNC_WAIT_SECONDS 秒，超时返回202和任务ID；no_cache 为 true 时不使用AI响应缓存
+    """
     try:
         user_id = session['user_id']
         username = session['username']
@@ -481,6 +695,7 @@ def send_chat():
         message = data.get('message', '')  # 消息可以为空（只发图片）
         model = data.get('model')  # 获取用户选择的模型
         images = data.get('images', [])  # 获取图片列表（base64格式）
+        use_cache = not data.get('no_cache')  # no_cache 为 true 时不使用AI响应缓存
         
         print(f"📨 收到聊天请求 - user_id: {user_id}, username: {username}, stock_code: {stock_code}, model: {model}, images: {len(images) if images else 0}")
         
@@ -490,14 +705,51 @@ def send_chat():
         if not message and not images:
             return jsonify({'success': False, 'message': '请输入消息或上传图片'}), 400
         
+        # 大模型调用在AI任务队列中执行
+        if data.get('stream'):
+            # 流式：以SSE逐段返回（event: delta），结束后发送 event: done；对话记录在生成结束后保存
+            job_id = ai_job_queue.submit(user_id, 'chat', ai_service.chat_with_history_stream,
+                                         user_id, username, stock_code, message, model=model, images=images,
+                                         use_cache=use_cache)
+            
+            def generate():
+                yield f"event: job\ndata: {app.json.dumps({'job_id': job_id})}\n\n"
+                for delta in ai_job_queue.follow(job_id):
+                    yield f"event: delta\ndata: {app.json.dumps({'content': delta})}\n\n"
+                job = ai_job_queue.get(job_id)
+                if job is None:
+                    yield f"event: error\ndata: {app.json.dumps({'message': '任务不存在或已过期'})}\n\n"
+                elif job['status'] == 'failed':
+                    yield f"event: error\ndata: {app.json.dumps({'message': job['error']})}\n\n"
+                yield "event: done\ndata: {}\n\n"
+            
+            response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
+        
+        job_id = ai_job_queue.submit(user_id, 'chat', ai_service.chat_with_history,
+                                     user_id, username, stock_code, message, model=model, images=images,
+                                     use_cache=use_cache)
+        if data.get('async'):
+            # 异步：立即返回任务ID，通过 /api/ai/jobs/<job_id> 轮询结果
+            return jsonify({'success': True, 'data': {'job_id': job_id}}), 202
+        
         # 带历史记录和图片的对话
         print(f"🤖 开始调用AI服务...")
-        response = ai_service.chat_with_history(user_id, username, stock_code, message, model=model, images=images)
+        job, pending = wait_ai_job(job_id)
+        if pending:
+            return pending
+        if job['status'] == 'failed':
+            return jsonify({'success': False, 'message': job['error']}), 500
+        response = job['result']
         print(f"✅ AI响应完成，响应长度: {len(response) if response else 0}")
         
         result = jsonify({'success': True, 'data': {'response': response}})
         print(f"📤 返回结果: success=True, response长度={len(response) if response else 0}")
         return result
+    except AIJobRejected as e:
+        return ai_job_rejected(e)
     except Exception as e:
         print(f"❌ 聊天API异常: {e}")
         traceback.print_exc()
@@ -506,8 +758,9 @@ def send_chat():
 
 @app.route('/api/chat/analyze/<stock_code>', methods=['POST'])
 @login_required
+@tushare_quota
 def analyze_stock(stock_code):
-    """分析股票并生成策略"""
+    """分析股票并生成策略（async 为 true 或等待超过 AI_SYNC_WAIT_SECONDS 秒时返回202和任务ID；no_cache 为 true 时不使用AI响应缓存）"""
     try:
         user_id = session['user_id']
         # 获取股票数据
@@ -524,49 +777,74 @@ def analyze_stock(stock_code):
         # 获取用户自定义消息
         data = request.json or {}
         user_message = data.get('message')
+        use_cache = not data.get('no_cache')
         
-        # AI分析
-        analysis = ai_service.analyze_stock(
-            stock_code,
-            stock_info['name'],
-            stock_data,
-            indicators,
-            user_message
-        )
-        
-        # 保存对话记录
-        if user_message:
-            ai_service.save_chat_history(user_id, stock_code, 'user', user_message)
-        ai_service.save_chat_history(user_id, stock_code, 'assistant', analysis)
-        
-        # 生成指标摘要
-        latest = indicators[-1]
-        indicators_summary = f"""
+        # AI分析（在AI任务队列中执行）
+        def run_analysis():
+            analysis = ai_service.analyze_stock(
+                stock_code,
+                stock_info['name'],
+                stock_data,
+                indicators,
+                user_message,
+                use_cache=use_cache
+            )
+            
+            # 保存对话记录
+            if user_message:
+                ai_service.save_chat_history(user_id, stock_code, 'user', user_message)
+            ai_service.save_chat_history(user_id, stock_code, 'assistant', analysis)
+            
+            # 生成指标摘要
+            latest = indicators[-1]
+            indicators_summary = f"""
 最新MACD: {latest['macd']:.4f} (信号线: {latest['macd_signal']:.4f})
 最新RSI(6): {latest['rsi_6']:.2f}, RSI(12): {latest['rsi_12']:.2f}
 EMA(12): {latest['ema_12']:.2f}, EMA(26): {latest['ema_26']:.2f}
 """
+            
+            # 保存策略文件
+            strategy_file = ai_service.save_strategy(
+                stock_code,
+                stock_info['name'],
+                analysis,
+                indicators_summary
+            )
+            return {
+                'analysis': analysis,
+                'strategy_file': strategy_file
+            }
         
-        # 保存策略文件
-        strategy_file = ai_service.save_strategy(
-            stock_code,
-            stock_info['name'],
-            analysis,
-            indicators_summary
-        )
+        job_id = ai_job_queue.submit(user_id, 'analyze', run_analysis)
+        if data.get('async'):
+            return jsonify({'success': True, 'data': {'job_id': job_id}}), 202
         
+        job, pending = wait_ai_job(job_id)
+        if pending:
+            return pending
+        if job['status'] == 'failed':
+            return jsonify({'success': False, 'message': job['error']}), 500
         return jsonify({
             'success': True,
-            'data': {
-                'analysis': analysis,
-                'strategy_file': strategy_file
-            }
+            'data': job['result']
         })
+    except AIJobRejected as e:
+        return ai_job_rejected(e)
     except Exception as e:
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/ai/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_ai_job(job_id):
+    """查询AI任务状态（queued/running/done/failed），完成后返回结果；流式对话进行中返回已生成的部分"""
+    job = ai_job_queue.get(job_id, user_id=session['user_id'])
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
+    return jsonify({'success': True, 'data': job})
+
+
 @app.route('/api/chat/clear/<stock_code>', methods=['DELETE'])
 @login_required
 def clear_chat_history(stock_code):
@@ -596,7 +874,7 @@ def get_positions():
 @app.route('/api/positions', methods=['POST'])
 @login_required
 def add_position():
-    """添加或更新持仓"""
+    """添加或更新持仓（配额检查同 add_watchlist，在写库前进行）"""
     try:
         user_id = session['user_id']
         data = request.json
@@ -608,7 +886,11 @@ def add_position():
         if not stock_code or quantity <= 0 or cost_price <= 0:
             return jsonify({'success': False, 'message': '参数无效'}), 400
         
-        result = position_service.add_or_update_position(user_id, stock_code, stock_name, quantity, cost_price)
+        with rate_limiter.non_blocking() as quota:
+            stock_service.get_stock_info(stock_code)
+            if quota.rejected:
+                return quota_exceeded(quota)
+            result = position_service.add_or_update_position(user_id, stock_code, stock_name, quantity, cost_price)
         if result:
             return jsonify({'success': True, 'message': '操作成功'})
         else:
@@ -826,10 +1108,13 @@ def init_app():
         config.init_directories()
         print("目录初始化完成！")
         
-        # 启动定时任务
-        print("正在启动定时任务...")
-        scheduler_service.start()
-        print("定时任务启动完成！")
+        # 启动定时任务（standalone模式下由 ingest_worker.py 独立进程运行，Web进程不运行任务）
+        if config.SCHEDULER_MODE == 'standalone':
+            print("定时任务由独立采集进程运行（ingest_worker.py），Web进程不启动定时任务")
+        else:
+            print("正在启动定时任务...")
+            scheduler_service.start()
+            print("定时任务启动完成！")
         
     except Exception as e:
         print(f"初始化失败: {e}")
@@ -0,0 +1,107 @@
+"""
+SQLite连接池基准测试
+对比 stock_daily 读路径在"每次查询新建连接"与"连接池复用"两种方式下的QPS
+
+用法：
+    python bench_db_pool.py [查询次数]
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database.db_manager_sqlite import DatabaseManager
+
+STOCK_CODES = ['600519.SH', '000858.SZ', '688385.SH', '300058.SZ', '601127.SH']
+READ_QUERY = """
+SELECT * FROM stock_daily
+WHERE ts_code = %s
+ORDER BY trade_date DESC
+LIMIT %s
+"""
+
+
+class ConnectPerQueryManager(DatabaseManager):
+    """旧实现：每次查询都新建并关闭连接"""
+
+    def get_connection(self):
+        from contextlib import contextmanager
+
+        @contextmanager
+        def _conn():
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = self.dict_factory
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+            finally:
+                conn.close()
+        return _conn()
+
+
+def prepare_database(db_path, days=365):
+    """生成测试数据"""
+    manager = DatabaseManager(db_path=db_path)
+    manager.init_database()
+
+    start = date.today() - timedelta(days=days)
+    rows = []
+    for ts_code in STOCK_CODES:
+        for i in range(days):
+            trade_date = (start + timedelta(days=i)).strftime('%Y-%m-%d')
+            price = 10 + i * 0.01
+            rows.append((ts_code, trade_date, price, price + 0.5, price - 0.5, price + 0.1, 100000 + i, 1e6 + i))
+
+    manager.execute_many(
+        "INSERT OR REPLACE INTO stock_daily (ts_code, trade_date, open, high, low, close, volume, amount) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+        rows
+    )
+    manager.close_all()
+
+
+def run(manager, iterations, window=60):
+    """执行读查询并返回QPS"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        ts_code = STOCK_CODES[i % len(STOCK_CODES)]
+        manager.execute_query(READ_QUERY, (ts_code, window))
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'bench.db')
+        prepare_database(db_path)
+
+        legacy = ConnectPerQueryManager(db_path=db_path)
+        pooled = DatabaseManager(db_path=db_path)
+
+        # 预热
+        run(legacy, 100)
+        run(pooled, 100)
+
+        legacy_qps = run(legacy, iterations)
+        pooled_qps = run(pooled, iterations)
+        pooled.close_all()
+
+    print("=" * 60)
+    print(f"stock_daily 读路径基准测试（{iterations} 次查询，每次60行）")
+    print("=" * 60)
+    print(f"每次新建连接: {legacy_qps:10.0f} QPS")
+    print(f"连接池复用:   {pooled_qps:10.0f} QPS")
+    print(f"提升:         {pooled_qps / legacy_qps:10.2f} x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+K线/指标批量保存路径基准测试
+对比旧实现（iterrows + 逐行构建字典/元组 + 逐行strftime）与按列转换的新实现
+
+每种规模分别统计：
+- 参数构建耗时（不写库，只测Python侧转换）
+- 实际写入耗时（SQLite临时库；MySQL使用.env配置，连接失败时跳过）
+
+日K的旧路径以fetch返回的字典列表为输入，新路径直接使用fetch返回的DataFrame（不再经过字典列表）
+
+本地SQLite实测（参数构建，旧 -> 新）：
+- 1万行：日K 0.07s -> 0.07s（固定开销为主，无明显差别），指标 0.53s -> 0.02s
+- 100万行：日K 7.5s -> 1.9s，指标 89.4s -> 1.8s
+
+用法：
+    python bench_save_paths.py [行数,行数...]    # 默认 10000,1000000
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+
+from config import config
+from services.stock_service import stock_service
+
+stock_service_module = sys.modules['services.stock_service']
+
+BENCH_PREFIX = 'BENCH'
+
+
+class NullManager:
+    """只接收参数不写库，用于单独测量参数构建耗时"""
+
+    def execute_many(self, query, params_list):
+        return len(params_list)
+
+
+def make_daily(rows):
+    """生成rows行日K（与fetch_daily_data返回格式一致：DataFrame，trade_date为Timestamp）"""
+    days = min(rows, 1000)
+    codes = -(-rows // days)
+    dates = pd.date_range('2020-01-01', periods=days, freq='D')
+    rng = np.random.default_rng(0)
+    close = 10 + rng.random(codes * days)
+    df = pd.DataFrame({
+        'ts_code': np.repeat([f'{BENCH_PREFIX}{i:05d}.SH' for i in range(codes)], days),
+        'trade_date': np.tile(dates, codes),
+        'open': close - 0.1,
+        'high': close + 0.2,
+        'low': close - 0.2,
+        'close': close,
+        'vol': rng.integers(1000, 100000, codes * days).astype(float),
+        'amount': close * 1000
+    }).head(rows)
+    return df
+
+
+def make_indicators(rows):
+    """生成rows行指标（与calculate_indicators输出格式一致）"""
+    dates = pd.date_range('1900-01-01', periods=rows, freq='D')
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({'trade_date': dates, 'close': 10 + rng.random(rows)})
+    for col in stock_service_module.INDICATOR_FIELDS:
+        df[col] = rng.random(rows)
+    return df
+
+
+# ---------- 旧实现（仅构建参数） ----------
+
+def legacy_kline_params(data_list):
+    params_list = []
+    for d in data_list:
+        trade_date = d['trade_date']
+        if hasattr(trade_date, 'strftime'):
+            trade_date = trade_date.strftime('%Y-%m-%d')
+        params_list.append((
+            d['ts_code'], trade_date, d['open'], d['high'], d['low'],
+            d['close'], d.get('vol', 0), d.get('amount', 0)
+        ))
+    return params_list
+
+
+def legacy_indicator_params(stock_code, df):
+    df = df.dropna(subset=['macd', 'macd_signal', 'rsi_6'])
+    data_list = []
+    for _, row in df.iterrows():
+        data_list.append({
+            'ts_code': stock_code,
+            'trade_date': row['trade_date'],
+            'macd': row['macd'],
+            'macd_signal': row['macd_signal'],
+            'macd_hist': row['macd_hist'],
+            'ema_12': row['ema_12'],
+            'ema_26': row['ema_26'],
+            'rsi_6': row['rsi_6'],
+            'rsi_12': row['rsi_12'],
+            'rsi_24': row['rsi_24']
+        })
+    params_list = []
+    for d in data_list:
+        trade_date = d['trade_date']
+        if hasattr(trade_date, 'strftime'):
+            trade_date = trade_date.strftime('%Y-%m-%d')
+        params_list.append((
+            d['ts_code'], trade_date, d['macd'], d['macd_signal'], d['macd_hist'],
+            d['ema_12'], d['ema_26'], d['rsi_6'], d['rsi_12'], d['rsi_24']
+        ))
+    return params_list
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def with_manager(manager, database_type, func, *args):
+    """临时替换stock_service使用的数据库"""
+    original_db = stock_service_module.db_manager
+    original_type = config.DATABASE_TYPE
+    stock_service_module.db_manager = manager
+    config.DATABASE_TYPE = database_type
+    try:
+        return timed(func, *args)
+    finally:
+        stock_service_module.db_manager = original_db
+        config.DATABASE_TYPE = original_type
+
+
+def open_mysql():
+    """连接.env中配置的MySQL，失败返回None"""
+    try:
+        from database.db_manager import DatabaseManager as MySQLManager
+        manager = MySQLManager()
+        manager.execute_query("SELECT 1")
+        return manager
+    except Exception as e:
+        print(f"MySQL不可用，跳过: {e}")
+        return None
+
+
+def cleanup(manager):
+    manager.execute_update("DELETE FROM stock_daily WHERE ts_code LIKE %s", (f'{BENCH_PREFIX}%',))
+    manager.execute_update("DELETE FROM stock_indicators WHERE ts_code = %s", (f'{BENCH_PREFIX}.SH',))
+
+
+def bench_size(rows, backends):
+    daily_df = make_daily(rows)
+    daily_list = daily_df.to_dict('records')
+    indicators = make_indicators(rows)
+    ts_code = f'{BENCH_PREFIX}.SH'
+
+    print(f"\n{rows:,} 行")
+    print("-" * 60)
+    # 旧路径：fetch返回字典列表，逐行构建参数；新路径：fetch返回的DataFrame直接按列转换
+    legacy = timed(legacy_kline_params, daily_list)
+    vectorized = with_manager(NullManager(), 'sqlite', stock_service.save_daily_data, daily_df)
+    print(f"日K参数构建   旧: {legacy:8.3f}s  新: {vectorized:8.3f}s  ({legacy / vectorized:5.1f}x)")
+
+    legacy = timed(legacy_indicator_params, ts_code, indicators)
+    vectorized = with_manager(NullManager(), 'sqlite', stock_service.save_indicators, ts_code, indicators)
+    print(f"指标参数构建  旧: {legacy:8.3f}s  新: {vectorized:8.3f}s  ({legacy / vectorized:5.1f}x)")
+
+    for name, manager, database_type in backends:
+        cleanup(manager)
+        daily = with_manager(manager, database_type, stock_service.save_daily_data, daily_df)
+        indicator = with_manager(manager, database_type, stock_service.save_indicators, ts_code, indicators)
+        cleanup(manager)
+        print(f"{name:6s}写入   日K: {daily:8.3f}s ({rows / daily:10,.0f} 行/秒)  "
+              f"指标: {indicator:8.3f}s ({rows / indicator:10,.0f} 行/秒)")
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 1000000]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        from database.db_manager_sqlite import DatabaseManager as SQLiteManager
+        sqlite_manager = SQLiteManager(db_path=os.path.join(tmp_dir, 'bench.db'))
+        sqlite_manager.init_database()
+        backends = [('SQLite', sqlite_manager, 'sqlite')]
+
+        mysql_manager = open_mysql()
+        if mysql_manager:
+            backends.append(('MySQL', mysql_manager, 'mysql'))
+
+        print("=" * 60)
+        print("批量保存路径基准测试")
+        print("=" * 60)
+        for rows in sizes:
+            bench_size(rows, backends)
+
+        sqlite_manager.close_all()
+        if mysql_manager:
+            mysql_manager.pool.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,19 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _parse_rate_limits(text, defaults):
+    """解析接口配额，格式 'daily:500,pro_bar:2'，覆盖默认值；配额必须为正整数"""
+    limits = dict(defaults)
+    for item in text.split(','):
+        if ':' in item:
+            name, quota = item.split(':', 1)
+            quota = int(quota)
+            if quota <= 0:
+                raise ValueError(f"TUSHARE_RATE_LIMITS 中的配额必须为正整数: {item.strip()}")
+            limits[name.strip()] = quota
+    return limits
+
+
 class Config:
     """应用配置类"""
     
@@ -18,11 +31,34 @@ class Config:
     # Tushare配置
     TUSHARE_TOKEN = os.getenv('TUSHARE_TOKEN', '')
     
+    # Tushare接口限流（每分钟调用次数）
+    TUSHARE_DEFAULT_RATE = int(os.getenv('TUSHARE_DEFAULT_RATE', 200))  # 未单独配置的接口
+    TUSHARE_RATE_LIMITS = _parse_rate_limits(os.getenv('TUSHARE_RATE_LIMITS', ''), {
+        'pro_bar': 2,                 # 分钟K线，每分钟最多2次
+        'get_realtime_quotes': 300,   # 旧版实时行情接口
+    })
+    
     # OpenRouter配置
     OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
+    OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+    OPENROUTER_TIMEOUT = int(os.getenv('OPENROUTER_TIMEOUT', 60))  # 非流式请求总超时；流式请求为两段数据之间的最长等待
+    OPENROUTER_POOL_SIZE = int(os.getenv('OPENROUTER_POOL_SIZE', 8))      # 保持的长连接数（建议不小于AI_WORKERS）
+    OPENROUTER_MAX_RETRIES = int(os.getenv('OPENROUTER_MAX_RETRIES', 2))  # 429/5xx及连接失败时的重试次数
+    OPENROUTER_RETRY_BACKOFF = float(os.getenv('OPENROUTER_RETRY_BACKOFF', 1.0))  # 重试退避基数（秒，指数增长并加随机抖动）
     SITE_URL = os.getenv('SITE_URL', 'https://ai-quant.example.com')
     SITE_NAME = os.getenv('SITE_NAME', 'AI量化股票分析工具')
     
+    # AI任务队列配置（大模型调用在独立线程池中执行）
+    AI_WORKERS = int(os.getenv('AI_WORKERS', 4))                      # 同时进行的大模型调用数
+    AI_QUEUE_SIZE = int(os.getenv('AI_QUEUE_SIZE', 32))               # 排队和运行中的任务上限，超出返回429
+    AI_USER_CONCURRENCY = int(os.getenv('AI_USER_CONCURRENCY', 2))    # 每个用户未完成的任务上限
+    AI_JOB_RESULT_TTL = int(os.getenv('AI_JOB_RESULT_TTL', 600))      # 任务结果保留秒数（供轮询）
+    AI_SYNC_WAIT_SECONDS = float(os.getenv('AI_SYNC_WAIT_SECONDS', 10))  # 同步请求最长等待秒数，超时返回任务ID
+    AI_RESPONSE_CACHE = os.getenv('AI_RESPONSE_CACHE', 'True').lower() == 'true'  # 相同提示词复用AI回复（到下一交易日开盘失效）
+    AI_EXPANSION_CACHE_SIZE = int(os.getenv('AI_EXPANSION_CACHE_SIZE', '256'))  # 提示词变量展开结果缓存条数
+    AI_EXPANSION_CACHE_TTL = int(os.getenv('AI_EXPANSION_CACHE_TTL', '600'))  # 展开结果最长保留秒数（数据写入时立即失效）
+    AI_VARIABLE_WORKERS = int(os.getenv('AI_VARIABLE_WORKERS', '4'))  # 提示词变量数据并行查询的线程数
+    
     # 数据库配置
     DATABASE_TYPE = os.getenv('DATABASE_TYPE', 'mysql')  # mysql 或 sqlite
     
@@ -33,6 +69,58 @@ class Config:
     MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
     MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'quanti_stock')
     
+    # MySQL连接池配置
+    MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', 5))                 # 常驻连接数
+    MYSQL_POOL_MAX_OVERFLOW = int(os.getenv('MYSQL_POOL_MAX_OVERFLOW', 10))  # 高峰期额外连接数
+    MYSQL_POOL_IDLE_TIMEOUT = int(os.getenv('MYSQL_POOL_IDLE_TIMEOUT', 300))  # 空闲连接回收秒数
+    MYSQL_POOL_TIMEOUT = float(os.getenv('MYSQL_POOL_TIMEOUT', 30))        # 等待可用连接的秒数
+    
+    # SQLite连接池配置
+    SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 8))           # 最多保留的空闲连接数
+    SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 30))  # 等待写锁的秒数
+    SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 32768))  # 每个连接的页缓存（KB）
+    
+    # K线批量更新配置
+    KLINE_BATCH_MAX_GAP_DAYS = int(os.getenv('KLINE_BATCH_MAX_GAP_DAYS', 10))  # 落后超过该天数的股票改为逐只补数
+    
+    # 股票基本信息缓存配置（get_stock_info）
+    STOCK_INFO_CACHE_SIZE = int(os.getenv('STOCK_INFO_CACHE_SIZE', 4096))          # 最多缓存的股票数
+    STOCK_INFO_CACHE_TTL = int(os.getenv('STOCK_INFO_CACHE_TTL', 21600))           # 有效期（秒）
+    STOCK_INFO_NEGATIVE_TTL = int(os.getenv('STOCK_INFO_NEGATIVE_TTL', 600))       # 不存在的代码的缓存秒数
+    
+    # 证券主表配置
+    SECURITY_MASTER_MAX_AGE_HOURS = int(os.getenv('SECURITY_MASTER_MAX_AGE_HOURS', 24))  # 超过该小时数重新批量拉取
+    
+    # K线/指标接口响应缓存配置
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 512))                 # 最多缓存的响应数
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 3600))                  # 响应最长缓存秒数
+    DATA_VERSION_SYNC_SECONDS = float(os.getenv('DATA_VERSION_SYNC_SECONDS', 5))     # 检查其他进程写入的间隔
+    
+    # 实时行情批量刷新配置
+    REALTIME_CHUNK_SIZE = int(os.getenv('REALTIME_CHUNK_SIZE', 50))          # 每次请求的股票数
+    REALTIME_WORKERS = int(os.getenv('REALTIME_WORKERS', 4))                 # 并发请求线程数
+    
+    # 实时行情推送（SSE）配置
+    QUOTE_STREAM_POLL_SECONDS = float(os.getenv('QUOTE_STREAM_POLL_SECONDS', 5))       # 检查其他进程写入的间隔
+    QUOTE_STREAM_HEARTBEAT_SECONDS = float(os.getenv('QUOTE_STREAM_HEARTBEAT_SECONDS', 15))  # 无数据时的保活间隔
+    QUOTE_STREAM_MAX_CODES = int(os.getenv('QUOTE_STREAM_MAX_CODES', 50))             # 单个连接最多订阅的股票数
+    
+    # 定时任务触发时间（Cron表达式：分 时 日 月 周）
+    SCHEDULER_REALTIME_CRON = os.getenv('SCHEDULER_REALTIME_CRON', '* * * * *')  # 实时股价：每分钟（仅交易时段）
+    SCHEDULER_KLINE_CRON = os.getenv('SCHEDULER_KLINE_CRON', '30 16 * * *')      # 日K/周K：收盘后（非交易日自动跳过）
+    SCHEDULER_SECURITY_CRON = os.getenv('SCHEDULER_SECURITY_CRON', '0 8 * * *')   # 证券主表：每天开盘前
+    
+    # 交易日历离线文件（接口不可用时使用）
+    TRADE_CALENDAR_FILE = os.getenv('TRADE_CALENDAR_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'trade_calendar.json'))
+    
+    # 定时任务线程池配置
+    SCHEDULER_REALTIME_WORKERS = int(os.getenv('SCHEDULER_REALTIME_WORKERS', 4))  # 实时行情通道并发数
+    SCHEDULER_KLINE_WORKERS = int(os.getenv('SCHEDULER_KLINE_WORKERS', 4))        # K线通道并发数
+    
+    # 定时任务运行方式：embedded（Web进程内启动）或 standalone（只由 ingest_worker.py 独立进程运行）
+    SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'embedded')
+    INGEST_LEASE_TTL = int(os.getenv('INGEST_LEASE_TTL', 90))  # 采集进程分片租约有效期（秒）
+    
     # 数据库连接字符串
     @property
     def DATABASE_URI(self):
@@ -0,0 +1,38 @@
+"""
+测试公共夹具
+"""
+import os
+import sys
+from types import ModuleType
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import database
+from config import config
+from database.db_manager_sqlite import DatabaseManager
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """临时SQLite数据库
+
+    替换所有已导入模块中的全局 db_manager（包括 database 包本身，函数内延迟导入的也会拿到临时库），
+    测试结束后恢复，真实的 data/quanti_stock.db 不会被写入
+    """
+    manager = DatabaseManager(db_path=str(tmp_path / 'test.db'))
+    manager.init_database()
+    monkeypatch.setattr(config, 'DATABASE_TYPE', 'sqlite')
+
+    # 导入 database.db_manager 子模块（MySQL实现）后，包属性 db_manager 会被子模块覆盖，
+    # 因此按"不是模块"判断全局实例，而不是与 database.db_manager 比较
+    monkeypatch.setattr(database, 'db_manager', manager)
+    for module in list(sys.modules.values()):
+        value = getattr(module, 'db_manager', None)
+        if value is not None and not isinstance(value, ModuleType):
+            monkeypatch.setattr(module, 'db_manager', manager)
+
+    yield manager
+    monkeypatch.undo()
+    manager.close_all()
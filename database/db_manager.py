@@ -2,15 +2,129 @@
 数据库管理模块
 """
 import pymysql
-from pymysql.cursors import DictCursor
+import threading
+import time
+from collections import deque
+from pymysql.cursors import Cursor, DictCursor
 from contextlib import contextmanager
 from config import config
+from .rows import check_row_mode, to_columns
+
+
+class PoolTimeoutError(Exception):
+    """连接池等待超时"""
+    pass
+
+
+class ConnectionPool:
+    """MySQL连接池
+    
+    - pool_size: 常驻连接数，归还后保留在空闲队列
+    - max_overflow: 高峰期允许额外创建的连接数，归还时若空闲队列已满则直接关闭
+    - idle_timeout: 空闲超过该秒数的连接在取出时丢弃重建（避免被服务端wait_timeout断开）
+    - ping_on_checkout: 取出连接时ping检测，失效则重建
+    - checkout_timeout: 连接数达到上限时等待归还的最长秒数
+    """
+    
+    def __init__(self, factory, pool_size=5, max_overflow=10, idle_timeout=300,
+                 checkout_timeout=30, ping_on_checkout=True):
+        self.factory = factory
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.ping_on_checkout = ping_on_checkout
+        
+        self._idle = deque()   # (conn, 归还时间)
+        self._opened = 0       # 当前已打开的连接总数（空闲 + 使用中）
+        self._cond = threading.Condition()
+    
+    def _is_alive(self, conn):
+        """检测连接是否可用"""
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+    
+    def _discard(self, conn):
+        """关闭连接并释放名额（调用方需持有锁）"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._opened -= 1
+        self._cond.notify()
+    
+    def acquire(self):
+        """取出连接"""
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn, released_at = self._idle.pop()
+                    if self.idle_timeout and time.monotonic() - released_at > self.idle_timeout:
+                        self._discard(conn)
+                        continue
+                    if self.ping_on_checkout and not self._is_alive(conn):
+                        self._discard(conn)
+                        continue
+                    return conn
+                
+                if self._opened < self.pool_size + self.max_overflow:
+                    self._opened += 1
+                    break
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"获取数据库连接超时（{self.checkout_timeout}秒，"
+                        f"连接数已达上限 {self.pool_size + self.max_overflow}）"
+                    )
+                self._cond.wait(remaining)
+        
+        # 在锁外建立连接，避免阻塞其他线程
+        try:
+            return self.factory()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+    
+    def release(self, conn, discard=False):
+        """归还连接"""
+        with self._cond:
+            if discard or len(self._idle) >= self.pool_size:
+                self._discard(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+    
+    def dispose(self):
+        """关闭所有空闲连接"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+    
+    def status(self):
+        """连接池状态"""
+        with self._cond:
+            return {
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'opened': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._opened - len(self._idle)
+            }
 
 
 class DatabaseManager:
     """数据库管理器"""
     
-    def __init__(self):
+    def __init__(self, connection_factory=None, pool_size=None, max_overflow=None,
+                 idle_timeout=None, checkout_timeout=None):
         self.config = {
             'host': config.MYSQL_HOST,
             'port': config.MYSQL_PORT,
@@ -20,28 +134,65 @@ class DatabaseManager:
             'charset': 'utf8mb4',
             'cursorclass': DictCursor
         }
+        
+        # connection_factory 可替换为测试用的假连接
+        self.pool = ConnectionPool(
+            connection_factory or (lambda: pymysql.connect(**self.config)),
+            pool_size=pool_size or config.MYSQL_POOL_SIZE,
+            max_overflow=config.MYSQL_POOL_MAX_OVERFLOW if max_overflow is None else max_overflow,
+            idle_timeout=config.MYSQL_POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout,
+            checkout_timeout=checkout_timeout or config.MYSQL_POOL_TIMEOUT
+        )
+        self._local = threading.local()
     
     @contextmanager
     def get_connection(self):
         """获取数据库连接上下文管理器"""
-        conn = pymysql.connect(**self.config)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # 同一线程内嵌套调用，复用外层连接，由外层负责提交
+            yield conn
+            return
+        
+        conn = self.pool.acquire()
+        self._local.conn = conn
+        broken = False
         try:
             yield conn
             conn.commit()
         except Exception as e:
-            conn.rollback()
+            try:
+                conn.rollback()
+            except Exception:
+                # 回滚失败说明连接已断开，不再放回池中
+                broken = True
+            if isinstance(e, pymysql.err.OperationalError):
+                broken = True
             raise e
         finally:
-            conn.close()
+            self._local.conn = None
+            self.pool.release(conn, discard=broken)
     
-    def execute_query(self, query, params=None, fetch_one=False):
-        """执行查询并返回结果"""
+    def execute_query(self, query, params=None, fetch_one=False, row_mode='dict'):
+        """执行查询并返回结果
+        
+        Args:
+            row_mode: 行格式，'dict'（默认）、'tuple' 或 'columns'，见 database/rows.py
+        """
+        check_row_mode(row_mode)
         with self.get_connection() as conn:
-            with conn.cursor() as cursor:
+            cursor_class = DictCursor if row_mode == 'dict' else Cursor
+            with conn.cursor(cursor_class) as cursor:
                 cursor.execute(query, params or ())
                 if fetch_one:
-                    return cursor.fetchone()
-                return cursor.fetchall()
+                    row = cursor.fetchone()
+                    if row_mode == 'columns':
+                        return to_columns(cursor.description, [row] if row else [])
+                    return row
+                rows = cursor.fetchall()
+                if row_mode == 'columns':
+                    return to_columns(cursor.description, rows)
+                return rows
     
     def execute_update(self, query, params=None):
         """执行更新操作"""
@@ -135,6 +286,88 @@ class DatabaseManager:
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
                 """)
                 
+                # 增量指标引擎状态表（EMA、RSI滚动窗口等）
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS indicator_state (
+                    ts_code VARCHAR(20) PRIMARY KEY,
+                    last_trade_date DATE NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                # K线/指标数据版本表（接口响应缓存失效判断）
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS kline_versions (
+                    ts_code VARCHAR(20) PRIMARY KEY,
+                    updated_at DOUBLE NOT NULL,
+                    INDEX idx_updated_at (updated_at)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                # 持仓/资金数据版本表（AI提示词变量展开缓存失效判断）
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS position_versions (
+                    user_id INT PRIMARY KEY,
+                    updated_at DOUBLE NOT NULL,
+                    INDEX idx_updated_at (updated_at)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                # AI响应缓存表（相同模型、参数和消息的回复）
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ai_response_cache (
+                    cache_key CHAR(64) PRIMARY KEY,
+                    model VARCHAR(100),
+                    response LONGTEXT NOT NULL,
+                    created_at DOUBLE NOT NULL,
+                    expires_at DOUBLE NOT NULL,
+                    hits INT DEFAULT 0,
+                    INDEX idx_expires_at (expires_at)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                # 证券主表（A股、指数、ETF基本信息，每日批量刷新）
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS securities (
+                    ts_code VARCHAR(20) PRIMARY KEY,
+                    symbol VARCHAR(20) NOT NULL,
+                    name VARCHAR(100),
+                    cnspell VARCHAR(50),
+                    type VARCHAR(10) NOT NULL,
+                    area VARCHAR(50),
+                    industry VARCHAR(50),
+                    market VARCHAR(50),
+                    publisher VARCHAR(100),
+                    category VARCHAR(50),
+                    management VARCHAR(100),
+                    fund_type VARCHAR(50),
+                    issue_date VARCHAR(8),
+                    list_date VARCHAR(8),
+                    updated_at DATETIME NOT NULL,
+                    INDEX idx_symbol (symbol),
+                    INDEX idx_name (name),
+                    INDEX idx_cnspell (cnspell)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                # 采集进程心跳表与分片租约表（独立采集进程瓜分自选股）
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_workers (
+                    worker_id VARCHAR(100) PRIMARY KEY,
+                    heartbeat_at DOUBLE NOT NULL
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_leases (
+                    ts_code VARCHAR(20) PRIMARY KEY,
+                    worker_id VARCHAR(100) NOT NULL,
+                    expires_at DOUBLE NOT NULL,
+                    INDEX idx_worker_id (worker_id)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
                 # 持仓数据表（添加user_id）
                 cursor.execute("""
                 CREATE TABLE IF NOT EXISTS positions (
@@ -3,21 +3,39 @@ SQLite数据库管理模块 - 轻量级替代方案
 适用于开发、测试环境，无需安装MySQL服务
 """
 import sqlite3
+import threading
 from contextlib import contextmanager
 from config import config
+from .rows import check_row_mode, to_columns
 import os
 
 
 class DatabaseManager:
-    """SQLite数据库管理器"""
+    """SQLite数据库管理器
     
-    def __init__(self):
+    连接池说明：
+    - 连接在首次使用时创建，用完归还到空闲池，不再每次查询都重新打开
+    - 同一线程内嵌套使用 get_connection 会复用同一个连接（只在最外层提交）
+    - 连接创建时统一配置 WAL、synchronous=NORMAL 和页缓存大小
+    - 不使用共享缓存模式（cache=shared）：共享缓存下连接之间改为表级锁，并发写入直接报
+      "database table is locked" 而不等待 busy_timeout，也抵消了WAL读写并发的好处；
+      池中的连接长期复用（后进先出），各自的页缓存保持热度，效果相当
+    """
+    
+    def __init__(self, db_path=None, pool_size=None):
         # 创建数据目录
         self.db_dir = os.path.join(config.BASE_DIR, 'data')
         os.makedirs(self.db_dir, exist_ok=True)
         
         # 数据库文件路径
-        self.db_path = os.path.join(self.db_dir, 'quanti_stock.db')
+        self.db_path = db_path or os.path.join(self.db_dir, 'quanti_stock.db')
+        
+        # 连接池
+        self.pool_size = pool_size or config.SQLITE_POOL_SIZE
+        self._idle = []                    # 空闲连接（后进先出，保持缓存热度）
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()    # 当前线程正在使用的连接及嵌套深度
+        self._wal_ready = False
         
         print(f"SQLite数据库路径: {self.db_path}")
     
@@ -28,11 +46,65 @@ class DatabaseManager:
             d[col[0]] = row[idx]
         return d
     
+    def _create_connection(self):
+        """创建新连接并配置PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=config.SQLITE_BUSY_TIMEOUT,
+            check_same_thread=False  # 连接会在线程间复用，但同一时刻只归一个线程使用
+        )
+        conn.row_factory = self.dict_factory
+        
+        # WAL是数据库文件级别的持久设置，只需设置一次（多个线程可能同时创建第一批连接，在锁内检查）
+        with self._pool_lock:
+            if not self._wal_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                self._wal_ready = True
+        
+        # 以下是连接级别的设置
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def _checkout(self):
+        """从连接池取出连接"""
+        with self._pool_lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._create_connection()
+    
+    def _checkin(self, conn):
+        """归还连接到连接池，超出池大小的连接直接关闭"""
+        with self._pool_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+    
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+    
     @contextmanager
     def get_connection(self):
         """获取数据库连接上下文管理器"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = self.dict_factory
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # 同一线程内嵌套调用，复用外层连接，由外层负责提交
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
         try:
             yield conn
             conn.commit()
@@ -40,19 +112,38 @@ class DatabaseManager:
             conn.rollback()
             raise e
         finally:
-            conn.close()
+            # 防止未完成的事务随连接回到池中
+            if conn.in_transaction:
+                conn.rollback()
+            self._local.conn = None
+            self._local.depth = 0
+            self._checkin(conn)
     
-    def execute_query(self, query, params=None, fetch_one=False):
-        """执行查询并返回结果"""
+    def execute_query(self, query, params=None, fetch_one=False, row_mode='dict'):
+        """执行查询并返回结果
+        
+        Args:
+            row_mode: 行格式，'dict'（默认）、'tuple' 或 'columns'，见 database/rows.py
+        """
+        check_row_mode(row_mode)
         # 转换MySQL占位符 %s 为 SQLite 占位符 ?
         query = query.replace('%s', '?')
         
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            if row_mode != 'dict':
+                # 跳过Python层的dict_factory，直接使用C层构建的元组
+                cursor.row_factory = None
             cursor.execute(query, params or ())
             if fetch_one:
-                return cursor.fetchone()
-            return cursor.fetchall()
+                row = cursor.fetchone()
+                if row_mode == 'columns':
+                    return to_columns(cursor.description, [row] if row else [])
+                return row
+            rows = cursor.fetchall()
+            if row_mode == 'columns':
+                return to_columns(cursor.description, rows)
+            return rows
     
     def execute_update(self, query, params=None):
         """执行更新操作"""
@@ -232,6 +323,100 @@ class DatabaseManager:
             ON stock_indicators(ts_code)
             """)
             
+            # 增量指标引擎状态表（EMA、RSI滚动窗口等）
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS indicator_state (
+                ts_code TEXT PRIMARY KEY,
+                last_trade_date DATE NOT NULL,
+                state TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            
+            # 证券主表（A股、指数、ETF基本信息，每日批量刷新）
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS securities (
+                ts_code TEXT PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                name TEXT,
+                cnspell TEXT,
+                type TEXT NOT NULL,
+                area TEXT,
+                industry TEXT,
+                market TEXT,
+                publisher TEXT,
+                category TEXT,
+                management TEXT,
+                fund_type TEXT,
+                issue_date TEXT,
+                list_date TEXT,
+                updated_at TIMESTAMP NOT NULL
+            )
+            """)
+            
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_securities_symbol ON securities(symbol)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_securities_name ON securities(name)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_securities_cnspell ON securities(cnspell)")
+            
+            # 采集进程心跳表与分片租约表（独立采集进程瓜分自选股）
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            )
+            """)
+            
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_leases (
+                ts_code TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+            
+            # K线/指标数据版本表（接口响应缓存失效判断）
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS kline_versions (
+                ts_code TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            )
+            """)
+            
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_kline_versions_updated_at 
+            ON kline_versions(updated_at)
+            """)
+            
+            # 持仓/资金数据版本表（AI提示词变量展开缓存失效判断）
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS position_versions (
+                user_id INTEGER PRIMARY KEY,
+                updated_at REAL NOT NULL
+            )
+            """)
+            
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_position_versions_updated_at 
+            ON position_versions(updated_at)
+            """)
+            
+            # AI响应缓存表（相同模型、参数和消息的回复）
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ai_response_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                hits INTEGER DEFAULT 0
+            )
+            """)
+            
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ai_response_cache_expires_at 
+            ON ai_response_cache(expires_at)
+            """)
+            
             # 实时股价表（扩展版）
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS stock_realtime (
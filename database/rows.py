@@ -0,0 +1,30 @@
+"""
+查询结果行格式
+
+- dict: 每行一个字典（默认，兼容旧代码）
+- tuple: 数据库驱动原生元组，按SELECT列顺序访问，无额外构建开销
+- columns: 列式结果 {列名: [值, ...]}，适合整列转换为NumPy/pandas
+"""
+
+ROW_MODES = ('dict', 'tuple', 'columns')
+
+
+def check_row_mode(row_mode):
+    """校验行格式参数"""
+    if row_mode not in ROW_MODES:
+        raise ValueError(f"不支持的row_mode: {row_mode}，可选: {', '.join(ROW_MODES)}")
+
+
+def to_columns(description, rows):
+    """将元组行转换为列式结果"""
+    names = [col[0] for col in description] if description else []
+    if not rows:
+        return {name: [] for name in names}
+    return {name: list(values) for name, values in zip(names, zip(*rows))}
+
+
+def column_length(columns):
+    """列式结果的行数"""
+    for values in columns.values():
+        return len(values)
+    return 0
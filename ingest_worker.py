@@ -0,0 +1,71 @@
+"""
+独立数据采集进程
+与Web进程分离运行定时任务（实时股价、日K/周K），可启动多个进程水平扩展：
+
+    python ingest_worker.py                 # 单个采集进程
+    python ingest_worker.py --processes 4   # 本机启动4个采集进程
+
+各进程通过数据库租约表（ingest_leases）瓜分自选股，每只股票同一时刻只由一个进程更新；
+进程退出后其租约被释放或过期，由其余进程接手。
+配合 SCHEDULER_MODE=standalone 使用，Web进程不再运行定时任务。
+注意：Tushare限流按进程计算，多进程时请按进程数调低 TUSHARE_RATE_LIMITS。
+"""
+import argparse
+import multiprocessing
+import signal
+import threading
+
+
+def run_worker(worker_id=None):
+    """运行一个采集进程，直到收到 SIGINT/SIGTERM"""
+    # 在子进程内导入，避免父进程创建的数据库连接被子进程继承
+    from database import db_manager
+    from services.ingest_lease_service import IngestLeaseService
+    from services.scheduler_service import SchedulerService
+
+    db_manager.init_database()
+    shard = IngestLeaseService(worker_id)
+    scheduler = SchedulerService(shard=shard)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    signal.signal(signal.SIGINT, lambda *args: stopped.set())
+
+    print(f"🚀 采集进程已启动: {shard.worker_id}")
+    scheduler.start()
+    try:
+        stopped.wait()
+    finally:
+        scheduler.stop()
+        print(f"采集进程已退出: {shard.worker_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='独立数据采集进程')
+    parser.add_argument('--processes', type=int, default=1, help='本机启动的采集进程数')
+    parser.add_argument('--worker-id', help='进程标识（仅单进程时有效），默认 主机名:进程号')
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.worker_id)
+        return
+
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=run_worker, name=f'ingest-{i}') for i in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    # 父进程转发退出信号给子进程
+    def terminate(*args):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
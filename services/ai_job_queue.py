@@ -0,0 +1,198 @@
+"""
+AI任务队列
+大模型调用（每次可达数十秒）在独立的线程池中执行，不占用Web线程：
+- 队列有界：排队和运行中的任务总数不超过 AI_QUEUE_SIZE，超出时拒绝（接口返回429）
+- 按用户限制并发：每个用户未完成的任务不超过 AI_USER_CONCURRENCY
+- 任务结果保留 AI_JOB_RESULT_TTL 秒，供按任务ID轮询
+任务函数返回生成器时（流式对话）逐段记录输出，可在完成前读取已生成的部分
+"""
+import inspect
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import config
+from utils.logger import ai_logger
+
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class AIJobRejected(Exception):
+    """AI任务队列已满或用户并发任务过多"""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AIJob:
+    """一个AI任务"""
+
+    def __init__(self, user_id, kind):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.status = QUEUED
+        self.chunks = []          # 流式任务已生成的文本
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self):
+        def fmt(ts):
+            return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts else None
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'partial': ''.join(self.chunks) if self.chunks and not self.finished else None,
+            'created_at': fmt(self.created_at),
+            'started_at': fmt(self.started_at),
+            'finished_at': fmt(self.finished_at),
+        }
+
+
+class AIJobQueue:
+    """有界的AI任务线程池"""
+
+    def __init__(self, workers=None, max_pending=None, per_user=None, result_ttl=None):
+        self.workers = workers or config.AI_WORKERS
+        self.max_pending = max_pending or config.AI_QUEUE_SIZE
+        self.per_user = per_user or config.AI_USER_CONCURRENCY
+        self.result_ttl = config.AI_JOB_RESULT_TTL if result_ttl is None else result_ttl
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ai-job')
+        self._cond = threading.Condition()
+        self._jobs = {}           # job_id -> AIJob（含已完成、未过期的任务）
+        self.stats = {'submitted': 0, 'rejected': 0, 'failed': 0}
+
+    def _prune(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, user_id, kind, func, *args, **kwargs):
+        """提交任务，立即返回任务ID
+
+        Raises:
+            AIJobRejected: 队列已满或该用户未完成的任务过多
+        """
+        with self._cond:
+            self._prune(time.time())
+            pending = [job for job in self._jobs.values() if not job.finished]
+            if len(pending) >= self.max_pending:
+                self.stats['rejected'] += 1
+                raise AIJobRejected(f'AI服务繁忙（{len(pending)}个任务排队中），请稍后重试')
+            if sum(1 for job in pending if job.user_id == user_id) >= self.per_user:
+                self.stats['rejected'] += 1
+                raise AIJobRejected(f'您已有{self.per_user}个AI任务在处理中，请等待完成后再试')
+            job = AIJob(user_id, kind)
+            self._jobs[job.id] = job
+            self.stats['submitted'] += 1
+
+        self.executor.submit(self._run, job, func, args, kwargs)
+        return job.id
+
+    def _run(self, job, func, args, kwargs):
+        with self._cond:
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            result = func(*args, **kwargs)
+            if inspect.isgenerator(result):
+                for chunk in result:
+                    with self._cond:
+                        job.chunks.append(chunk)
+                        self._cond.notify_all()
+                result = ''.join(job.chunks)
+            with self._cond:
+                job.result = result
+                job.status = DONE
+        except Exception as e:
+            ai_logger.error(f"AI任务执行失败: {job.kind} {job.id}", exc_info=True)
+            with self._cond:
+                job.error = str(e)
+                job.status = FAILED
+                self.stats['failed'] += 1
+        finally:
+            with self._cond:
+                job.finished_at = time.time()
+                self._cond.notify_all()
+
+    def _find(self, job_id, user_id):
+        job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job.user_id != user_id):
+            return None
+        return job
+
+    def get(self, job_id, user_id=None):
+        """任务状态；指定user_id时只能查看自己的任务"""
+        with self._cond:
+            job = self._find(job_id, user_id)
+            return job.to_dict() if job else None
+
+    def wait(self, job_id, timeout=None):
+        """等待任务完成并返回任务状态（超时返回当前状态；任务不存在或已过期返回None）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            while not job.finished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return job.to_dict()
+
+    def follow(self, job_id):
+        """逐段返回流式任务生成的文本，直到任务结束（任务不存在或已过期时直接结束）
+
+        Yields:
+            str: 增量文本
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return
+        sent = 0
+        while True:
+            with self._cond:
+                while sent == len(job.chunks) and not job.finished:
+                    self._cond.wait()
+                chunks = job.chunks[sent:]
+                finished = job.finished
+            sent += len(chunks)
+            yield from chunks
+            if finished:
+                return
+
+    def status(self):
+        with self._cond:
+            jobs = list(self._jobs.values())
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'per_user': self.per_user,
+                'queued': sum(1 for job in jobs if job.status == QUEUED),
+                'running': sum(1 for job in jobs if job.status == RUNNING),
+                **self.stats,
+            }
+
+
+# 创建全局AI任务队列
+ai_job_queue = AIJobQueue()
@@ -0,0 +1,127 @@
+"""
+AI响应缓存
+相同的提示词（同一模版作用于同一股票、同一交易日的变量展开）不再重复调用付费的大模型：
+- 缓存键：模型、temperature、max_tokens 和规范化后的消息列表的SHA-256
+  （变量替换后的行情/指标数据在消息中，数据变化时键随之变化）
+- 存储在 ai_response_cache 表，跨用户、跨进程共享
+- 有效期到下一个交易日开盘，之后的分析应基于新一天的数据
+只缓存成功的回复；请求可以指定不使用缓存
+"""
+import hashlib
+import json
+import threading
+import time
+from config import config
+from database import db_manager
+from services.trading_calendar import trading_calendar
+from utils.logger import ai_logger
+
+
+def _normalize_text(text):
+    """合并空白，避免仅空格/换行不同的提示词产生不同的键"""
+    return ' '.join(text.split())
+
+
+def normalize_messages(messages):
+    """规范化消息列表：去掉空消息（如空的system提示），文本合并空白"""
+    normalized = []
+    for msg in messages:
+        content = msg.get('content')
+        if isinstance(content, str):
+            content = _normalize_text(content)
+        elif isinstance(content, list):
+            content = [dict(part, text=_normalize_text(part['text'])) if part.get('type') == 'text' else part
+                       for part in content]
+        if content:
+            normalized.append({'role': msg.get('role'), 'content': content})
+    return normalized
+
+
+class AIResponseCache:
+    """数据库中的AI回复缓存"""
+
+    def __init__(self, enabled=None):
+        self.enabled = config.AI_RESPONSE_CACHE if enabled is None else enabled
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+    @staticmethod
+    def key(model, temperature, max_tokens, messages):
+        raw = json.dumps({
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'messages': normalize_messages(messages),
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        """未过期的缓存回复，没有时返回None"""
+        if not self.enabled:
+            return None
+        try:
+            row = db_manager.execute_query(
+                "SELECT response FROM ai_response_cache WHERE cache_key = %s AND expires_at > %s",
+                (key, time.time()), fetch_one=True
+            )
+            if row is None:
+                self._count('misses')
+                return None
+            db_manager.execute_update("UPDATE ai_response_cache SET hits = hits + 1 WHERE cache_key = %s", (key,))
+        except Exception as e:
+            # 缓存不可用时直接调用模型
+            ai_logger.warning(f"读取AI响应缓存失败: {e}")
+            return None
+        self._count('hits')
+        ai_logger.info(f"AI响应缓存命中: {key[:12]}")
+        return row['response']
+
+    def set(self, key, model, response, expires_at=None):
+        """保存回复，默认到下一个交易日开盘过期"""
+        if not self.enabled or not response:
+            return
+        now = time.time()
+        if expires_at is None:
+            expires_at = trading_calendar.next_session_start().timestamp()
+        if config.DATABASE_TYPE == 'sqlite':
+            query = """
+            INSERT OR REPLACE INTO ai_response_cache (cache_key, model, response, created_at, expires_at, hits)
+            VALUES (%s, %s, %s, %s, %s, 0)
+            """
+        else:
+            query = """
+            INSERT INTO ai_response_cache (cache_key, model, response, created_at, expires_at, hits)
+            VALUES (%s, %s, %s, %s, %s, 0)
+            ON DUPLICATE KEY UPDATE model = VALUES(model), response = VALUES(response),
+            created_at = VALUES(created_at), expires_at = VALUES(expires_at), hits = 0
+            """
+        try:
+            db_manager.execute_update(query, (key, model, response, now, expires_at))
+            # 顺带清理过期的缓存
+            db_manager.execute_update("DELETE FROM ai_response_cache WHERE expires_at <= %s", (now,))
+        except Exception as e:
+            ai_logger.warning(f"写入AI响应缓存失败: {e}")
+            return
+        self._count('stores')
+
+    def status(self):
+        with self._lock:
+            data = {'enabled': self.enabled, **self.stats}
+        try:
+            row = db_manager.execute_query(
+                "SELECT COUNT(*) AS entries, SUM(hits) AS total_hits FROM ai_response_cache WHERE expires_at > %s",
+                (time.time(),), fetch_one=True
+            )
+            data['entries'] = row['entries']
+            data['total_hits'] = int(row['total_hits'] or 0)
+        except Exception as e:
+            ai_logger.warning(f"读取AI响应缓存统计失败: {e}")
+        return data
+
+
+# 创建全局AI响应缓存实例
+ai_response_cache = AIResponseCache()
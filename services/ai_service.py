@@ -4,11 +4,36 @@ AI服务模块 - OpenRouter API集成
 import requests
 import json
 import os
-import re
+import random
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from requests.adapters import HTTPAdapter
 from config import config
 from database import db_manager
+from database.rows import column_length
+from services.ai_response_cache import ai_response_cache
+from services.data_versions import data_versions
+from services.prompt_template import compile_template, render
 from utils.logger import ai_logger
+from utils.ttl_cache import TTLCache
+
+
+# 需要重试的HTTP状态码（限流、网关错误、服务暂不可用）
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# 服务端 Retry-After 的最长等待秒数
+MAX_RETRY_AFTER = 30
+
+# 保留的最近请求明细条数
+RECENT_ATTEMPTS = 50
+
+# 流式回复正常结束的 finish_reason（length 为达到 max_tokens，与非流式回复一样可以缓存）
+NORMAL_FINISH_REASONS = ('stop', 'length')
 
 
 class AIService:
@@ -17,7 +42,7 @@ class AIService:
     def __init__(self):
         # OpenRouter配置
         self.api_key = config.OPENROUTER_API_KEY
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.api_url = config.OPENROUTER_API_URL
         self.site_url = config.SITE_URL or "https://ai-quant.example.com"
         self.site_name = config.SITE_NAME or "AI量化股票分析工具"
         
@@ -26,6 +51,22 @@ class AIService:
         
         self.prompt_history_dir = os.path.join(config.BASE_DIR, 'prompt_history')
         
+        # 共享的HTTP会话：连接池复用到OpenRouter的长连接（keep-alive），省去每次的DNS/TCP/TLS握手
+        self.max_retries = config.OPENROUTER_MAX_RETRIES
+        self.retry_backoff = config.OPENROUTER_RETRY_BACKOFF
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.OPENROUTER_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._http_lock = threading.Lock()
+        self._http_stats = {'requests': 0, 'attempts': 0, 'retries': 0, 'errors': 0, 'statuses': {}}
+        self._recent_attempts = deque(maxlen=RECENT_ATTEMPTS)
+        
+        # 提示词变量展开缓存：(变量, 股票, 数据版本) -> 展开结果；写入新K线/指标或持仓后版本变化即失效
+        self.expansion_cache = TTLCache(maxsize=config.AI_EXPANSION_CACHE_SIZE, ttl=config.AI_EXPANSION_CACHE_TTL)
+        # 一个提示词中相互独立的数据源（不同K线、持仓、实时行情）并行查询
+        self.variable_executor = ThreadPoolExecutor(max_workers=config.AI_VARIABLE_WORKERS, thread_name_prefix='ai-variables')
+        
         # 确保prompt_history目录存在
         os.makedirs(self.prompt_history_dir, exist_ok=True)
         
@@ -89,7 +130,7 @@ class AIService:
             ai_logger.error(f"检查模型vision支持失败: {e}")
             return False
     
-    def chat(self, messages, model=None, temperature=0.7, max_tokens=2000):
+    def chat(self, messages, model=None, temperature=0.7, max_tokens=2000, use_cache=True):
         """调用OpenRouter API进行对话
         
         Args:
@@ -97,11 +138,18 @@ class AIService:
             model: 模型ID，如果为None则使用默认模型
             temperature: 温度参数
             max_tokens: 最大token数
+            use_cache: 是否使用AI响应缓存（相同提示词直接返回之前的回复）
         """
         # 如果没有指定模型，使用默认模型
         if not model:
             model = self.default_model
         
+        cache_key = ai_response_cache.key(model, temperature, max_tokens, messages) if use_cache else None
+        if cache_key:
+            cached = ai_response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
         ai_logger.debug(f"调用OpenRouter API, 模型: {model}, 消息数: {len(messages)}, temperature: {temperature}")
         
         # 检查消息格式
@@ -113,18 +161,8 @@ class AIService:
                         url = item['image_url']['url']
                         print(f"   图片 {j}: {url[:100]}...")  # 只打印前100字符
         
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.api_key}',
-            'HTTP-Referer': self.site_url
-        }
-        
-        payload = {
-            'model': model,
-            'messages': messages,
-            'temperature': temperature,
-            'max_tokens': max_tokens
-        }
+        headers = self._headers()
+        payload = self._payload(messages, model, temperature, max_tokens)
         
         try:
             print(f"🌐 发送请求到 OpenRouter API...")
@@ -132,7 +170,7 @@ class AIService:
             print(f"   模型: {model}")
             print(f"   消息数: {len(messages)}")
             
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=60)
+            response = self._post(headers, payload)
             
             print(f"📥 收到响应: status={response.status_code}")
             
@@ -151,6 +189,8 @@ class AIService:
             if result.get('choices') and len(result['choices']) > 0:
                 content = result['choices'][0]['message']['content']
                 ai_logger.info(f"AI响应成功, 模型: {model}, tokens: {result.get('usage', {})}")
+                if cache_key:
+                    ai_response_cache.set(cache_key, model, content)
                 return content
             else:
                 error_msg = result.get('error', {}).get('message', 'AI响应格式错误')
@@ -162,8 +202,159 @@ class AIService:
             print(f"API调用失败: {e}")
             return f"AI服务暂时不可用: {str(e)}"
     
-    def analyze_stock(self, stock_code, stock_name, stock_data, indicators, user_message=None, model=None):
-        """分析股票数据并生成交易策略"""
+    def _retry_delay(self, attempt, response=None):
+        """重试前的等待秒数：优先服务端 Retry-After，否则指数退避加随机抖动"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+        return self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+    
+    def _record_attempt(self, attempt, started, status=None, error=None):
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        with self._http_lock:
+            stats = self._http_stats
+            stats['attempts'] += 1
+            stats['requests'] += attempt == 0
+            stats['retries'] += attempt > 0
+            if error is not None:
+                stats['errors'] += 1
+            else:
+                stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            self._recent_attempts.append({
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'attempt': attempt,
+                'status': status,
+                'error': error,
+                'elapsed_ms': elapsed_ms,   # 流式请求为收到响应头的耗时
+            })
+        ai_logger.debug(f"OpenRouter请求 第{attempt + 1}次: status={status}, error={error}, {elapsed_ms}ms")
+    
+    def _post(self, headers, payload, stream=False):
+        """通过共享会话发送请求；429/5xx或连接失败时退避重试
+        
+        读超时不重试（模型可能已在生成，重试会加倍等待）
+        
+        Returns:
+            requests.Response: 最后一次请求的响应（可能仍是错误状态，由调用方处理）
+        """
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self.session.post(self.api_url, headers=headers, json=payload,
+                                             timeout=config.OPENROUTER_TIMEOUT, stream=stream)
+            except requests.exceptions.ConnectionError as e:
+                self._record_attempt(attempt, started, error=type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+            else:
+                self._record_attempt(attempt, started, status=response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self._retry_delay(attempt, response)
+                response.close()
+            ai_logger.warning(f"OpenRouter请求失败，{delay:.2f}秒后第{attempt + 1}次重试")
+            time.sleep(delay)
+    
+    def http_status(self):
+        """OpenRouter请求统计（请求数、尝试数、重试、连接错误、各状态码次数）及最近的请求明细"""
+        with self._http_lock:
+            return {
+                **self._http_stats,
+                'statuses': dict(self._http_stats['statuses']),
+                'pool_size': config.OPENROUTER_POOL_SIZE,
+                'recent': list(self._recent_attempts),
+            }
+    
+    def _headers(self):
+        return {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}',
+            'HTTP-Referer': self.site_url
+        }
+    
+    def _payload(self, messages, model, temperature, max_tokens, stream=False):
+        payload = {
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }
+        if stream:
+            payload['stream'] = True
+        return payload
+    
+    def chat_stream(self, messages, model=None, temperature=0.7, max_tokens=2000, use_cache=True):
+        """流式调用OpenRouter API（stream: true），逐段返回生成的文本
+        
+        出错时与 chat 一样以文本形式返回错误信息；命中AI响应缓存时一次返回完整回复
+        
+        Yields:
+            str: 增量文本
+        """
+        if not model:
+            model = self.default_model
+        
+        cache_key = ai_response_cache.key(model, temperature, max_tokens, messages) if use_cache else None
+        if cache_key:
+            cached = ai_response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        ai_logger.debug(f"流式调用OpenRouter API, 模型: {model}, 消息数: {len(messages)}, temperature: {temperature}")
+        payload = self._payload(messages, model, temperature, max_tokens, stream=True)
+        
+        try:
+            # 超时为建立连接及两段数据之间的最长等待，不限制整体生成时间
+            with self._post(self._headers(), payload, stream=True) as response:
+                if response.status_code != 200:
+                    print(f"❌ API错误响应: {response.text}")
+                response.raise_for_status()
+                
+                parts = []
+                done = False
+                finish_reason = None
+                for line in response.iter_lines():
+                    # SSE：空行分隔事件，冒号开头为注释（OpenRouter处理中的保活）
+                    line = line.decode('utf-8')
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        done = True
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get('error'):
+                        error_msg = chunk['error'].get('message', 'AI响应格式错误')
+                        ai_logger.error(f"流式响应错误: {error_msg}")
+                        yield f"AI响应错误: {error_msg}"
+                        return
+                    for choice in chunk.get('choices') or []:
+                        content = (choice.get('delta') or {}).get('content')
+                        if content:
+                            parts.append(content)
+                            yield content
+                        finish_reason = choice.get('finish_reason') or finish_reason
+                    if chunk.get('usage'):
+                        ai_logger.info(f"AI流式响应完成, 模型: {model}, tokens: {chunk['usage']}")
+                # 完整生成后才缓存：以正常的 finish_reason 结束，或收到 [DONE] 且没有异常的 finish_reason；
+                # 中途出错、连接断开或上游超时截断的回复不缓存
+                finished = finish_reason in NORMAL_FINISH_REASONS or (done and finish_reason is None)
+                if not finished:
+                    ai_logger.warning(f"流式响应未正常结束，不缓存, 模型: {model}, 已接收{len(parts)}段")
+                elif cache_key:
+                    ai_response_cache.set(cache_key, model, ''.join(parts))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            ai_logger.error(f"流式API调用失败: {e}", exc_info=True)
+            yield f"AI服务暂时不可用: {str(e)}"
+    
+    def analyze_stock(self, stock_code, stock_name, stock_data, indicators, user_message=None, model=None,
+                      use_cache=True):
+        """分析股票数据并生成交易策略（相同数据的分析默认复用AI响应缓存）"""
         # 构建系统提示
         system_prompt = ""
 #         system_prompt = """你是一位专业的量化交易分析师，擅长技术分析和交易策略制定。
@@ -205,7 +396,7 @@ class AIService:
             messages.append({'role': 'user', 'content': user_message})
         
         # 调用AI
-        response = self.chat(messages, model=model, temperature=0.7, max_tokens=2000)
+        response = self.chat(messages, model=model, temperature=0.7, max_tokens=2000, use_cache=use_cache)
         return response
     
     def save_chat_history(self, user_id, stock_code, role, content):
@@ -310,9 +501,34 @@ class AIService:
         return max_index if max_index > 0 else 1
     
     def _format_kline_data(self, data_list, columns=['trade_date', 'open', 'close', 'high', 'low', 'volume']):
-        """格式化K线数据为表格字符串"""
-        if not data_list:
-            return "暂无数据"
+        """格式化K线数据为表格字符串
+        
+        Args:
+            data_list: 行字典列表，或列式数据 {列名: [值, ...]}（row_mode='columns'）
+            columns: 输出的列
+        """
+        if isinstance(data_list, dict):
+            # 列式数据：按列取值后一次性zip成行，不再逐行构建字典
+            row_count = column_length(data_list)
+            if not row_count:
+                return "暂无数据"
+            column_values = []
+            for col in columns:
+                values = data_list.get(col)
+                if values is None:
+                    values = ['-'] * row_count
+                elif isinstance(values, np.ndarray) and values.dtype.kind == 'M':
+                    # get_kline_arrays 的时间列：整列转换为字符串
+                    if col == 'trade_date':
+                        values = np.datetime_as_string(values, unit='D')
+                    else:
+                        values = np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ')
+                column_values.append(values)
+            rows = zip(*column_values)
+        else:
+            if not data_list:
+                return "暂无数据"
+            rows = ([data.get(col, '-') for col in columns] for data in data_list)
         
         # 表头
         headers = {
@@ -324,24 +540,25 @@ class AIService:
             'volume': '成交量'
         }
         
-        result = '\t'.join([headers.get(col, col) for col in columns]) + '\n'
+        lines = ['\t'.join([headers.get(col, col) for col in columns])]
         
         # 数据行
-        for data in data_list:
+        for values in rows:
             row = []
-            for col in columns:
-                value = data.get(col, '-')
+            for col, value in zip(columns, values):
                 # 格式化数字
-                if isinstance(value, (int, float)):
+                if isinstance(value, float) and value != value:
+                    row.append('-')  # NaN
+                elif isinstance(value, (int, float)):
                     if col == 'volume':
                         row.append(f"{int(value):,}")
                     else:
                         row.append(f"{float(value):.2f}")
                 else:
                     row.append(str(value))
-            result += '\t'.join(row) + '\n'
+            lines.append('\t'.join(row))
         
-        return result
+        return '\n'.join(lines) + '\n'
     
     def _format_macd_data(self, indicators):
         """格式化MACD数据为表格字符串"""
@@ -519,184 +736,92 @@ class AIService:
         
         return result
     
-    def _replace_variables(self, user_id, stock_code, message):
-        """替换消息中的变量占位符
-        
-        支持的变量格式：
-        1. K线类型_股票_窗口_指标
-           - K线类型（必填）：1分钟K、日K、周K
-           - 股票（选填）：股票代码或名称，空则使用当前股票
-           - 窗口（选填）：如"30天"、"360天"，空则使用默认值
-           - 指标（选填）：如"MACD"、"EMA"、"MACD&EMA"等
+    def _expand_kline_variable(self, full_match, use_stock_code, kline_type, window_days, indicators):
+        """查询并格式化一个K线变量
         
-        2. 持仓 - 获取所有持仓信息
-        3. 可用资金 - 获取现金余额
-        4. 当前价格 - 获取当前股票的实时价格（简化版，仅价格）
-        5. 实时行情 - 获取当前股票的完整实时行情（价格+估值+成交）
-        
-        示例：
-        - 日K_复旦微电_30天_MACD&EMA
-        - 周K__360天_RSI
-        - 1分钟K
-        - 持仓
-        - 可用资金
-        - 当前价格
-        - 实时行情
+        Returns:
+            dict: {变量文本: (替换文本, 变量内容；无数据时为None)}
         """
         from services.stock_service import stock_service
-        from services.position_service import position_service
-        import re
         
-        replaced_message = message
-        variables_used = {}
+        # 获取K线数据（连续数组，避免逐行构建字典）
+        period = {'日K': 'daily', '周K': 'weekly', '1分钟K': 'minute'}[kline_type]
+        data = stock_service.get_kline_arrays(use_stock_code, period, window_days)
         
-        # 定义已知的技术指标
-        KNOWN_INDICATORS = {'MACD', 'EMA', 'RSI', 'KDJ', 'BOLL', 'MA', 'VOL'}
+        if not data or not column_length(data):
+            return {full_match: (f'[{full_match}：暂无数据]', None)}
         
-        # 正则匹配变量格式：K线类型_股票_窗口_指标
-        # 匹配整个变量字符串（排除花括号和空白符）
-        pattern = r'(1分钟K|日K|周K)(?:(?:_[^_\s\n{}]+)+)?'
+        # 确保数据条数不超过window_days（二次保险）
+        if column_length(data) > window_days:
+            data = {col: values[-window_days:] for col, values in data.items()}
         
-        matches = re.finditer(pattern, message)
+        # 基础K线列
+        columns = ['trade_date', 'open', 'close', 'high', 'low', 'volume']
+        if kline_type == '1分钟K':
+            columns[0] = 'trade_time'
         
-        for match in matches:
-            full_match = match.group(0)
-            parts = full_match.split('_')
-            
-            kline_type = parts[0]  # K线类型
-            
-            # 解析剩余部分
-            target_stock = None
-            window_str = None
-            indicators_str = None
-            
-            if len(parts) > 1:
-                # 从后向前解析，优先识别"窗口"和"指标"
-                remaining_parts = parts[1:]
-                
-                # 检查是否有指标（最后一部分，且匹配已知指标）
-                if remaining_parts:
-                    last_part = remaining_parts[-1]
-                    # 支持多个指标，用&连接，如 "EMA&RSI"
-                    indicators_in_last = [ind.strip() for ind in last_part.split('&')]
-                    # 如果所有部分都是已知指标，则认为是指标
-                    if all(ind in KNOWN_INDICATORS for ind in indicators_in_last):
-                        indicators_str = last_part
-                        remaining_parts = remaining_parts[:-1]
-                
-                # 检查是否有窗口（\d+天格式）
-                if remaining_parts and re.match(r'^\d+天$', remaining_parts[-1]):
-                    window_str = remaining_parts[-1]
-                    remaining_parts = remaining_parts[:-1]
-                
-                # 剩余的就是股票代码/名称
-                if remaining_parts:
-                    target_stock = '_'.join(remaining_parts)  # 可能包含下划线的股票名
-            
-            # 确定使用的股票代码
-            if target_stock:
-                # 如果提供了股票名称/代码，需要查询
-                info = stock_service.get_stock_info(target_stock)
-                if info:
-                    use_stock_code = info['ts_code']
-                else:
-                    replaced_message = replaced_message.replace(full_match, f'[股票"{target_stock}"不存在]')
-                    continue
-            else:
-                # 使用当前股票
-                use_stock_code = stock_code
-            
-            # 解析窗口（天数）
-            if window_str:
-                window_days = int(window_str.replace('天', ''))
-            else:
-                # 默认窗口
-                if kline_type == '日K':
-                    window_days = 60
-                elif kline_type == '周K':
-                    window_days = 360
-                else:  # 1分钟K
-                    window_days = 1440  # 2天的分钟数
-            
-            # 解析指标
-            indicators = []
-            if indicators_str:
-                indicators = [ind.strip() for ind in indicators_str.split('&')]
+        # 格式化K线数据
+        kline_str = self._format_kline_data(data, columns)
+        
+        # 如果需要指标数据
+        indicator_str = ''
+        if indicators:
+            indicator_data = None
             
-            # 获取K线数据
-            data = None
+            # 只支持日K的指标
             if kline_type == '日K':
-                data = stock_service.get_stock_data_from_db(use_stock_code, 'daily', window_days)
-            elif kline_type == '周K':
-                data = stock_service.get_stock_data_from_db(use_stock_code, 'weekly', window_days)
-            elif kline_type == '1分钟K':
-                data = stock_service.get_stock_data_from_db(use_stock_code, 'minute', window_days)
-            
-            if not data:
-                replaced_message = replaced_message.replace(full_match, f'[{full_match}：暂无数据]')
-                continue
-            
-            # 确保数据条数不超过window_days（二次保险）
-            if len(data) > window_days:
-                data = data[-window_days:]
-            
-            # 基础K线列
-            columns = ['trade_date', 'open', 'close', 'high', 'low', 'volume']
-            if kline_type == '1分钟K':
-                columns[0] = 'trade_time'
-            
-            # 格式化K线数据
-            kline_str = self._format_kline_data(data, columns)
+                indicator_data = stock_service.get_indicators_from_db(use_stock_code, window_days)
+                
+                # 确保指标数据条数不超过window_days（二次保险）
+                if indicator_data and len(indicator_data) > window_days:
+                    indicator_data = indicator_data[-window_days:]
             
-            # 如果需要指标数据
-            indicator_str = ''
-            if indicators:
-                indicator_data = None
+            if indicator_data:
+                # 根据指标类型格式化
+                if 'MACD' in indicators:
+                    indicator_str += '\n\nMACD指标:\n'
+                    indicator_str += self._format_macd_data(indicator_data)
                 
-                # 只支持日K的指标
-                if kline_type == '日K':
-                    indicator_data = stock_service.get_indicators_from_db(use_stock_code, window_days)
-                    
-                    # 确保指标数据条数不超过window_days（二次保险）
-                    if indicator_data and len(indicator_data) > window_days:
-                        indicator_data = indicator_data[-window_days:]
+                if 'EMA' in indicators:
+                    indicator_str += '\n\nEMA指标:\n'
+                    indicator_str += self._format_ema_data(indicator_data)
                 
-                if indicator_data:
-                    # 根据指标类型格式化
-                    if 'MACD' in indicators:
-                        indicator_str += '\n\nMACD指标:\n'
-                        indicator_str += self._format_macd_data(indicator_data)
-                    
-                    if 'EMA' in indicators:
-                        indicator_str += '\n\nEMA指标:\n'
-                        indicator_str += self._format_ema_data(indicator_data)
-                    
-                    if 'RSI' in indicators:
-                        indicator_str += '\n\nRSI指标:\n'
-                        indicator_str += self._format_rsi_data(indicator_data)
-            
-            # 组合结果
-            result_str = f'\n"""\n{kline_str}{indicator_str}\n"""'
-            replaced_message = replaced_message.replace(full_match, result_str)
-            variables_used[full_match] = result_str
-        
-        # 处理"持仓"变量
-        if '持仓' in message:
-            positions_summary = position_service.get_portfolio_summary(user_id)
-            positions_str = self._format_positions_data(user_id, positions_summary)
-            replaced_message = replaced_message.replace('持仓', f'\n"""\n{positions_str}\n"""')
-            variables_used['持仓'] = positions_str
-        
-        # 处理"可用资金"变量
-        if '可用资金' in message:
-            cash_balance = position_service.get_cash_balance(user_id)
-            cash_str = self._format_cash_data(cash_balance)
-            replaced_message = replaced_message.replace('可用资金', f'\n"""\n{cash_str}\n"""')
-            variables_used['可用资金'] = cash_str
-        
-        # 处理"当前价格"变量（简化版，仅显示价格）
-        if '当前价格' in message:
-            price_data = stock_service.get_realtime_price(stock_code)
+                if 'RSI' in indicators:
+                    indicator_str += '\n\nRSI指标:\n'
+                    indicator_str += self._format_rsi_data(indicator_data)
+        
+        # 组合结果
+        result_str = f'\n"""\n{kline_str}{indicator_str}\n"""'
+        return {full_match: (result_str, result_str)}
+    
+    def _expand_positions(self, user_id, with_cash):
+        """查询并格式化持仓（持仓汇总中已有可用资金，一并输出时不再单独查询）"""
+        from services.position_service import position_service
+        
+        positions_summary = position_service.get_portfolio_summary(user_id)
+        positions_str = self._format_positions_data(user_id, positions_summary)
+        result = {'持仓': (f'\n"""\n{positions_str}\n"""', positions_str)}
+        if with_cash:
+            cash_str = self._format_cash_data(positions_summary['cash'])
+            result['可用资金'] = (f'\n"""\n{cash_str}\n"""', cash_str)
+        return result
+    
+    def _expand_cash(self, user_id):
+        """查询并格式化可用资金"""
+        from services.position_service import position_service
+        
+        cash_str = self._format_cash_data(position_service.get_cash_balance(user_id))
+        return {'可用资金': (f'\n"""\n{cash_str}\n"""', cash_str)}
+    
+    def _expand_realtime(self, stock_code, names):
+        """查询一次实时价格，格式化"当前价格"和/或"实时行情"变量"""
+        from services.stock_service import stock_service
+        
+        price_data = stock_service.get_realtime_price(stock_code)
+        result = {}
+        
+        # "当前价格"：简化版，仅显示价格
+        if '当前价格' in names:
             if price_data and price_data.get('price'):
                 price_str = f"当前价格: {price_data['price']:.2f} 元"
                 if price_data.get('trade_date'):
@@ -709,17 +834,112 @@ class AIService:
                         price_str += f"\n更新时间: {price_data['updated_at']}"
             else:
                 price_str = f"股票 {stock_code} 暂无当前价格数据"
-            
-            replaced_message = replaced_message.replace('当前价格', f'\n"""\n{price_str}\n"""')
-            variables_used['当前价格'] = price_str
+            result['当前价格'] = (f'\n"""\n{price_str}\n"""', price_str)
         
-        # 处理"实时行情"变量（完整版，包括价格+估值+成交）
-        if '实时行情' in message:
-            price_data = stock_service.get_realtime_price(stock_code)
+        # "实时行情"：完整版，包括价格+估值+成交
+        if '实时行情' in names:
             realtime_str = self._format_realtime_price_data(stock_code, price_data)
-            replaced_message = replaced_message.replace('实时行情', f'\n"""\n{realtime_str}\n"""')
-            variables_used['实时行情'] = realtime_str
+            result['实时行情'] = (f'\n"""\n{realtime_str}\n"""', realtime_str)
+        
+        return result
+    
+    def _variable_sources(self, user_id, stock_code, template, values):
+        """把模版中的变量归并为数据源，逐个产出 (缓存键或None, 取数据的函数)
+        
+        取数据的函数返回 {变量文本: (替换文本, 变量内容或None)}；不需要查询的变量直接写入 values
+        """
+        from services.stock_service import stock_service
+        from services.position_service import position_service
+        
+        names = {variable.text for variable in template.variables}
         
+        for variable in template.variables:
+            if variable.kind != 'kline':
+                continue
+            kline_type, target_stock, window_days, indicators = variable.kline
+            
+            # 确定使用的股票代码
+            if target_stock:
+                # 如果提供了股票名称/代码，需要查询（证券主表/缓存）
+                info = stock_service.get_stock_info(target_stock)
+                if not info:
+                    values[variable.text] = (f'[股票"{target_stock}"不存在]', None)
+                    continue
+                use_stock_code = info['ts_code']
+            else:
+                # 使用当前股票
+                use_stock_code = stock_code
+            
+            # 相同变量、相同股票、数据未更新时直接复用展开结果
+            version = data_versions.get(stock_service.normalize_stock_code(use_stock_code))
+            yield (('kline', variable.text, use_stock_code, version),
+                   partial(self._expand_kline_variable, variable.text, use_stock_code, kline_type, window_days, indicators))
+        
+        # 持仓、可用资金（持仓写入后版本变化，缓存失效）
+        if '持仓' in names:
+            with_cash = '可用资金' in names
+            yield (('持仓', user_id, position_service.version(user_id), with_cash),
+                   partial(self._expand_positions, user_id, with_cash))
+        elif '可用资金' in names:
+            yield ('可用资金', user_id, position_service.version(user_id)), partial(self._expand_cash, user_id)
+        
+        # 当前价格、实时行情共用一次查询，不缓存
+        if '当前价格' in names or '实时行情' in names:
+            yield None, partial(self._expand_realtime, stock_code, names)
+    
+    def _replace_variables(self, user_id, stock_code, message):
+        """替换消息中的变量占位符
+        
+        支持的变量格式：
+        1. K线类型_股票_窗口_指标
+           - K线类型（必填）：1分钟K、日K、周K
+           - 股票（选填）：股票代码或名称，空则使用当前股票
+           - 窗口（选填）：如"30天"、"360天"，空则使用默认值
+           - 指标（选填）：如"MACD"、"EMA"、"MACD&EMA"等
+        
+        2. 持仓 - 获取所有持仓信息
+        3. 可用资金 - 获取现金余额
+        4. 当前价格 - 获取当前股票的实时价格（简化版，仅价格）
+        5. 实时行情 - 获取当前股票的完整实时行情（价格+估值+成交）
+        
+        示例：
+        - 日K_复旦微电_30天_MACD&EMA
+        - 周K__360天_RSI
+        - 1分钟K
+        - 持仓
+        - 可用资金
+        - 当前价格
+        - 实时行情
+        
+        变量须与正文用空白或标点隔开，或写成 {持仓}；模版编译一次后缓存，
+        各数据源只查询一次（多个时并行），最后一次拼接出结果。
+        """
+        template = compile_template(message)
+        if not template.variables:
+            return message, {}
+        
+        values = {}      # 变量文本 -> (替换文本, 变量内容或None)
+        fetches = []     # 需要查询的数据源：(缓存键, 取数据的函数)
+        for key, fetch in self._variable_sources(user_id, stock_code, template, values):
+            if key is not None:
+                cached = self.expansion_cache.get(key)
+                if not self.expansion_cache.missing(cached):
+                    values.update(cached)
+                    continue
+            fetches.append((key, fetch))
+        
+        # 多个数据源并行查询，只有一个时直接在当前线程查询
+        if len(fetches) > 1:
+            results = list(self.variable_executor.map(lambda item: item[1](), fetches))
+        else:
+            results = [fetch() for _, fetch in fetches]
+        for (key, _), result in zip(fetches, results):
+            if key is not None:
+                self.expansion_cache.set(key, result)
+            values.update(result)
+        
+        replaced_message = render(template, {text: value[0] for text, value in values.items()})
+        variables_used = {text: value[1] for text, value in values.items() if value[1] is not None}
         return replaced_message, variables_used
     
     def _save_prompt_history(self, username, stock_code, user_message, ai_response, replaced_message, images=None):
@@ -790,7 +1010,8 @@ class AIService:
             traceback.print_exc()
             return None
     
-    def chat_with_history(self, user_id, username, stock_code, user_message, model=None, images=None):
+    def chat_with_history(self, user_id, username, stock_code, user_message, model=None, images=None,
+                          use_cache=True):
         """带历史记录的对话（支持变量替换、图片和Prompt日志）
         
         Args:
@@ -800,6 +1021,42 @@ class AIService:
             user_message: 用户消息文本
             model: 模型ID，如果为None则使用默认模型
             images: 图片列表（base64格式），可选
+            use_cache: 是否使用AI响应缓存
+        """
+        messages, replaced_message = self._prepare_chat(user_id, stock_code, user_message, model, images)
+        
+        # 5. 调用AI
+        response = self.chat(messages, model=model, use_cache=use_cache)
+        
+        self._finish_chat(user_id, username, stock_code, user_message, response, replaced_message, images)
+        return response
+    
+    def chat_with_history_stream(self, user_id, username, stock_code, user_message, model=None, images=None,
+                                 use_cache=True):
+        """流式的带历史记录对话，参数同 chat_with_history
+        
+        逐段返回AI生成的文本；生成结束（或客户端断开）后保存对话记录和Prompt历史
+        
+        Yields:
+            str: 增量文本
+        """
+        messages, replaced_message = self._prepare_chat(user_id, stock_code, user_message, model, images)
+        
+        parts = []
+        try:
+            for delta in self.chat_stream(messages, model=model, use_cache=use_cache):
+                parts.append(delta)
+                yield delta
+        finally:
+            # 客户端中途断开时保存已生成的部分
+            if parts:
+                self._finish_chat(user_id, username, stock_code, user_message, ''.join(parts), replaced_message, images)
+    
+    def _prepare_chat(self, user_id, stock_code, user_message, model, images):
+        """替换变量、读取历史记录并构建发送给AI的消息列表
+        
+        Returns:
+            tuple: (消息列表, 变量替换后的用户消息)
         """
         # 0. 检查模型是否支持图片输入（仅警告，不阻止）
         if images and len(images) > 0:
@@ -872,9 +1129,10 @@ class AIService:
                 'content': replaced_message
             })
         
-        # 5. 调用AI
-        response = self.chat(messages, model=model)
-        
+        return messages, replaced_message
+    
+    def _finish_chat(self, user_id, username, stock_code, user_message, response, replaced_message, images):
+        """保存对话记录到数据库和Prompt历史到文件"""
         # 6. 保存对话记录到数据库（保存原始消息和图片信息）
         # 构建完整的用户消息（包含文本和图片标记）
         if images and len(images) > 0:
@@ -894,8 +1152,6 @@ class AIService:
         # 7. 保存Prompt历史到文件（保存替换后的完整内容和图片信息）
         save_text = user_message if user_message else f"[发送了{len(images)}张图片]"
         self._save_prompt_history(username, stock_code, save_text, response, replaced_message, images=images)
-        
-        return response
 
 
 # 创建全局AI服务实例
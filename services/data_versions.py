@@ -0,0 +1,90 @@
+"""
+数据版本
+每次写入后记录数据的最后写入时间：
+- data_versions：日K、周K、分钟K或技术指标，按股票记录（kline_versions 表），
+  用于接口响应缓存的失效判断以及 ETag / Last-Modified
+- position_versions：持仓和现金余额，按用户记录（position_versions 表），用于AI提示词变量展开缓存的失效判断
+写入进程立即更新本进程的版本号；其他进程（多个Web进程、独立调度/采集进程）
+每 DATA_VERSION_SYNC_SECONDS 秒最多查询一次变化的记录
+"""
+import threading
+import time
+from database import db_manager
+from config import config
+from utils.logger import stock_logger
+
+
+# 同步时回看的秒数，容忍多台机器之间的时钟误差
+SYNC_OVERLAP_SECONDS = 60
+
+
+class DataVersions:
+    """按键（股票代码或用户ID）的数据版本号（最后写入的Unix时间戳，未知时为0）
+
+    Args:
+        sync_interval: 同步其他进程写入的最小间隔（秒）
+        table: 版本表
+        key_column: 版本表的主键列
+    """
+
+    def __init__(self, sync_interval=None, table='kline_versions', key_column='ts_code'):
+        self.sync_interval = config.DATA_VERSION_SYNC_SECONDS if sync_interval is None else sync_interval
+        self.table = table
+        self.key_column = key_column
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._synced_at = None   # 上次同步的monotonic时间
+        self._since = 0.0        # 已同步到的最大写入时间
+
+    def bump(self, keys):
+        """记录这些键（股票代码或用户ID）的数据已被写入"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return
+        now = time.time()
+        if config.DATABASE_TYPE == 'sqlite':
+            query = f"INSERT OR REPLACE INTO {self.table} ({self.key_column}, updated_at) VALUES (%s, %s)"
+        else:
+            query = f"""
+            INSERT INTO {self.table} ({self.key_column}, updated_at) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE updated_at = VALUES(updated_at)
+            """
+        with self._lock:
+            for key in keys:
+                self._versions[key] = now
+        try:
+            db_manager.execute_many(query, [(key, now) for key in keys])
+        except Exception as e:
+            # 版本记录失败不影响数据写入，其他进程最多在缓存过期后看到新数据
+            stock_logger.warning(f"数据版本写入失败: {e}")
+
+    def _sync(self):
+        """拉取其他进程写入的版本变化"""
+        with self._lock:
+            if self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = time.monotonic()
+            since = self._since
+        try:
+            rows = db_manager.execute_query(
+                f"SELECT {self.key_column}, updated_at FROM {self.table} WHERE updated_at >= %s",
+                (since - SYNC_OVERLAP_SECONDS,), row_mode='tuple'
+            )
+        except Exception as e:
+            stock_logger.warning(f"数据版本同步失败: {e}")
+            return
+        with self._lock:
+            for key, updated_at in rows:
+                if updated_at > self._versions.get(key, 0.0):
+                    self._versions[key] = updated_at
+                self._since = max(self._since, updated_at)
+
+    def get(self, key):
+        self._sync()
+        with self._lock:
+            return self._versions.get(key, 0.0)
+
+
+# 创建全局数据版本实例
+data_versions = DataVersions()
+position_versions = DataVersions(table='position_versions', key_column='user_id')
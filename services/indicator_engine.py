@@ -0,0 +1,231 @@
+"""
+增量技术指标引擎
+每只股票持久化EMA和RSI滚动窗口状态，新K线到来时O(1)更新，只写入新增的指标行
+
+计算口径与 StockService.calculate_indicators（批量计算）保持一致：
+- EMA: pandas ewm(span, adjust=False)
+- MACD: EMA12 - EMA26，信号线为MACD的EMA9
+- RSI: 涨跌幅的简单移动平均（rolling mean），首根K线的涨跌记为0
+"""
+import json
+import math
+from collections import deque
+from datetime import datetime
+from database import db_manager
+from config import config
+from utils.logger import stock_logger
+
+
+EMA_SPANS = {'ema_12': 12, 'ema_26': 26}
+SIGNAL_SPAN = 9
+RSI_WINDOWS = (6, 12, 24)
+
+
+def _ema(prev, value, span):
+    """EMA递推（adjust=False）"""
+    if prev is None:
+        return value
+    alpha = 2.0 / (span + 1)
+    return alpha * value + (1 - alpha) * prev
+
+
+def _rsi(gains, losses, window):
+    """根据最近window个涨跌计算RSI，窗口未满返回NaN"""
+    if len(gains) < window:
+        return float('nan')
+    gain = sum(list(gains)[-window:]) / window
+    loss = sum(list(losses)[-window:]) / window
+    if loss == 0:
+        # 与pandas一致：gain/0 = inf -> 100；0/0 = NaN
+        return 100.0 if gain > 0 else float('nan')
+    return 100 - 100 / (1 + gain / loss)
+
+
+class IndicatorState:
+    """单只股票的指标计算状态"""
+
+    def __init__(self):
+        self.last_trade_date = None
+        self.last_close = None
+        self.ema_12 = None
+        self.ema_26 = None
+        self.macd_signal = None
+        self.gains = deque(maxlen=max(RSI_WINDOWS))
+        self.losses = deque(maxlen=max(RSI_WINDOWS))
+        self.prev = None  # 应用最后一根K线之前的状态，用于最新K线被修正时回退
+
+    def _snapshot(self):
+        return {
+            'last_trade_date': self.last_trade_date,
+            'last_close': self.last_close,
+            'ema_12': self.ema_12,
+            'ema_26': self.ema_26,
+            'macd_signal': self.macd_signal,
+            'gains': list(self.gains),
+            'losses': list(self.losses)
+        }
+
+    def _restore(self, snapshot):
+        self.last_trade_date = snapshot['last_trade_date']
+        self.last_close = snapshot['last_close']
+        self.ema_12 = snapshot['ema_12']
+        self.ema_26 = snapshot['ema_26']
+        self.macd_signal = snapshot['macd_signal']
+        self.gains = deque(snapshot['gains'], maxlen=max(RSI_WINDOWS))
+        self.losses = deque(snapshot['losses'], maxlen=max(RSI_WINDOWS))
+
+    def update(self, trade_date, close):
+        """应用一根新K线，返回该K线的指标"""
+        self.prev = self._snapshot()
+
+        delta = 0.0 if self.last_close is None else close - self.last_close
+        self.gains.append(delta if delta > 0 else 0.0)
+        self.losses.append(-delta if delta < 0 else 0.0)
+
+        self.ema_12 = _ema(self.ema_12, close, EMA_SPANS['ema_12'])
+        self.ema_26 = _ema(self.ema_26, close, EMA_SPANS['ema_26'])
+        macd = self.ema_12 - self.ema_26
+        self.macd_signal = _ema(self.macd_signal, macd, SIGNAL_SPAN)
+
+        self.last_trade_date = trade_date
+        self.last_close = close
+
+        result = {
+            'trade_date': trade_date,
+            'macd': macd,
+            'macd_signal': self.macd_signal,
+            'macd_hist': macd - self.macd_signal,
+            'ema_12': self.ema_12,
+            'ema_26': self.ema_26
+        }
+        for window in RSI_WINDOWS:
+            result[f'rsi_{window}'] = _rsi(self.gains, self.losses, window)
+        return result
+
+    def rollback(self):
+        """撤销最后一根K线，只能回退一步"""
+        if self.prev is None:
+            return False
+        self._restore(self.prev)
+        self.prev = None
+        return True
+
+    def to_json(self):
+        data = self._snapshot()
+        data['prev'] = self.prev
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        state = cls()
+        state._restore(data)
+        state.prev = data.get('prev')
+        return state
+
+
+class IndicatorEngine:
+    """增量指标引擎：负责状态持久化和指标行写入"""
+
+    def load_state(self, ts_code):
+        """读取持久化的指标状态"""
+        query = "SELECT state FROM indicator_state WHERE ts_code = %s"
+        result = db_manager.execute_query(query, (ts_code,), fetch_one=True)
+        if not result:
+            return None
+        return IndicatorState.from_json(result['state'])
+
+    def save_state(self, ts_code, state):
+        """保存指标状态"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if config.DATABASE_TYPE == 'sqlite':
+            query = """
+            INSERT OR REPLACE INTO indicator_state (ts_code, last_trade_date, state, updated_at)
+            VALUES (%s, %s, %s, %s)
+            """
+        else:
+            query = """
+            INSERT INTO indicator_state (ts_code, last_trade_date, state, updated_at)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+            last_trade_date=VALUES(last_trade_date), state=VALUES(state), updated_at=VALUES(updated_at)
+            """
+        db_manager.execute_update(query, (ts_code, state.last_trade_date, state.to_json(), now))
+
+    def _apply(self, state, bars):
+        """依次应用K线，返回指标行"""
+        rows = []
+        for trade_date, close in bars:
+            if close is None or (isinstance(close, float) and math.isnan(close)):
+                continue
+            rows.append(state.update(trade_date, float(close)))
+        return rows
+
+    def _save_rows(self, ts_code, rows):
+        """写入指标行（复用StockService的保存逻辑）"""
+        if not rows:
+            return 0
+        import pandas as pd
+        from services.stock_service import stock_service
+        return stock_service.save_indicators(ts_code, pd.DataFrame(rows))
+
+    def rebuild(self, ts_code, n=None):
+        """基于数据库中的日K重新计算全部指标并重置状态"""
+        from services.stock_service import stock_service, INDICATOR_HISTORY_BARS
+
+        frame = stock_service.get_kline_frame(ts_code, 'daily', n or INDICATOR_HISTORY_BARS)
+        if frame.empty:
+            return 0
+
+        state = IndicatorState()
+        dates = frame.index.strftime('%Y-%m-%d')
+        rows = self._apply(state, zip(dates, frame['close'].tolist()))
+        saved = self._save_rows(ts_code, rows)
+        self.save_state(ts_code, state)
+        stock_logger.info(f"指标全量重建: {ts_code}, K线{len(frame)}根")
+        return saved
+
+    def update(self, ts_code, changed_from=None):
+        """增量更新指标
+
+        Args:
+            ts_code: 股票代码
+            changed_from: 本次写入的最早K线日期（'YYYY-MM-DD'），早于状态日期时需要回退或重建
+
+        Returns:
+            int: 写入的指标行数
+        """
+        state = self.load_state(ts_code)
+        if state is None or state.last_trade_date is None:
+            return self.rebuild(ts_code)
+
+        if changed_from and changed_from <= state.last_trade_date:
+            # 只有最后一根K线被修正时可以回退一步，否则历史被改写，需要重建
+            if changed_from == state.last_trade_date and state.rollback():
+                stock_logger.debug(f"指标状态回退一根K线: {ts_code} {changed_from}")
+            else:
+                return self.rebuild(ts_code)
+
+        if state.last_trade_date is None:
+            # 状态中只有一根K线，回退后为空，无法按日期增量查询
+            return self.rebuild(ts_code)
+
+        query = """
+        SELECT trade_date, close FROM stock_daily
+        WHERE ts_code = %s AND trade_date > %s
+        ORDER BY trade_date
+        """
+        bars = db_manager.execute_query(query, (ts_code, state.last_trade_date), row_mode='tuple')
+        bars = [(str(trade_date)[:10], close) for trade_date, close in bars]
+        if not bars:
+            return 0
+
+        rows = self._apply(state, bars)
+        saved = self._save_rows(ts_code, rows)
+        self.save_state(ts_code, state)
+        stock_logger.debug(f"指标增量更新: {ts_code}, 新增{len(rows)}行")
+        return saved
+
+
+# 创建全局指标引擎实例
+indicator_engine = IndicatorEngine()
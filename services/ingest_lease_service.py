@@ -0,0 +1,180 @@
+"""
+数据采集分片租约服务
+多个独立采集进程（ingest_worker.py）通过数据库中的租约表瓜分自选股：
+- 每个进程定期在 ingest_workers 表中心跳，存活进程数决定每个进程的份额
+- ingest_leases 表每只股票一行，同一时刻只有一个未过期的持有者
+- 抢占过期租约使用带条件的UPDATE（expires_at < now），由数据库保证只有一个进程成功
+- 持有数超过份额的进程主动释放多余租约，新加入的进程在下一次同步时接手
+"""
+import math
+import os
+import socket
+import threading
+import time
+from database import db_manager
+from config import config
+from utils.logger import stock_logger
+
+
+def default_worker_id():
+    """默认进程标识：主机名:进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class IngestLeaseService:
+    """采集分片租约
+
+    Args:
+        worker_id: 进程标识，默认 主机名:进程号
+        ttl: 租约有效期（秒），进程停止心跳超过该时间后其股票由其他进程接手
+    """
+
+    def __init__(self, worker_id=None, ttl=None):
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl or config.INGEST_LEASE_TTL
+        self._owned = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _heartbeat(self, now):
+        """登记/刷新本进程的心跳"""
+        if config.DATABASE_TYPE == 'sqlite':
+            query = """
+            INSERT OR REPLACE INTO ingest_workers (worker_id, heartbeat_at)
+            VALUES (%s, %s)
+            """
+        else:
+            query = """
+            INSERT INTO ingest_workers (worker_id, heartbeat_at)
+            VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE heartbeat_at = VALUES(heartbeat_at)
+            """
+        db_manager.execute_update(query, (self.worker_id, now))
+
+    def _live_workers(self, now):
+        """存活进程（含本进程），顺带清理停止心跳的进程"""
+        db_manager.execute_update("DELETE FROM ingest_workers WHERE heartbeat_at < %s", (now - self.ttl,))
+        rows = db_manager.execute_query(
+            "SELECT worker_id FROM ingest_workers WHERE heartbeat_at >= %s",
+            (now - self.ttl,), row_mode='tuple'
+        )
+        return {row[0] for row in rows} | {self.worker_id}
+
+    def _claim(self, ts_code, now):
+        """尝试获取一只股票的租约，返回是否成功"""
+        expires = now + self.ttl
+        insert = "INSERT OR IGNORE" if config.DATABASE_TYPE == 'sqlite' else "INSERT IGNORE"
+        if db_manager.execute_update(
+            f"{insert} INTO ingest_leases (ts_code, worker_id, expires_at) VALUES (%s, %s, %s)",
+            (ts_code, self.worker_id, expires)
+        ):
+            return True
+        # 已有租约：只有在过期时才能抢占，并发抢占时条件保证只有一个进程更新成功
+        return db_manager.execute_update(
+            "UPDATE ingest_leases SET worker_id = %s, expires_at = %s WHERE ts_code = %s AND expires_at < %s",
+            (self.worker_id, expires, ts_code, now)
+        ) > 0
+
+    def sync(self, codes):
+        """按当前自选股和存活进程数重新分配租约
+
+        续约仍在份额内的股票，释放已移出自选股或超出份额的股票，再从无人持有的股票中补足份额
+
+        Args:
+            codes: 全部自选股代码（所有进程看到的同一份列表）
+
+        Returns:
+            set: 本进程持有的股票代码
+        """
+        codes = set(codes)
+        now = time.time()
+        self._heartbeat(now)
+        share = math.ceil(len(codes) / len(self._live_workers(now))) if codes else 0
+
+        leases = db_manager.execute_query(
+            "SELECT ts_code, worker_id, expires_at FROM ingest_leases", row_mode='tuple'
+        )
+        mine = sorted(code for code, owner, expires in leases
+                      if owner == self.worker_id and code in codes and expires >= now)
+        release = [code for code, owner, _ in leases if owner == self.worker_id and code not in codes]
+        release += mine[share:]
+        mine = mine[:share]
+
+        if release:
+            db_manager.execute_many(
+                "DELETE FROM ingest_leases WHERE worker_id = %s AND ts_code = %s",
+                [(self.worker_id, code) for code in release]
+            )
+        # 逐只续约并检查影响行数：读取租约后过期并被其他进程抢占的股票不再属于本进程
+        owned = set()
+        for code in mine:
+            if db_manager.execute_update(
+                "UPDATE ingest_leases SET expires_at = %s WHERE worker_id = %s AND ts_code = %s",
+                (now + self.ttl, self.worker_id, code)
+            ):
+                owned.add(code)
+
+        held = {code for code, owner, expires in leases if expires >= now and owner != self.worker_id}
+        for code in sorted(codes - held - owned):
+            if len(owned) >= share:
+                break
+            if self._claim(code, now):
+                owned.add(code)
+
+        with self._lock:
+            if owned != self._owned:
+                stock_logger.info(f"采集分片变更: {self.worker_id} 持有{len(owned)}/{len(codes)}只股票")
+            self._owned = owned
+        return set(owned)
+
+    def owned(self):
+        """最近一次同步后本进程持有的股票"""
+        with self._lock:
+            return set(self._owned)
+
+    def start(self, load_codes):
+        """启动后台续约线程，每 ttl/3 秒同步一次
+
+        Args:
+            load_codes: 返回全部自选股代码的函数
+        """
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.sync(load_codes())
+                except Exception as e:
+                    stock_logger.error(f"采集租约同步失败: {self.worker_id}, {e}", exc_info=True)
+                self._stop.wait(self.ttl / 3)
+
+        self._thread = threading.Thread(target=loop, name='ingest-lease', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止续约并释放本进程的全部租约，其他进程可立即接手"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        db_manager.execute_update("DELETE FROM ingest_leases WHERE worker_id = %s", (self.worker_id,))
+        db_manager.execute_update("DELETE FROM ingest_workers WHERE worker_id = %s", (self.worker_id,))
+        with self._lock:
+            self._owned = set()
+
+    @staticmethod
+    def cluster_status():
+        """各采集进程的心跳时间和持有的股票数"""
+        now = time.time()
+        workers = db_manager.execute_query(
+            "SELECT worker_id, heartbeat_at FROM ingest_workers ORDER BY worker_id", row_mode='tuple'
+        )
+        counts = dict(db_manager.execute_query(
+            "SELECT worker_id, COUNT(*) FROM ingest_leases WHERE expires_at >= %s GROUP BY worker_id",
+            (now,), row_mode='tuple'
+        ))
+        return [{
+            'worker_id': worker_id,
+            'heartbeat_age': round(now - heartbeat_at, 1),
+            'leases': counts.get(worker_id, 0)
+        } for worker_id, heartbeat_at in workers]
@@ -2,6 +2,7 @@
 持仓管理服务
 """
 from database import db_manager
+from services.data_versions import position_versions
 from services.stock_service import stock_service
 from utils.logger import position_logger
 
@@ -9,6 +10,16 @@ from utils.logger import position_logger
 class PositionService:
     """持仓管理服务类"""
     
+    def version(self, user_id):
+        """用户持仓和资金的版本号（最后写入时间，记录在数据库中，其他进程的写入同样可见）
+
+        AI提示词变量展开的缓存据此失效
+        """
+        return position_versions.get(user_id)
+    
+    def _bump(self, user_id):
+        position_versions.bump([user_id])
+    
     def get_all_positions(self, user_id):
         """获取指定用户的所有持仓"""
         query = "SELECT * FROM positions WHERE user_id = %s ORDER BY id"
@@ -45,6 +56,7 @@ class PositionService:
             VALUES (?, ?, ?, ?, ?)
             """
             result = db_manager.execute_update(query, (user_id, stock_code, stock_name, quantity, cost_price))
+        self._bump(user_id)
         
         # 添加到自选股（如果不存在）
         if result:
@@ -59,7 +71,9 @@ class PositionService:
     def delete_position(self, user_id, stock_code):
         """删除持仓"""
         query = "DELETE FROM positions WHERE user_id = %s AND stock_code = %s"
-        return db_manager.execute_update(query, (user_id, stock_code))
+        result = db_manager.execute_update(query, (user_id, stock_code))
+        self._bump(user_id)
+        return result
     
     def update_position_price(self, user_id, stock_code, current_price):
         """更新持仓当前价格和盈亏"""
@@ -75,7 +89,9 @@ class PositionService:
         SET current_price = %s, profit_loss = %s, profit_loss_pct = %s
         WHERE user_id = %s AND stock_code = %s
         """
-        return db_manager.execute_update(query, (current_price, profit_loss, profit_loss_pct, user_id, stock_code))
+        result = db_manager.execute_update(query, (current_price, profit_loss, profit_loss_pct, user_id, stock_code))
+        self._bump(user_id)
+        return result
     
     def update_all_positions_price(self, user_id):
         """更新指定用户所有持仓的当前价格"""
@@ -112,7 +128,9 @@ class PositionService:
         # 先确保用户有余额记录
         self.init_cash_balance(user_id)
         query = "UPDATE cash_balance SET balance = %s WHERE user_id = %s"
-        return db_manager.execute_update(query, (balance, user_id))
+        result = db_manager.execute_update(query, (balance, user_id))
+        self._bump(user_id)
+        return result
     
     def get_portfolio_summary(self, user_id):
         """获取指定用户的投资组合汇总"""
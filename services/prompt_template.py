@@ -0,0 +1,116 @@
+"""
+对话提示词模版编译
+模版只解析一次，得到由文本片段和变量节点组成的语法树（按模版文本缓存），渲染时一次拼接：
+- 变量必须是独立的词：前后为空白、标点、花括号或首尾，也可以写成 {持仓} 的形式（花括号一并替换）
+  因此正文里的"持仓"、"日K线"等普通文字不会被误替换
+- 同一模版中重复出现的变量只取一次数据
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+
+# 变量分隔符：空白、花括号、中英文标点
+DELIMITERS = r'\s{}，。；：？！、（）【】《》“”‘’,;:?!()\[\]<>"\''
+
+# K线变量的一段后缀（股票可以为空，如 周K__360天_RSI；英文句点用于股票代码，如 688385.SH）
+KLINE_SUFFIX = r'_+[^_\s{}，。；：？！、（）【】《》“”‘’]+'
+
+# 仓位、实时数据变量
+SIMPLE_VARIABLES = ('持仓', '可用资金', '当前价格', '实时行情')
+
+# 变量词法：K线类型_股票_窗口_指标，或固定名称；可以包在花括号中
+TOKEN_PATTERN = re.compile(
+    rf'(?:(?<=[{DELIMITERS}])|^)'
+    rf'(?P<open>\{{)?'
+    rf'(?P<name>(?:1分钟K|日K|周K)(?:{KLINE_SUFFIX})*|{"|".join(SIMPLE_VARIABLES)})'
+    rf'(?(open)\}})'
+    rf'(?=[{DELIMITERS}]|$)'
+)
+WINDOW_PATTERN = re.compile(r'^\d+天$')
+
+# 已知的技术指标
+KNOWN_INDICATORS = {'MACD', 'EMA', 'RSI', 'KDJ', 'BOLL', 'MA', 'VOL'}
+
+# 各K线类型的默认窗口（1分钟K为2天的分钟数）
+DEFAULT_WINDOWS = {'日K': 60, '周K': 360, '1分钟K': 1440}
+
+# 语法树中的变量节点：kind 为 'kline' 或变量名；kline 为K线变量的解析结果
+Variable = namedtuple('Variable', ['kind', 'text', 'kline'])
+
+# 编译后的模版：nodes 为文本(str)与 Variable 交替的序列，variables 为去重后的变量
+CompiledTemplate = namedtuple('CompiledTemplate', ['nodes', 'variables'])
+
+
+@lru_cache(maxsize=1024)
+def parse_kline_variable(text):
+    """解析K线变量（结果只取决于变量文本，因此可以记忆）
+
+    Returns:
+        tuple: (K线类型, 股票代码/名称或None, 窗口天数, 指标元组)
+    """
+    parts = text.split('_')
+    kline_type = parts[0]  # K线类型
+
+    target_stock = None
+    window_str = None
+    indicators_str = None
+
+    if len(parts) > 1:
+        # 从后向前解析，优先识别"窗口"和"指标"
+        remaining_parts = parts[1:]
+
+        # 检查是否有指标（最后一部分，且匹配已知指标）
+        if remaining_parts:
+            last_part = remaining_parts[-1]
+            # 支持多个指标，用&连接，如 "EMA&RSI"
+            indicators_in_last = [ind.strip() for ind in last_part.split('&')]
+            # 如果所有部分都是已知指标，则认为是指标
+            if all(ind in KNOWN_INDICATORS for ind in indicators_in_last):
+                indicators_str = last_part
+                remaining_parts = remaining_parts[:-1]
+
+        # 检查是否有窗口（\d+天格式）
+        if remaining_parts and WINDOW_PATTERN.match(remaining_parts[-1]):
+            window_str = remaining_parts[-1]
+            remaining_parts = remaining_parts[:-1]
+
+        # 剩余的就是股票代码/名称
+        if remaining_parts:
+            target_stock = '_'.join(remaining_parts)  # 可能包含下划线的股票名
+
+    window_days = int(window_str.replace('天', '')) if window_str else DEFAULT_WINDOWS[kline_type]
+    indicators = tuple(ind.strip() for ind in indicators_str.split('&')) if indicators_str else ()
+    return kline_type, target_stock, window_days, indicators
+
+
+@lru_cache(maxsize=256)
+def compile_template(text):
+    """把提示词编译为语法树（同一模版文本只编译一次）"""
+    nodes = []
+    variables = {}
+    position = 0
+
+    for match in TOKEN_PATTERN.finditer(text):
+        if match.start() > position:
+            nodes.append(text[position:match.start()])
+
+        name = match.group('name')
+        variable = variables.get(name)
+        if variable is None:
+            if name in SIMPLE_VARIABLES:
+                variable = Variable(name, name, None)
+            else:
+                variable = Variable('kline', name, parse_kline_variable(name))
+            variables[name] = variable
+        nodes.append(variable)
+        position = match.end()
+
+    if position < len(text):
+        nodes.append(text[position:])
+    return CompiledTemplate(tuple(nodes), tuple(variables.values()))
+
+
+def render(template, values):
+    """按变量文本取值，一次拼接出最终提示词"""
+    return ''.join(node if isinstance(node, str) else values[node.text] for node in template.nodes)
@@ -0,0 +1,140 @@
+"""
+实时行情推送
+进程内的发布/订阅：每个SSE连接订阅一组股票，行情写入数据库后推送给订阅者，替代页面每30秒轮询
+- 本进程写入（save_realtime_prices）后立即通知
+- 其他进程写入（独立采集进程）由分发线程每 QUOTE_STREAM_POLL_SECONDS 秒查库发现
+每个订阅者只收到与上次推给它的不同的行情（订阅时的快照也算已推送）；没有订阅者时分发线程不查库
+"""
+import queue
+import threading
+from config import config
+from utils.logger import stock_logger
+
+
+# 每个订阅者最多积压的行情条数，超出时丢弃最旧的（客户端只关心最新价格）
+SUBSCRIBER_QUEUE_SIZE = 200
+
+
+class Subscription:
+    """一个客户端的订阅"""
+
+    def __init__(self, codes):
+        self.codes = frozenset(codes)
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.sent = {}  # ts_code -> 已推送给该订阅者的行情（含订阅时的快照），由 QuoteHub 在锁内维护
+
+    def put(self, quote):
+        while True:
+            try:
+                self.queue.put_nowait(quote)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """等待下一条行情，超时返回None"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class QuoteHub:
+    """实时行情发布/订阅中心"""
+
+    def __init__(self, poll_interval=None):
+        self.poll_interval = config.QUOTE_STREAM_POLL_SECONDS if poll_interval is None else poll_interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._pending = set()    # 本进程写入、等待推送的股票
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def subscribe(self, codes):
+        """订阅一组股票（ts_code），返回订阅对象"""
+        sub = Subscription(codes)
+        with self._lock:
+            self._subscribers.add(sub)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='quote-hub', daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def notify(self, ts_codes):
+        """行情已写入数据库，唤醒分发线程（只记录有订阅者的股票）"""
+        with self._lock:
+            if not self._subscribers:
+                return
+            watched = set().union(*(s.codes for s in self._subscribers))
+            self._pending.update(code for code in ts_codes if code in watched)
+            if not self._pending:
+                return
+        self._wakeup.set()
+
+    def snapshot(self, codes, sub=None):
+        """订阅时的当前行情
+
+        传入订阅对象时把快照记为已推送给它，分发线程不会再把相同的行情推一遍
+        """
+        from services.stock_service import stock_service
+        quotes = stock_service.get_realtime_prices(codes)
+        if sub is not None:
+            with self._lock:
+                sub.sent.update((ts_code, quote) for ts_code, quote in quotes.items() if ts_code in sub.codes)
+        return quotes
+
+    def dispatch(self):
+        """查询订阅的股票，把与该订阅者上次收到的不同的行情推给它
+
+        Returns:
+            int: 推送的行情条数
+        """
+        with self._lock:
+            self._pending.clear()
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return 0
+        codes = set().union(*(sub.codes for sub in subscribers))
+        quotes = self.snapshot(codes)
+
+        pushed = 0
+        with self._lock:
+            for sub in subscribers:
+                for ts_code in sub.codes & quotes.keys():
+                    quote = quotes[ts_code]
+                    if sub.sent.get(ts_code) != quote:
+                        sub.sent[ts_code] = quote
+                        sub.put(quote)
+                        pushed += 1
+        return pushed
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self.dispatch()
+            except Exception as e:
+                stock_logger.error(f"实时行情推送失败: {e}")
+
+    def status(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'codes': len(set().union(*(s.codes for s in self._subscribers))) if self._subscribers else 0,
+            }
+
+
+# 创建全局行情推送实例
+quote_hub = QuoteHub()
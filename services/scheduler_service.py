@@ -1,24 +1,190 @@
 """
 定时任务服务 - 自动更新股票数据
-按北京时间统一时间点触发：
-- 实时股价：每分钟更新
-- 日K/周K：每小时更新
+按北京时间统一时间点触发（Cron表达式可配置）：
+- 实时股价：交易时段内每分钟更新（SCHEDULER_REALTIME_CRON）
+- 日K/周K：A股交易日收盘后更新一次（SCHEDULER_KLINE_CRON）
+- 证券主表：每天开盘前批量刷新（SCHEDULER_SECURITY_CRON），启动时表为空或过期也会立即刷新
+
+实时和K线任务分别在独立的任务通道（线程池）中执行，互不阻塞；
+同一任务上一次尚未结束时，新的触发被合并（跳过），不会堆积
+
+独立采集进程（ingest_worker.py）传入分片租约，每个进程只更新自己持有租约的股票
 """
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Thread, Lock, Condition
+import heapq
+import itertools
 import time
 from datetime import datetime
+from config import config
 from services.stock_service import stock_service
+from services.security_master import security_master
+from services.trading_calendar import trading_calendar, market_of
 from services.watchlist_service import watchlist_service
+from utils.cron import CronExpression
+from utils.logger import stock_logger
+
+
+class JobLane:
+    """任务通道
+    
+    - 任务本身在通道的单线程执行器中依次运行
+    - 任务内的单股步骤提交到通道的线程池（tasks）并发执行
+    """
+    
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'scheduler-{name}')
+        self.tasks = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'scheduler-{name}-task')
+        self._lock = Lock()
+        self._active = set()   # 已提交且尚未结束的任务名
+        self.stats = {}        # 任务名 -> 运行统计
+    
+    def _job_stats(self, job_name):
+        return self.stats.setdefault(job_name, {
+            'runs': 0, 'coalesced': 0, 'failures': 0,
+            'last_started': None, 'last_duration': None
+        })
+    
+    def submit(self, job_name, func):
+        """提交任务；同名任务仍在排队或运行时合并本次触发
+        
+        Returns:
+            bool: 是否提交成功（False表示被合并）
+        """
+        with self._lock:
+            stats = self._job_stats(job_name)
+            if job_name in self._active:
+                stats['coalesced'] += 1
+                stock_logger.warning(f"任务仍在运行，合并本次触发: {job_name}")
+                return False
+            self._active.add(job_name)
+        
+        self.runner.submit(self._run, job_name, func)
+        return True
+    
+    def _run(self, job_name, func):
+        started = time.monotonic()
+        failed = False
+        try:
+            func(self.tasks)
+        except Exception:
+            failed = True
+            stock_logger.error(f"定时任务执行出错: {job_name}", exc_info=True)
+        finally:
+            with self._lock:
+                stats = self._job_stats(job_name)
+                stats['runs'] += 1
+                stats['failures'] += failed
+                stats['last_started'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                stats['last_duration'] = round(time.monotonic() - started, 3)
+                self._active.discard(job_name)
+    
+    def is_active(self, job_name):
+        with self._lock:
+            return job_name in self._active
+    
+    def status(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'active': sorted(self._active),
+                'jobs': {name: dict(stats) for name, stats in self.stats.items()}
+            }
+    
+    def shutdown(self, wait=False):
+        self.runner.shutdown(wait=wait)
+        self.tasks.shutdown(wait=wait)
+
+
+class ScheduledJob:
+    """定时任务定义
+    
+    Args:
+        name: 任务名（同名任务在通道中合并）
+        schedule: Cron表达式字符串，或任何提供 next_after(dt) 的触发器
+        lane: 运行的任务通道
+        func: 任务函数，接收通道线程池作为参数
+        title: 触发时打印的说明
+        catch_up: 错过触发时间后是否补跑一次（多次错过合并为一次）
+        condition: 可选，condition(计划时间) 为False时跳过本次触发（如非交易时段）；在任务通道中检查
+    """
+    
+    def __init__(self, name, schedule, lane, func, title=None, catch_up=True, condition=None):
+        self.name = name
+        self.trigger = CronExpression(schedule) if isinstance(schedule, str) else schedule
+        self.lane = lane
+        self.func = func
+        self.title = title or name
+        self.catch_up = catch_up
+        self.condition = condition
+        self.next_run = None
+        self.last_run = None
+        self.last_lag_ms = None  # 实际触发时间相对计划时间的延迟
+        self.fired = 0
+        self.missed = 0
+        self.skipped = 0  # 因condition不满足而跳过的次数
+    
+    def to_dict(self):
+        fmt = '%Y-%m-%d %H:%M:%S'
+        return {
+            'schedule': getattr(self.trigger, 'expression', repr(self.trigger)),
+            'lane': self.lane,
+            'next_run': self.next_run.strftime(fmt) if self.next_run else None,
+            'last_run': self.last_run.strftime(fmt) if self.last_run else None,
+            'last_lag_ms': self.last_lag_ms,
+            'fired': self.fired,
+            'missed': self.missed,
+            'skipped': self.skipped
+        }
 
 
 class SchedulerService:
-    """定时任务服务类"""
+    """定时任务服务类
+    
+    最小堆按下次触发时间排列任务，调度线程在条件变量上睡到最近的触发时间，
+    新增任务或停止时被唤醒，不做轮询
     
-    def __init__(self):
+    Args:
+        shard: 可选，IngestLeaseService；提供时只处理本进程持有租约的自选股
+    """
+    
+    # 延迟超过该秒数视为错过触发
+    MISFIRE_GRACE_SECONDS = 30
+    
+    def __init__(self, shard=None):
+        self.shard = shard
         self.running = False
         self.thread = None
-        self.last_realtime_trigger = None  # 上次实时价格触发时间
-        self.last_hourly_trigger = None    # 上次小时触发时间
+        self.lanes = {}
+        self.jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = Condition()
+        
+        # 实时股价只在A股/港股交易时段内拉取；K线在A股交易日收盘后更新一次
+        self.add_job(ScheduledJob('realtime_price', config.SCHEDULER_REALTIME_CRON, 'realtime',
+                                  self._update_realtime_price, title='更新实时股价', catch_up=False,
+                                  condition=lambda due: bool(trading_calendar.open_markets(due))))
+        self.add_job(ScheduledJob('kline_data', config.SCHEDULER_KLINE_CRON, 'kline',
+                                  self._update_kline_data, title='更新日K/周K',
+                                  condition=lambda due: trading_calendar.is_trading_day(due, 'A')))
+        self.add_job(ScheduledJob('security_master', config.SCHEDULER_SECURITY_CRON, 'kline',
+                                  self._refresh_security_master, title='刷新证券主表'))
+    
+    def add_job(self, job):
+        """注册任务；调度器运行中时立即排入下一次触发"""
+        with self._cond:
+            self.jobs[job.name] = job
+            if self.running:
+                self._schedule(job, datetime.now())
+    
+    def _schedule(self, job, after):
+        job.next_run = job.trigger.next_after(after)
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+        self._cond.notify()
     
     def start(self):
         """启动定时任务"""
@@ -26,132 +192,192 @@ class SchedulerService:
             print("定时任务已在运行中")
             return
         
-        self.running = True
+        self.lanes = {
+            'realtime': JobLane('realtime', config.SCHEDULER_REALTIME_WORKERS),
+            'kline': JobLane('kline', config.SCHEDULER_KLINE_WORKERS)
+        }
+        with self._cond:
+            self.running = True
+            self._heap = []
+            now = datetime.now()
+            for job in self.jobs.values():
+                self._schedule(job, now)
+        if self.shard:
+            self.shard.start(self._all_codes)
+        # 证券主表为空或已过期时立即刷新（只在过期时调用接口，多进程下不会重复拉取）
+        self.submit('kline', 'security_master', self._refresh_security_master)
         self.thread = Thread(target=self._run_scheduler, daemon=True)
         self.thread.start()
-        print("✅ 定时任务已启动（实时股价：每分钟，日K/周K：每小时）")
+        print("✅ 定时任务已启动（" + "，".join(
+            f"{job.title}: {job.to_dict()['schedule']}" for job in self.jobs.values()
+        ) + "）")
     
     def stop(self):
         """停止定时任务"""
-        self.running = False
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
         if self.thread:
             self.thread.join(timeout=5)
+        for lane in self.lanes.values():
+            lane.shutdown()
+        if self.shard:
+            self.shard.stop()
         print("❌ 定时任务已停止")
     
+    def submit(self, lane_name, job_name, func):
+        """在指定通道中运行任务，func接收通道的线程池作为参数"""
+        return self.lanes[lane_name].submit(job_name, func)
+    
+    def status(self):
+        """调度状态：各任务的下次触发时间、错过次数，以及各通道的运行统计"""
+        with self._cond:
+            jobs = {name: job.to_dict() for name, job in self.jobs.items()}
+        return {
+            'running': self.running,
+            'worker_id': self.shard.worker_id if self.shard else None,
+            'jobs': jobs,
+            'lanes': {name: lane.status() for name, lane in self.lanes.items()}
+        }
+    
     def _run_scheduler(self):
-        """运行定时任务主循环"""
-        while self.running:
-            try:
-                now = datetime.now()
+        """调度主循环：睡到最近的触发时间"""
+        with self._cond:
+            while self.running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
                 
-                # 每分钟更新实时股价
-                if self._is_minute_mark(now):
-                    if not self._is_same_minute(now, self.last_realtime_trigger):
-                        print(f"\n⏰ 更新实时股价: {now.strftime('%H:%M')}")
-                        self._update_realtime_price()
-                        self.last_realtime_trigger = now
+                due, _, job = self._heap[0]
+                delay = (due - datetime.now()).total_seconds()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
                 
-                # 每小时更新日K/周K（整点）
-                if self._is_hourly_update_time(now):
-                    if not self._is_same_hour(now, self.last_hourly_trigger):
-                        print(f"\n⏰ 小时更新时间: {now.strftime('%Y-%m-%d %H:%M')}")
-                        self._update_kline_data()
-                        self.last_hourly_trigger = now
-                
-                # 每20秒检查一次（降低CPU占用）
-                time.sleep(20)
-            except Exception as e:
-                print(f"定时任务执行出错: {e}")
-                import traceback
-                traceback.print_exc()
-                time.sleep(20)
-    
-    def _is_minute_mark(self, now):
-        """判断是否是整分钟时刻"""
-        return now.second < 20
-    
-    def _is_hourly_update_time(self, now):
-        """判断是否是整点时间"""
-        return now.minute == 0 and now.second < 20
-    
-    def _is_same_minute(self, time1, time2):
-        """判断两个时间是否在同一分钟内"""
-        if time2 is None:
-            return False
-        return (time1.year == time2.year and 
-                time1.month == time2.month and 
-                time1.day == time2.day and 
-                time1.hour == time2.hour and 
-                time1.minute == time2.minute)
-    
-    def _is_same_hour(self, time1, time2):
-        """判断两个时间是否在同一小时内"""
-        if time2 is None:
-            return False
-        return (time1.year == time2.year and 
-                time1.month == time2.month and 
-                time1.day == time2.day and 
-                time1.hour == time2.hour)
-    
-    def _update_realtime_price(self):
+                heapq.heappop(self._heap)
+                try:
+                    self._fire(job, due)
+                except Exception as e:
+                    stock_logger.error(f"定时任务触发失败: {job.name}, {e}", exc_info=True)
+                    self._schedule(job, datetime.now())
+    
+    def _fire(self, job, due):
+        """触发任务并排入下一次；延迟期间错过的触发计入missed，按catch_up决定是否补跑"""
+        now = datetime.now()
+        lag = (now - due).total_seconds()
+        
+        # 计划时间之后、当前时间之前还有多少次触发被错过
+        missed = 0
+        next_run = job.trigger.next_after(due)
+        while next_run <= now:
+            missed += 1
+            next_run = job.trigger.next_after(next_run)
+        
+        late = lag > self.MISFIRE_GRACE_SECONDS
+        if late or missed:
+            job.missed += missed + (0 if job.catch_up else 1)
+            stock_logger.warning(
+                f"定时任务错过触发: {job.name}, 计划 {due:%Y-%m-%d %H:%M}, 延迟{lag:.1f}秒, "
+                f"{'补跑一次' if job.catch_up else '跳过'}"
+            )
+        
+        if job.catch_up or not late:
+            self.submit(job.lane, job.name, partial(self._run_job, job, due, now, lag))
+        
+        job.next_run = next_run
+        heapq.heappush(self._heap, (next_run, next(self._seq), job))
+    
+    def _run_job(self, job, due, fired_at, lag, executor):
+        """在任务通道中运行任务
+        
+        触发条件在这里检查而不是在调度锁内：交易日历缓存未命中时会调用Tushare接口，
+        接口变慢不应阻塞调度线程、add_job、status 和 stop
+        """
+        if job.condition and not job.condition(due):
+            with self._cond:
+                job.skipped += 1
+            return
+        
+        print(f"\n⏰ {job.title}: {due.strftime('%Y-%m-%d %H:%M')}")
+        with self._cond:
+            job.fired += 1
+            job.last_run = fired_at
+            job.last_lag_ms = round(lag * 1000, 1)
+        job.func(executor)
+    
+    def _all_codes(self):
+        return [stock['stock_code'] for stock in watchlist_service.get_all_unique_stocks()]
+    
+    def _watchlist(self):
+        """本进程负责的自选股（跨所有用户，去重）；分片模式下先同步租约"""
+        watchlist = watchlist_service.get_all_unique_stocks()
+        if not self.shard:
+            return watchlist
+        owned = self.shard.sync(stock['stock_code'] for stock in watchlist)
+        return [stock for stock in watchlist if stock['stock_code'] in owned]
+    
+    def _update_realtime_price(self, executor=None):
         """更新所有自选股的实时股价（跨所有用户，去重）"""
         try:
             # 获取所有用户的自选股（去重）
-            watchlist = watchlist_service.get_all_unique_stocks()
+            watchlist = self._watchlist()
             if not watchlist:
                 print("  ⚠️ 自选股列表为空，跳过更新")
                 return
             
-            print(f"💰 开始更新实时股价（共{len(watchlist)}只股票）...")
+            # 只拉取当前处于交易时段的市场
+            open_markets = trading_calendar.open_markets()
+            codes = [stock['stock_code'] for stock in watchlist
+                     if market_of(stock_service.normalize_stock_code(stock['stock_code'])) in open_markets]
+            if not codes:
+                print("  ⚠️ 自选股所在市场均已休市，跳过更新")
+                return
             
-            success_count = 0
-            for stock in watchlist:
-                stock_code = stock['stock_code']
-                try:
-                    # 获取实时价格
-                    price_data = stock_service.fetch_realtime_price(stock_code)
-                    if price_data:
-                        stock_service.save_realtime_price(price_data)
-                        success_count += 1
-                        print(f"  ✓ {stock_code} 当前价格: {price_data.get('price', 'N/A')}")
-                    
-                    # 避免触发频率限制
-                    time.sleep(0.5)
-                except Exception as e:
-                    print(f"  ✗ {stock_code} 实时价格更新失败: {e}")
+            print(f"💰 开始更新实时股价（共{len(codes)}只股票）...")
             
-            print(f"✅ 实时股价更新完成（成功{success_count}/{len(watchlist)}）\n")
+            # 分组批量请求、并发执行，一次写入数据库
+            prices = stock_service.fetch_realtime_prices(codes, executor=executor)
+            stock_service.save_realtime_prices(prices)
+            for price_data in prices:
+                print(f"  ✓ {price_data['ts_code']} 当前价格: {price_data.get('price', 'N/A')}")
+            success_count = len(prices)
+            
+            print(f"✅ 实时股价更新完成（成功{success_count}/{len(codes)}）\n")
         except Exception as e:
             print(f"❌ 更新实时股价失败: {e}")
             import traceback
             traceback.print_exc()
     
-    def _update_kline_data(self):
+    def _refresh_security_master(self, executor=None):
+        """批量刷新证券主表（已在有效期内时只加载本进程索引）"""
+        try:
+            count = security_master.refresh_if_stale()
+            if count:
+                print(f"✅ 证券主表刷新完成（共{count}只证券）\n")
+        except Exception as e:
+            print(f"❌ 刷新证券主表失败: {e}")
+    
+    def _update_kline_data(self, executor=None):
         """更新所有自选股的日K/周K数据（跨所有用户，去重）"""
         try:
             # 获取所有用户的自选股（去重）
-            watchlist = watchlist_service.get_all_unique_stocks()
+            watchlist = self._watchlist()
             if not watchlist:
                 print("  ⚠️ 自选股列表为空，跳过更新")
                 return
             
             print(f"📊 开始更新日K/周K数据（共{len(watchlist)}只股票）...")
             
-            success_count = 0
-            for stock in watchlist:
-                stock_code = stock['stock_code']
-                try:
-                    # 更新日K和周K（不包含分钟K）
-                    stock_service.update_kline_data_only(stock_code)
-                    success_count += 1
-                    print(f"  ✓ {stock_code} 日K/周K已更新")
-                    
-                    # 避免触发频率限制，每只股票间隔1秒
-                    time.sleep(1)
-                except Exception as e:
-                    print(f"  ✗ {stock_code} 日K/周K更新失败: {e}")
+            # 按交易日批量拉取全市场日K，API调用次数与自选股数量无关
+            result = stock_service.update_kline_batch(
+                [stock['stock_code'] for stock in watchlist], executor=executor
+            )
+            for stock_code in result['failed']:
+                print(f"  ✗ {stock_code} 日K/周K更新失败")
             
-            print(f"✅ 日K/周K更新完成（成功{success_count}/{len(watchlist)}）\n")
+            success_count = len(watchlist) - len(result['failed'])
+            print(f"✅ 日K/周K更新完成（成功{success_count}/{len(watchlist)}，"
+                  f"批量接口调用{result['api_calls']}次，写入日K{result['written']}条）\n")
         except Exception as e:
             print(f"❌ 更新日K/周K数据失败: {e}")
 
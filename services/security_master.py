@@ -0,0 +1,221 @@
+"""
+证券主表服务
+- A股、指数、ETF的基本信息一次性批量拉取（stock_basic / index_basic / fund_basic），写入 securities 表
+- 每日刷新一次（SECURITY_MASTER_MAX_AGE_HOURS），多进程时先到的进程刷新，其余进程直接读取
+- 进程内按代码、数字代码、名称、拼音缩写建立索引，代码标准化和名称解析不再需要网络请求
+
+拼音缩写来自 stock_basic 的 cnspell 字段；指数/ETF在安装了 pypinyin 时自动生成
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from database import db_manager
+from config import config
+from utils.logger import stock_logger
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 可选依赖
+    lazy_pinyin = None
+
+
+# 各类证券的字段（与 get_stock_info 原先从Tushare返回的字段一致）
+INFO_FIELDS = {
+    'stock': ('ts_code', 'symbol', 'name', 'area', 'industry', 'list_date'),
+    'index': ('ts_code', 'name', 'market', 'publisher', 'category'),
+    'fund': ('ts_code', 'name', 'management', 'fund_type', 'issue_date', 'list_date'),
+}
+
+# securities 表的列
+SECURITY_COLUMNS = (
+    'ts_code', 'symbol', 'name', 'cnspell', 'type', 'area', 'industry', 'market',
+    'publisher', 'category', 'management', 'fund_type', 'issue_date', 'list_date', 'updated_at'
+)
+
+# 指数按交易所分别拉取（本项目只使用上证、深证指数）
+INDEX_MARKETS = ('SSE', 'SZSE')
+
+
+def _initials(name):
+    """名称的拼音首字母缩写（大写），无法生成时返回None"""
+    if not name or lazy_pinyin is None:
+        return None
+    return ''.join(lazy_pinyin(name, style=Style.FIRST_LETTER)).upper() or None
+
+
+class SecurityMaster:
+    """证券主表"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_code = {}      # ts_code -> 行
+        self._by_symbol = {}    # 数字代码 -> [ts_code, ...]（如000001同时对应平安银行和上证指数）
+        self._by_name = {}      # 名称 -> ts_code
+        self._by_cnspell = {}   # 拼音缩写 -> [ts_code, ...]
+        self._loaded_at = None
+        self._listeners = []    # 每次加载后调用 listener(rows)，用于维护派生索引
+
+    def add_listener(self, listener):
+        """注册加载回调；已加载过时立即用当前数据调用一次"""
+        with self._lock:
+            self._listeners.append(listener)
+            rows = list(self._by_code.values()) if self._loaded_at is not None else None
+        if rows is not None:
+            listener(rows)
+
+    # ---------- 批量拉取 ----------
+
+    def _fetch(self, pro):
+        """从Tushare批量拉取全部证券，返回 securities 表的行字典列表"""
+        frames = [('stock', pro.stock_basic(
+            exchange='', list_status='L', fields=','.join(INFO_FIELDS['stock'] + ('cnspell',))
+        ))]
+        for market in INDEX_MARKETS:
+            frames.append(('index', pro.index_basic(market=market, fields=','.join(INFO_FIELDS['index']))))
+        frames.append(('fund', pro.fund_basic(market='E', fields=','.join(INFO_FIELDS['fund']))))
+
+        rows = {}
+        for code_type, df in frames:
+            if df is None or df.empty:
+                continue
+            df = df.astype(object).where(df.notna(), None)
+            for record in df.to_dict('records'):
+                record['type'] = code_type
+                if not record.get('symbol'):
+                    record['symbol'] = record['ts_code'].split('.')[0]
+                if not record.get('cnspell'):
+                    record['cnspell'] = _initials(record.get('name'))
+                # 同一代码以先出现的类型为准（A股优先）
+                rows.setdefault(record['ts_code'], record)
+        return list(rows.values())
+
+    def refresh(self, pro=None):
+        """批量拉取并写入 securities 表，完成后重新加载索引
+
+        Returns:
+            int: 写入的证券数
+        """
+        if pro is None:
+            from services.stock_service import stock_service
+            pro = stock_service.pro
+
+        rows = self._fetch(pro)
+        if not rows:
+            stock_logger.warning("证券主表刷新失败：接口未返回数据")
+            return 0
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        columns = ', '.join(SECURITY_COLUMNS)
+        placeholders = ', '.join(['%s'] * len(SECURITY_COLUMNS))
+        if config.DATABASE_TYPE == 'sqlite':
+            query = f"INSERT OR REPLACE INTO securities ({columns}) VALUES ({placeholders})"
+        else:
+            updates = ', '.join(f"{col} = VALUES({col})" for col in SECURITY_COLUMNS[1:])
+            query = f"INSERT INTO securities ({columns}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates}"
+        params = [tuple(row.get(col) for col in SECURITY_COLUMNS[:-1]) + (now,) for row in rows]
+        db_manager.execute_many(query, params)
+
+        stock_logger.info(f"证券主表刷新完成: {len(rows)}只")
+        self.load()
+        return len(rows)
+
+    def last_refreshed(self):
+        """securities 表最近一次刷新时间（datetime），表为空时返回None"""
+        row = db_manager.execute_query("SELECT MAX(updated_at) FROM securities", fetch_one=True, row_mode='tuple')
+        if not row or not row[0]:
+            return None
+        value = row[0]
+        return value if isinstance(value, datetime) else datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+
+    def is_stale(self):
+        last = self.last_refreshed()
+        return last is None or datetime.now() - last > timedelta(hours=config.SECURITY_MASTER_MAX_AGE_HOURS)
+
+    def refresh_if_stale(self, pro=None):
+        """表为空或超过有效期时刷新，否则只加载索引"""
+        if self.is_stale():
+            return self.refresh(pro)
+        self.load()
+        return 0
+
+    # ---------- 进程内索引 ----------
+
+    def load(self):
+        """从 securities 表加载进程内索引"""
+        rows = db_manager.execute_query(f"SELECT {', '.join(SECURITY_COLUMNS[:-1])} FROM securities")
+        by_code, by_symbol, by_name, by_cnspell = {}, {}, {}, {}
+        for row in rows:
+            ts_code = row['ts_code']
+            by_code[ts_code] = row
+            by_symbol.setdefault(row['symbol'], []).append(ts_code)
+            if row['name']:
+                by_name.setdefault(row['name'], ts_code)
+            if row['cnspell']:
+                by_cnspell.setdefault(row['cnspell'].upper(), []).append(ts_code)
+        with self._lock:
+            self._by_code, self._by_symbol = by_code, by_symbol
+            self._by_name, self._by_cnspell = by_name, by_cnspell
+            self._loaded_at = time.monotonic()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(rows)
+            except Exception:
+                stock_logger.error("证券主表加载回调失败", exc_info=True)
+        return len(rows)
+
+    def ensure_loaded(self):
+        """首次使用时加载；其他进程刷新后，超过有效期重新加载（表为空时每分钟重试）"""
+        max_age = config.SECURITY_MASTER_MAX_AGE_HOURS * 3600 if self._by_code else 60
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < max_age:
+            return
+        try:
+            self.load()
+        except Exception as e:
+            # 表尚未创建或数据库不可用时退回到接口查询
+            stock_logger.warning(f"证券主表加载失败: {e}")
+            self._loaded_at = time.monotonic()
+
+    def __contains__(self, ts_code):
+        self.ensure_loaded()
+        return ts_code in self._by_code
+
+    def get(self, ts_code):
+        """按ts_code获取基本信息，字段与接口查询结果一致；不存在时返回None"""
+        self.ensure_loaded()
+        row = self._by_code.get(ts_code)
+        if row is None:
+            return None
+        info = {field: row.get(field) for field in INFO_FIELDS[row['type']]}
+        info['type'] = row['type']
+        return info
+
+    def symbol_codes(self, symbol):
+        """数字代码对应的全部ts_code"""
+        self.ensure_loaded()
+        return list(self._by_symbol.get(symbol, ()))
+
+    def resolve(self, text):
+        """按ts_code、名称或拼音缩写解析为ts_code，无法唯一确定时返回None
+
+        纯数字代码可能同时对应多只证券（如000001），由调用方结合代码规则处理
+        """
+        self.ensure_loaded()
+        text = text.strip()
+        if text in self._by_code:
+            return text
+        if text in self._by_name:
+            return self._by_name[text]
+        codes = self._by_cnspell.get(text.upper(), ())
+        return codes[0] if len(codes) == 1 else None
+
+    def status(self):
+        last = self.last_refreshed()
+        return {
+            'count': len(self._by_code),
+            'last_refreshed': last.strftime('%Y-%m-%d %H:%M:%S') if last else None
+        }
+
+
+# 创建全局证券主表实例
+security_master = SecurityMaster()
@@ -0,0 +1,167 @@
+"""
+股票模糊搜索
+在证券主表之上建立进程内索引：
+- 前缀索引（展开的字典树）：代码、数字代码、名称、拼音缩写的每个前缀 -> 证券
+- 名称二元组（bigram）索引：支持名称中间片段的查询，如"微电"
+证券主表重新加载时按ts_code对比增量更新，只增删发生变化的证券
+
+排序：完全匹配 > 代码前缀 > 名称前缀 > 拼音缩写前缀 > 名称包含；同级按A股、ETF、指数，再按名称长度
+"""
+import threading
+from services.security_master import security_master
+
+
+# 匹配级别（越小越靠前）
+RANK_EXACT = 0
+RANK_CODE = 1
+RANK_NAME = 2
+RANK_CNSPELL = 3
+RANK_CONTAINS = 4
+
+TYPE_ORDER = {'stock': 0, 'fund': 1, 'index': 2}
+
+# 前缀索引的最大长度，更长的查询先按该长度前缀取候选再校验
+MAX_PREFIX = 12
+
+# 搜索结果返回的字段
+RESULT_FIELDS = ('ts_code', 'symbol', 'name', 'cnspell', 'type')
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class StockSearchIndex:
+    """证券搜索索引"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}      # ts_code -> (结果字典, ((键, 级别), ...))
+        self._order = {}     # ts_code -> 同级排序键（类型、名称长度、代码）
+        self._position = {}  # ts_code -> 按同级排序键的全局名次
+        self._ranked = {}    # 已查询过的前缀 -> 按（级别, 名次）排好序的ts_code列表，索引变化时清空
+        self._prefix = {}    # 前缀 -> {ts_code: 最优级别}
+        self._exact = {}     # 完整键 -> {ts_code}
+        self._grams = {}     # 名称二元组 -> {ts_code}
+
+    @staticmethod
+    def _keys(row):
+        """证券的索引键及对应的匹配级别"""
+        keys = [(row['ts_code'].lower(), RANK_CODE), (str(row['symbol']).lower(), RANK_CODE)]
+        if row.get('name'):
+            keys.append((row['name'].lower(), RANK_NAME))
+        if row.get('cnspell'):
+            keys.append((row['cnspell'].lower(), RANK_CNSPELL))
+        return tuple(keys)
+
+    def _add(self, ts_code, doc, keys):
+        self._docs[ts_code] = (doc, keys)
+        self._order[ts_code] = (TYPE_ORDER.get(doc['type'], 9), len(doc['name'] or ''), ts_code)
+        for key, rank in keys:
+            self._exact.setdefault(key, set()).add(ts_code)
+            for i in range(1, min(len(key), MAX_PREFIX) + 1):
+                bucket = self._prefix.setdefault(key[:i], {})
+                if rank < bucket.get(ts_code, RANK_CONTAINS):
+                    bucket[ts_code] = rank
+        if doc['name']:
+            for gram in _bigrams(doc['name'].lower()):
+                self._grams.setdefault(gram, set()).add(ts_code)
+
+    def _remove(self, ts_code):
+        doc, keys = self._docs.pop(ts_code)
+        del self._order[ts_code]
+        for key, _ in keys:
+            codes = self._exact.get(key)
+            if codes is not None:
+                codes.discard(ts_code)
+                if not codes:
+                    del self._exact[key]
+            for i in range(1, min(len(key), MAX_PREFIX) + 1):
+                bucket = self._prefix.get(key[:i])
+                if bucket is not None:
+                    bucket.pop(ts_code, None)
+                    if not bucket:
+                        del self._prefix[key[:i]]
+        if doc['name']:
+            for gram in _bigrams(doc['name'].lower()):
+                codes = self._grams.get(gram)
+                if codes is not None:
+                    codes.discard(ts_code)
+                    if not codes:
+                        del self._grams[gram]
+
+    def update(self, rows):
+        """按最新的证券列表增量更新索引
+
+        Returns:
+            tuple: (新增数, 删除数)
+        """
+        latest = {row['ts_code']: row for row in rows}
+        added = removed = 0
+        with self._lock:
+            for ts_code in list(self._docs):
+                row = latest.get(ts_code)
+                if row is None or self._keys(row) != self._docs[ts_code][1]:
+                    self._remove(ts_code)
+                    removed += 1
+                else:
+                    # 索引键未变，只更新返回的字段
+                    doc = {field: row.get(field) for field in RESULT_FIELDS}
+                    self._docs[ts_code] = (doc, self._docs[ts_code][1])
+                    self._order[ts_code] = (TYPE_ORDER.get(doc['type'], 9), len(doc['name'] or ''), ts_code)
+            for ts_code, row in latest.items():
+                if ts_code not in self._docs:
+                    self._add(ts_code, {field: row.get(field) for field in RESULT_FIELDS}, self._keys(row))
+                    added += 1
+            self._position = {code: i for i, code in enumerate(sorted(self._order, key=self._order.get))}
+            self._ranked = {}
+        return added, removed
+
+    def search(self, query, limit=10):
+        """模糊搜索，返回按匹配程度排序的证券列表（每项带 match 级别）"""
+        q = (query or '').strip().lower()
+        if not q or limit <= 0:
+            return []
+
+        with self._lock:
+            position = self._position
+            exact = sorted(self._exact.get(q, ()), key=position.get)
+            results = [(code, RANK_EXACT) for code in exact]
+            seen = set(exact)
+
+            key = q[:MAX_PREFIX]
+            bucket = self._prefix.get(key, {})
+            ranked = self._ranked.get(key)
+            if ranked is None:
+                ranked = sorted(bucket, key=lambda code: (bucket[code], position[code]))
+                if bucket:
+                    self._ranked[key] = ranked
+            for code in ranked:
+                if len(results) >= limit:
+                    break
+                if code in seen:
+                    continue
+                if len(q) > MAX_PREFIX and not any(k.startswith(q) for k, _ in self._docs[code][1]):
+                    continue
+                results.append((code, bucket[code]))
+                seen.add(code)
+
+            # 名称中间片段：候选为所有二元组的交集，按名次依次校验包含关系
+            if len(q) >= 2 and len(results) < limit:
+                grams = sorted((self._grams.get(gram, set()) for gram in _bigrams(q)), key=len)
+                candidates = set.intersection(*grams) - seen if grams and grams[0] else ()
+                for code in sorted(candidates, key=position.get):
+                    if len(results) >= limit:
+                        break
+                    if q in (self._docs[code][0]['name'] or '').lower():
+                        results.append((code, RANK_CONTAINS))
+
+            return [dict(self._docs[code][0], match=rank) for code, rank in results[:limit]]
+
+    def __len__(self):
+        return len(self._docs)
+
+
+# 创建全局搜索索引，随证券主表加载增量更新
+stock_search = StockSearchIndex()
+security_master.add_listener(stock_search.update)
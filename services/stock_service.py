@@ -1,13 +1,87 @@
 """
 股票数据服务
 """
+from decimal import Decimal, ROUND_HALF_UP
 import tushare as ts
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from database import db_manager
 from config import config
 from utils.logger import stock_logger
-import time
+from utils.rate_limiter import rate_limiter, RateLimitedClient
+from utils.ttl_cache import TTLCache
+from services.security_master import security_master
+from services.data_versions import data_versions
+from services.quote_hub import quote_hub
+from services.trading_calendar import trading_calendar
+
+
+# K线数值列（get_kline_arrays 返回的float64数组）
+KLINE_VALUE_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'amount')
+
+# 上述各列在MySQL中保存的小数位数：价格和成交额为 DECIMAL(…, 2)，成交量为 BIGINT
+KLINE_VALUE_DIGITS = (2, 2, 2, 2, 0, 2)
+
+# 全量重建技术指标时从数据库读取的日K条数（约一年交易日）
+INDICATOR_HISTORY_BARS = 250
+
+# stock_indicators 表的指标列
+INDICATOR_FIELDS = ('macd', 'macd_signal', 'macd_hist', 'ema_12', 'ema_26', 'rsi_6', 'rsi_12', 'rsi_24')
+
+# 实时行情字段（与 stock_realtime 表列顺序一致，trade_time 写入 updated_at）
+REALTIME_FIELDS = (
+    'ts_code', 'stock_name', 'price', 'open', 'pre_close', 'high', 'low',
+    'volume', 'amount', 'change', 'change_percent', 'turnover_ratio', 'amplitude',
+    'total_mv', 'circ_mv', 'pe', 'pe_ttm', 'pb', 'dv_ratio', 'trade_date', 'trade_time'
+)
+
+
+def _run_each(func, items, executor=None):
+    """对每个元素执行func，传入线程池时并发执行，结果按输入顺序返回"""
+    if executor is None:
+        return [func(item) for item in items]
+    return list(executor.map(func, items))
+
+
+def _as_frame(data):
+    """字典列表或DataFrame统一为DataFrame"""
+    if isinstance(data, pd.DataFrame):
+        return data
+    return pd.DataFrame(data if data else [])
+
+
+def _column_values(series):
+    """列转为Python原生值列表（numpy标量转为float/int，NaN转为None）"""
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+def _format_times(series, unit='D'):
+    """整列格式化日期：unit='D' 为 'YYYY-MM-DD'，unit='s' 为 'YYYY-MM-DD HH:MM:SS'"""
+    values = pd.to_datetime(series).to_numpy(dtype='datetime64[ns]')
+    text = np.datetime_as_string(values, unit=unit)
+    if unit != 'D':
+        text = np.char.replace(text, 'T', ' ')
+    return text.tolist()
+
+
+def _aggregate_weekly(daily):
+    """日K聚合为周K（daily 含 trade_date(Timestamp)/open/high/low/close/vol/amount 列）
+
+    按自然周（周一至周日）分组，trade_date 取该周最后一个交易日，与Tushare周线口径一致
+    """
+    daily = daily.sort_values('trade_date')
+    return daily.groupby(daily['trade_date'].dt.to_period('W-SUN')).agg(
+        trade_date=('trade_date', 'last'),
+        open=('open', 'first'),
+        high=('high', 'max'),
+        low=('low', 'min'),
+        close=('close', 'last'),
+        vol=('vol', 'sum'),
+        amount=('amount', 'sum')
+    ).reset_index(drop=True)
 
 
 class StockService:
@@ -17,14 +91,20 @@ class StockService:
         """初始化Tushare API"""
         if config.TUSHARE_TOKEN:
             ts.set_token(config.TUSHARE_TOKEN)
-            self.pro = ts.pro_api()
+            # 所有pro接口调用都经过令牌桶限流
+            self.pro = RateLimitedClient(ts.pro_api(), rate_limiter)
             stock_logger.info("Stock service initialized successfully")
         else:
             stock_logger.error("Tushare Token未配置")
             raise ValueError("Tushare Token未配置，请在.env文件中设置TUSHARE_TOKEN")
         
-        # API调用限流
-        self._last_api_call = {}  # 记录每个接口的最后调用时间
+        # 股票基本信息缓存（ts_code -> 信息字典，不存在的代码缓存None）
+        self.info_cache = TTLCache(
+            maxsize=config.STOCK_INFO_CACHE_SIZE,
+            ttl=config.STOCK_INFO_CACHE_TTL,
+            negative_ttl=config.STOCK_INFO_NEGATIVE_TTL
+        )
+
     
     def detect_code_type(self, stock_code):
         """检测代码类型
@@ -55,23 +135,6 @@ class StockService:
         # 默认为A股
         return 'stock'
     
-    def _rate_limit_check(self, api_name, min_interval=30):
-        """API限流检查
-        
-        Args:
-            api_name: API名称
-            min_interval: 最小调用间隔（秒），默认30秒
-        """
-        current_time = time.time()
-        last_call = self._last_api_call.get(api_name, 0)
-        
-        if current_time - last_call < min_interval:
-            wait_time = min_interval - (current_time - last_call)
-            stock_logger.info(f"API限流: {api_name} 等待 {wait_time:.1f} 秒")
-            time.sleep(wait_time)
-        
-        self._last_api_call[api_name] = time.time()
-    
     def normalize_stock_code(self, stock_code):
         """标准化股票代码
         支持A股、指数、ETF等
@@ -84,14 +147,24 @@ class StockService:
         - 上交所ETF：51、52开头 -> .SH
         - 深交所ETF：15、16开头 -> .SZ
         - 已带后缀的直接返回
+        - 名称/拼音缩写按证券主表解析；规则推断的代码不在主表中、而主表中该数字代码唯一时以主表为准
         """
         if '.' in stock_code:
             return stock_code
         
         # 必须是纯数字
         if not stock_code.isdigit():
-            return f"{stock_code}.SZ"  # 默认深圳
+            return security_master.resolve(stock_code) or f"{stock_code}.SZ"  # 默认深圳
         
+        ts_code = self._normalize_by_rule(stock_code)
+        if ts_code not in security_master:
+            candidates = security_master.symbol_codes(stock_code)
+            if len(candidates) == 1:
+                return candidates[0]
+        return ts_code
+    
+    def _normalize_by_rule(self, stock_code):
+        """按代码规则推断纯数字代码的后缀"""
         # 6位数字
         if len(stock_code) == 6:
             # 上证指数（000开头）
@@ -118,47 +191,66 @@ class StockService:
             return f"{stock_code}.SZ"
     
     def get_stock_info(self, stock_code):
-        """获取股票/指数/ETF基本信息"""
+        """获取股票/指数/ETF基本信息
+        
+        支持代码、名称或拼音缩写；优先查本地证券主表，主表中没有时再查询接口。
+        接口结果按ts_code缓存（TTL + LRU），不存在的代码也缓存较短时间；
+        接口调用失败时不缓存，下次重新查询
+        """
         try:
             ts_code = self.normalize_stock_code(stock_code)
-            code_type = self.detect_code_type(stock_code)
-            
-            stock_logger.debug(f"查询股票信息: {ts_code}, 类型: {code_type}")
-            
-            if code_type == 'index':
-                # 指数查询
-                df = self.pro.index_basic(ts_code=ts_code, fields='ts_code,name,market,publisher,category')
-                if not df.empty:
-                    info = df.iloc[0].to_dict()
-                    info['type'] = 'index'
-                    stock_logger.info(f"查询到指数: {info.get('name')} ({ts_code})")
-                    return info
-            elif code_type == 'fund':
-                # ETF查询
-                df = self.pro.fund_basic(ts_code=ts_code, market='E', fields='ts_code,name,management,fund_type,issue_date,list_date')
-                if not df.empty:
-                    info = df.iloc[0].to_dict()
-                    info['type'] = 'fund'
-                    stock_logger.info(f"查询到ETF: {info.get('name')} ({ts_code})")
-                    return info
-            else:
-                # A股查询
-                df = self.pro.stock_basic(ts_code=ts_code, fields='ts_code,symbol,name,area,industry,list_date')
-                if not df.empty:
-                    info = df.iloc[0].to_dict()
-                    info['type'] = 'stock'
-                    stock_logger.info(f"查询到股票: {info.get('name')} ({ts_code})")
-                    return info
-            
-            stock_logger.warning(f"未查询到股票信息: {ts_code}")
-            return None
+            info = security_master.get(ts_code)
+            if info:
+                return info
+            info = self.info_cache.get(ts_code)
+            if self.info_cache.missing(info):
+                info = self._fetch_stock_info(ts_code, self.detect_code_type(ts_code))
+                self.info_cache.set(ts_code, info)
+            # 返回副本，调用方修改不影响缓存
+            return dict(info) if info else None
         except Exception as e:
             stock_logger.error(f"获取股票信息失败: {stock_code}", exc_info=True)
             print(f"获取信息失败: {e}")
             return None
     
+    def _fetch_stock_info(self, ts_code, code_type):
+        """从Tushare查询基本信息，不存在时返回None，接口异常向上抛出"""
+        stock_logger.debug(f"查询股票信息: {ts_code}, 类型: {code_type}")
+        
+        if code_type == 'index':
+            # 指数查询
+            df = self.pro.index_basic(ts_code=ts_code, fields='ts_code,name,market,publisher,category')
+            if not df.empty:
+                info = df.iloc[0].to_dict()
+                info['type'] = 'index'
+                stock_logger.info(f"查询到指数: {info.get('name')} ({ts_code})")
+                return info
+        elif code_type == 'fund':
+            # ETF查询
+            df = self.pro.fund_basic(ts_code=ts_code, market='E', fields='ts_code,name,management,fund_type,issue_date,list_date')
+            if not df.empty:
+                info = df.iloc[0].to_dict()
+                info['type'] = 'fund'
+                stock_logger.info(f"查询到ETF: {info.get('name')} ({ts_code})")
+                return info
+        else:
+            # A股查询
+            df = self.pro.stock_basic(ts_code=ts_code, fields='ts_code,symbol,name,area,industry,list_date')
+            if not df.empty:
+                info = df.iloc[0].to_dict()
+                info['type'] = 'stock'
+                stock_logger.info(f"查询到股票: {info.get('name')} ({ts_code})")
+                return info
+        
+        stock_logger.warning(f"未查询到股票信息: {ts_code}")
+        return None
+    
     def fetch_daily_data(self, stock_code, start_date=None, end_date=None):
-        """获取日K线数据（支持A股、指数、ETF）"""
+        """获取日K线数据（支持A股、指数、ETF）
+
+        Returns:
+            DataFrame: 按日期正序，trade_date 为 Timestamp；无数据或失败时为空 DataFrame
+        """
         try:
             ts_code = self.normalize_stock_code(stock_code)
             code_type = self.detect_code_type(stock_code)
@@ -183,19 +275,23 @@ class StockService:
             
             if df.empty:
                 stock_logger.warning(f"日K线数据为空: {ts_code}")
-                return []
+                return pd.DataFrame()
             
             df['trade_date'] = pd.to_datetime(df['trade_date'])
-            df = df.sort_values('trade_date')
+            df = df.sort_values('trade_date', ignore_index=True)
             stock_logger.info(f"获取日K线成功: {ts_code}, 数据条数: {len(df)}")
-            return df.to_dict('records')
+            return df
         except Exception as e:
             stock_logger.error(f"获取日K线失败: {stock_code}, {start_date} - {end_date}", exc_info=True)
             print(f"获取日K线数据失败: {e}")
-            return []
+            return pd.DataFrame()
     
     def fetch_weekly_data(self, stock_code, start_date=None, end_date=None):
-        """获取周K线数据（支持A股、指数、ETF）"""
+        """获取周K线数据（支持A股、指数、ETF）
+
+        Returns:
+            DataFrame: 按日期正序，trade_date 为 Timestamp；无数据或失败时为空 DataFrame
+        """
         try:
             ts_code = self.normalize_stock_code(stock_code)
             code_type = self.detect_code_type(stock_code)
@@ -213,38 +309,27 @@ class StockService:
                 # ETF周线数据 - Tushare可能不支持，使用日线数据聚合
                 daily_df = self.pro.fund_daily(ts_code=ts_code, start_date=start_date, end_date=end_date)
                 if daily_df.empty:
-                    return []
-                # 转换为周线
+                    return pd.DataFrame()
+                # 转换为周线（与 rebuild_weekly_from_daily 同一口径，避免同一周写入两条不同日期的周K）
                 daily_df['trade_date'] = pd.to_datetime(daily_df['trade_date'])
-                daily_df = daily_df.set_index('trade_date')
-                weekly_df = daily_df.resample('W').agg({
-                    'open': 'first',
-                    'high': 'max',
-                    'low': 'min',
-                    'close': 'last',
-                    'vol': 'sum',
-                    'amount': 'sum'
-                }).dropna()
-                weekly_df['ts_code'] = ts_code
-                weekly_df = weekly_df.reset_index()
-                weekly_df = weekly_df.rename(columns={'trade_date': 'trade_date'})
-                df = weekly_df
+                df = _aggregate_weekly(daily_df)
+                df['ts_code'] = ts_code
             else:
                 # A股周线数据
                 df = self.pro.weekly(ts_code=ts_code, start_date=start_date, end_date=end_date)
             
             if df.empty:
-                return []
+                return pd.DataFrame()
             
             if 'trade_date' in df.columns:
                 df['trade_date'] = pd.to_datetime(df['trade_date'])
-                df = df.sort_values('trade_date')
+                df = df.sort_values('trade_date', ignore_index=True)
             stock_logger.info(f"获取周K线成功: {ts_code}, 数据条数: {len(df)}")
-            return df.to_dict('records')
+            return df
         except Exception as e:
             stock_logger.error(f"获取周K线失败: {stock_code}, {start_date} - {end_date}", exc_info=True)
             print(f"获取周K线数据失败: {e}")
-            return []
+            return pd.DataFrame()
     
     def fetch_minute_data(self, stock_code, freq='1min'):
         """获取分钟K线数据
@@ -273,8 +358,8 @@ class StockService:
                 print(f"指数不支持分钟K线数据")
                 return []
             
-            # API限流 - 分钟K线需要特别注意，每分钟最多2次
-            self._rate_limit_check(f'pro_bar_{freq}', min_interval=30)
+            # API限流 - 分钟K线需要特别注意，每分钟最多2次（配额见 TUSHARE_RATE_LIMITS）
+            rate_limiter.acquire('pro_bar')
             
             # 获取最近2天的数据（考虑周末，取4天）
             end_date = datetime.now()
@@ -361,109 +446,55 @@ class StockService:
         
         return df
     
-    def save_daily_data(self, data_list):
-        """保存日K线数据到数据库"""
-        if not data_list:
+    def _save_kline(self, table, time_col, data):
+        """批量写入K线（日K/周K/分钟K共用）
+
+        按列转换为参数元组，不逐行构建字典；SQLite和MySQL使用同一组%s占位符。
+        写入后更新这些股票的数据版本，使接口响应缓存失效
+        """
+        df = _as_frame(data)
+        if df.empty:
             return 0
         
         from config import config
+        columns = f"ts_code, {time_col}, open, high, low, close, volume, amount"
         if config.DATABASE_TYPE == 'sqlite':
-            # SQLite使用INSERT OR REPLACE
-            query = """
-            INSERT OR REPLACE INTO stock_daily (ts_code, trade_date, open, high, low, close, volume, amount)
+            query = f"""
+            INSERT OR REPLACE INTO {table} ({columns})
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
-            # 转换为元组列表，并处理Timestamp类型
-            params_list = []
-            for d in data_list:
-                trade_date = d['trade_date']
-                # 转换pandas Timestamp为字符串
-                if hasattr(trade_date, 'strftime'):
-                    trade_date = trade_date.strftime('%Y-%m-%d')
-                params_list.append((
-                    d['ts_code'], trade_date, d['open'], d['high'], d['low'], 
-                    d['close'], d.get('vol', 0), d.get('amount', 0)
-                ))
         else:
-            # MySQL使用命名占位符和ON DUPLICATE KEY UPDATE
-            query = """
-            INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, volume, amount)
-            VALUES (%(ts_code)s, %(trade_date)s, %(open)s, %(high)s, %(low)s, %(close)s, %(vol)s, %(amount)s)
+            query = f"""
+            INSERT INTO {table} ({columns})
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             ON DUPLICATE KEY UPDATE
             open=VALUES(open), high=VALUES(high), low=VALUES(low), 
             close=VALUES(close), volume=VALUES(volume), amount=VALUES(amount)
             """
-            params_list = data_list
         
-        return db_manager.execute_many(query, params_list)
+        unit = 's' if time_col == 'trade_time' else 'D'
+        params_list = list(zip(
+            _column_values(df['ts_code']),
+            _format_times(df[time_col], unit),
+            *(_column_values(df[col]) for col in ('open', 'high', 'low', 'close')),
+            _column_values(df['vol']) if 'vol' in df else [0] * len(df),
+            _column_values(df['amount']) if 'amount' in df else [0] * len(df)
+        ))
+        count = db_manager.execute_many(query, params_list)
+        data_versions.bump(df['ts_code'].unique().tolist())
+        return count
+    
+    def save_daily_data(self, data_list):
+        """保存日K线数据到数据库（data_list为字典列表或DataFrame）"""
+        return self._save_kline('stock_daily', 'trade_date', data_list)
     
     def save_weekly_data(self, data_list):
-        """保存周K线数据到数据库"""
-        if not data_list:
-            return 0
-        
-        from config import config
-        if config.DATABASE_TYPE == 'sqlite':
-            # SQLite使用INSERT OR REPLACE
-            query = """
-            INSERT OR REPLACE INTO stock_weekly (ts_code, trade_date, open, high, low, close, volume, amount)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            # 转换为元组列表，并处理Timestamp类型
-            params_list = []
-            for d in data_list:
-                trade_date = d['trade_date']
-                # 转换pandas Timestamp为字符串
-                if hasattr(trade_date, 'strftime'):
-                    trade_date = trade_date.strftime('%Y-%m-%d')
-                params_list.append((
-                    d['ts_code'], trade_date, d['open'], d['high'], d['low'], 
-                    d['close'], d.get('vol', 0), d.get('amount', 0)
-                ))
-        else:
-            # MySQL使用命名占位符和ON DUPLICATE KEY UPDATE
-            query = """
-            INSERT INTO stock_weekly (ts_code, trade_date, open, high, low, close, volume, amount)
-            VALUES (%(ts_code)s, %(trade_date)s, %(open)s, %(high)s, %(low)s, %(close)s, %(vol)s, %(amount)s)
-            ON DUPLICATE KEY UPDATE
-            open=VALUES(open), high=VALUES(high), low=VALUES(low), 
-            close=VALUES(close), volume=VALUES(volume), amount=VALUES(amount)
-            """
-            params_list = data_list
-        
-        return db_manager.execute_many(query, params_list)
+        """保存周K线数据到数据库（data_list为字典列表或DataFrame）"""
+        return self._save_kline('stock_weekly', 'trade_date', data_list)
     
     def save_minute_data(self, data_list):
-        """保存分钟K线数据到数据库"""
-        if not data_list:
-            return 0
-        
-        from config import config
-        if config.DATABASE_TYPE == 'sqlite':
-            query = """
-            INSERT OR REPLACE INTO stock_minute (ts_code, trade_time, open, high, low, close, volume, amount)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            params_list = []
-            for d in data_list:
-                trade_time = d['trade_time']
-                if hasattr(trade_time, 'strftime'):
-                    trade_time = trade_time.strftime('%Y-%m-%d %H:%M:%S')
-                params_list.append((
-                    d['ts_code'], trade_time, d['open'], d['high'], d['low'],
-                    d['close'], d.get('vol', 0), d.get('amount', 0)
-                ))
-        else:
-            query = """
-            INSERT INTO stock_minute (ts_code, trade_time, open, high, low, close, volume, amount)
-            VALUES (%(ts_code)s, %(trade_time)s, %(open)s, %(high)s, %(low)s, %(close)s, %(vol)s, %(amount)s)
-            ON DUPLICATE KEY UPDATE
-            open=VALUES(open), high=VALUES(high), low=VALUES(low),
-            close=VALUES(close), volume=VALUES(volume), amount=VALUES(amount)
-            """
-            params_list = data_list
-        
-        return db_manager.execute_many(query, params_list)
+        """保存分钟K线数据到数据库（data_list为字典列表或DataFrame）"""
+        return self._save_kline('stock_minute', 'trade_time', data_list)
     
     def save_indicators(self, stock_code, df):
         """保存技术指标到数据库"""
@@ -472,23 +503,7 @@ class StockService:
         
         # 只保存有效的指标数据
         df = df.dropna(subset=['macd', 'macd_signal', 'rsi_6'])
-        
-        data_list = []
-        for _, row in df.iterrows():
-            data_list.append({
-                'ts_code': stock_code,
-                'trade_date': row['trade_date'],
-                'macd': row['macd'],
-                'macd_signal': row['macd_signal'],
-                'macd_hist': row['macd_hist'],
-                'ema_12': row['ema_12'],
-                'ema_26': row['ema_26'],
-                'rsi_6': row['rsi_6'],
-                'rsi_12': row['rsi_12'],
-                'rsi_24': row['rsi_24']
-            })
-        
-        if not data_list:
+        if df.empty:
             return 0
         
         from config import config
@@ -499,32 +514,119 @@ class StockService:
                                          ema_12, ema_26, rsi_6, rsi_12, rsi_24)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
-            # 转换为元组列表，并处理Timestamp类型
-            params_list = []
-            for d in data_list:
-                trade_date = d['trade_date']
-                # 转换pandas Timestamp为字符串
-                if hasattr(trade_date, 'strftime'):
-                    trade_date = trade_date.strftime('%Y-%m-%d')
-                params_list.append((
-                    d['ts_code'], trade_date, d['macd'], d['macd_signal'], d['macd_hist'],
-                    d['ema_12'], d['ema_26'], d['rsi_6'], d['rsi_12'], d['rsi_24']
-                ))
         else:
-            # MySQL使用命名占位符和ON DUPLICATE KEY UPDATE
+            # MySQL使用ON DUPLICATE KEY UPDATE
             query = """
             INSERT INTO stock_indicators (ts_code, trade_date, macd, macd_signal, macd_hist, 
                                          ema_12, ema_26, rsi_6, rsi_12, rsi_24)
-            VALUES (%(ts_code)s, %(trade_date)s, %(macd)s, %(macd_signal)s, %(macd_hist)s,
-                    %(ema_12)s, %(ema_26)s, %(rsi_6)s, %(rsi_12)s, %(rsi_24)s)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ON DUPLICATE KEY UPDATE
             macd=VALUES(macd), macd_signal=VALUES(macd_signal), macd_hist=VALUES(macd_hist),
             ema_12=VALUES(ema_12), ema_26=VALUES(ema_26),
             rsi_6=VALUES(rsi_6), rsi_12=VALUES(rsi_12), rsi_24=VALUES(rsi_24)
             """
-            params_list = data_list
         
-        return db_manager.execute_many(query, params_list)
+        params_list = list(zip(
+            [stock_code] * len(df),
+            _format_times(df['trade_date'], 'D'),
+            *(_column_values(df[col]) for col in INDICATOR_FIELDS)
+        ))
+        count = db_manager.execute_many(query, params_list)
+        data_versions.bump([stock_code])
+        return count
+    
+    def _empty_realtime_result(self, ts_code):
+        """实时行情结果的初始结构"""
+        return {
+            'ts_code': ts_code,
+            'stock_name': None,
+            'price': None,
+            'open': None,
+            'pre_close': None,
+            'high': None,
+            'low': None,
+            'volume': None,
+            'amount': None,
+            'change': None,
+            'change_percent': None,
+            'turnover_ratio': None,
+            'amplitude': None,
+            'total_mv': None,
+            'circ_mv': None,
+            'pe': None,
+            'pe_ttm': None,
+            'pb': None,
+            'dv_ratio': None,
+            'trade_date': None,
+            'trade_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    def _apply_realtime_quote(self, result, real):
+        """填充旧版实时行情接口（get_realtime_quotes）的一行数据"""
+        result['stock_name'] = real.get('name', '')
+        result['price'] = float(real.get('price', 0)) if real.get('price') else None
+        result['open'] = float(real.get('open', 0)) if real.get('open') else None
+        result['pre_close'] = float(real.get('pre_close', 0)) if real.get('pre_close') else None
+        result['high'] = float(real.get('high', 0)) if real.get('high') else None
+        result['low'] = float(real.get('low', 0)) if real.get('low') else None
+        result['volume'] = float(real.get('volume', 0)) if real.get('volume') else None
+        result['amount'] = float(real.get('amount', 0)) if real.get('amount') else None
+        result['change'] = float(real.get('change', 0)) if real.get('change') else None
+        result['turnover_ratio'] = float(real.get('turnoverratio', 0)) if real.get('turnoverratio') else None
+        
+        # 涨跌幅（注意字段名可能是changepercent）
+        change_pct = real.get('changepercent') or real.get('p_change')
+        if change_pct:
+            result['change_percent'] = float(change_pct)
+        
+        # 计算振幅
+        if result['high'] and result['low'] and result['pre_close'] and result['pre_close'] > 0:
+            result['amplitude'] = (result['high'] - result['low']) / result['pre_close'] * 100
+        
+        # 交易日期（实时接口可能没有，用今天日期）
+        result['trade_date'] = datetime.now().strftime('%Y%m%d')
+    
+    def _apply_daily_basic(self, result, basic):
+        """填充基本面数据（市值、PE、PB等）"""
+        result['total_mv'] = float(basic.get('total_mv', 0)) if basic.get('total_mv') else None
+        result['circ_mv'] = float(basic.get('circ_mv', 0)) if basic.get('circ_mv') else None
+        result['pe'] = float(basic.get('pe', 0)) if basic.get('pe') else None
+        result['pe_ttm'] = float(basic.get('pe_ttm', 0)) if basic.get('pe_ttm') else None
+        result['pb'] = float(basic.get('pb', 0)) if basic.get('pb') else None
+        result['dv_ratio'] = float(basic.get('dv_ratio', 0)) if basic.get('dv_ratio') else None
+        
+        # 如果实时接口没获取到交易日期，用基本面的
+        if not result['trade_date'] and basic.get('trade_date'):
+            result['trade_date'] = basic['trade_date']
+    
+    def _apply_latest_daily(self, result, ts_code, code_type):
+        """实时接口失败时，降级使用最新一根日K线"""
+        try:
+            if code_type == 'index':
+                df = self.pro.index_daily(ts_code=ts_code)
+            elif code_type == 'fund':
+                df = self.pro.fund_daily(ts_code=ts_code)
+            else:
+                df = self.pro.daily(ts_code=ts_code)
+            
+            if df is not None and not df.empty:
+                df = df.sort_values('trade_date', ascending=False)
+                latest = df.iloc[0]
+                
+                result['price'] = float(latest['close'])
+                result['open'] = float(latest.get('open', 0)) if latest.get('open') else None
+                result['pre_close'] = float(latest.get('pre_close', 0)) if latest.get('pre_close') else None
+                result['high'] = float(latest.get('high', 0)) if latest.get('high') else None
+                result['low'] = float(latest.get('low', 0)) if latest.get('low') else None
+                result['volume'] = float(latest.get('vol', 0)) if latest.get('vol') else None
+                result['amount'] = float(latest.get('amount', 0)) if latest.get('amount') else None
+                result['change'] = float(latest.get('change', 0)) if latest.get('change') else None
+                result['change_percent'] = float(latest.get('pct_chg', 0)) if latest.get('pct_chg') else None
+                result['trade_date'] = latest['trade_date']
+                
+                stock_logger.info(f"降级使用日K线数据: {ts_code}, 价格: {result['price']}")
+        except Exception as e:
+            stock_logger.error(f"日K线数据获取失败: {ts_code}, {e}")
     
     def fetch_realtime_price(self, stock_code):
         """获取股票完整实时行情数据（使用旧版免费接口）
@@ -539,60 +641,16 @@ class StockService:
             stock_logger.debug(f"获取实时行情: {ts_code}, 类型: {code_type}")
             
             # 准备结果字典
-            result = {
-                'ts_code': ts_code,
-                'stock_name': None,
-                'price': None,
-                'open': None,
-                'pre_close': None,
-                'high': None,
-                'low': None,
-                'volume': None,
-                'amount': None,
-                'change': None,
-                'change_percent': None,
-                'turnover_ratio': None,
-                'amplitude': None,
-                'total_mv': None,
-                'circ_mv': None,
-                'pe': None,
-                'pe_ttm': None,
-                'pb': None,
-                'dv_ratio': None,
-                'trade_date': None,
-                'trade_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
+            result = self._empty_realtime_result(ts_code)
             
             # 1. 获取实时行情数据（旧版免费接口）
             try:
                 stock_code_simple = ts_code.split('.')[0]
+                rate_limiter.acquire('get_realtime_quotes')
                 df_real = ts.get_realtime_quotes(stock_code_simple)
                 
                 if not df_real.empty:
-                    real = df_real.iloc[0]
-                    result['stock_name'] = real.get('name', '')
-                    result['price'] = float(real.get('price', 0)) if real.get('price') else None
-                    result['open'] = float(real.get('open', 0)) if real.get('open') else None
-                    result['pre_close'] = float(real.get('pre_close', 0)) if real.get('pre_close') else None
-                    result['high'] = float(real.get('high', 0)) if real.get('high') else None
-                    result['low'] = float(real.get('low', 0)) if real.get('low') else None
-                    result['volume'] = float(real.get('volume', 0)) if real.get('volume') else None
-                    result['amount'] = float(real.get('amount', 0)) if real.get('amount') else None
-                    result['change'] = float(real.get('change', 0)) if real.get('change') else None
-                    result['turnover_ratio'] = float(real.get('turnoverratio', 0)) if real.get('turnoverratio') else None
-                    
-                    # 涨跌幅（注意字段名可能是changepercent）
-                    change_pct = real.get('changepercent') or real.get('p_change')
-                    if change_pct:
-                        result['change_percent'] = float(change_pct)
-                    
-                    # 计算振幅
-                    if result['high'] and result['low'] and result['pre_close'] and result['pre_close'] > 0:
-                        result['amplitude'] = (result['high'] - result['low']) / result['pre_close'] * 100
-                    
-                    # 交易日期（实时接口可能没有，用今天日期）
-                    result['trade_date'] = datetime.now().strftime('%Y%m%d')
-                    
+                    self._apply_realtime_quote(result, df_real.iloc[0])
                     stock_logger.info(f"实时行情获取成功: {ts_code}, 价格: {result['price']}")
             except Exception as e:
                 stock_logger.warning(f"旧版实时行情接口失败: {ts_code}, {e}")
@@ -601,50 +659,14 @@ class StockService:
             try:
                 df_basic = self.pro.daily_basic(ts_code=ts_code, limit=1)
                 if not df_basic.empty:
-                    basic = df_basic.iloc[0]
-                    result['total_mv'] = float(basic.get('total_mv', 0)) if basic.get('total_mv') else None
-                    result['circ_mv'] = float(basic.get('circ_mv', 0)) if basic.get('circ_mv') else None
-                    result['pe'] = float(basic.get('pe', 0)) if basic.get('pe') else None
-                    result['pe_ttm'] = float(basic.get('pe_ttm', 0)) if basic.get('pe_ttm') else None
-                    result['pb'] = float(basic.get('pb', 0)) if basic.get('pb') else None
-                    result['dv_ratio'] = float(basic.get('dv_ratio', 0)) if basic.get('dv_ratio') else None
-                    
-                    # 如果实时接口没获取到交易日期，用基本面的
-                    if not result['trade_date'] and basic.get('trade_date'):
-                        result['trade_date'] = basic['trade_date']
-                    
+                    self._apply_daily_basic(result, df_basic.iloc[0])
                     stock_logger.info(f"基本面数据获取成功: {ts_code}")
             except Exception as e:
                 stock_logger.warning(f"基本面数据获取失败: {ts_code}, {e}")
             
             # 3. 如果实时接口失败，降级使用日K线数据
             if not result['price']:
-                try:
-                    if code_type == 'index':
-                        df = self.pro.index_daily(ts_code=ts_code)
-                    elif code_type == 'fund':
-                        df = self.pro.fund_daily(ts_code=ts_code)
-                    else:
-                        df = self.pro.daily(ts_code=ts_code)
-                    
-                    if df is not None and not df.empty:
-                        df = df.sort_values('trade_date', ascending=False)
-                        latest = df.iloc[0]
-                        
-                        result['price'] = float(latest['close'])
-                        result['open'] = float(latest.get('open', 0)) if latest.get('open') else None
-                        result['pre_close'] = float(latest.get('pre_close', 0)) if latest.get('pre_close') else None
-                        result['high'] = float(latest.get('high', 0)) if latest.get('high') else None
-                        result['low'] = float(latest.get('low', 0)) if latest.get('low') else None
-                        result['volume'] = float(latest.get('vol', 0)) if latest.get('vol') else None
-                        result['amount'] = float(latest.get('amount', 0)) if latest.get('amount') else None
-                        result['change'] = float(latest.get('change', 0)) if latest.get('change') else None
-                        result['change_percent'] = float(latest.get('pct_chg', 0)) if latest.get('pct_chg') else None
-                        result['trade_date'] = latest['trade_date']
-                        
-                        stock_logger.info(f"降级使用日K线数据: {ts_code}, 价格: {result['price']}")
-                except Exception as e:
-                    stock_logger.error(f"日K线数据获取失败: {ts_code}, {e}")
+                self._apply_latest_daily(result, ts_code, code_type)
             
             # 检查是否至少获取到了价格
             if result['price']:
@@ -657,87 +679,139 @@ class StockService:
             stock_logger.error(f"获取实时行情失败: {stock_code}", exc_info=True)
             return None
     
+    def fetch_daily_basic_latest(self, ts_codes, max_lookback=10):
+        """一次调用获取最近一个交易日全市场的基本面数据，只返回ts_codes中的股票
+        
+        从今天往前逐日查找第一个有数据的交易日（盘中当天数据尚未发布）
+        
+        Returns:
+            dict: {ts_code: 基本面数据字典}
+        """
+        for i in range(max_lookback):
+            trade_date = (datetime.now() - timedelta(days=i)).strftime('%Y%m%d')
+            df = self.pro.daily_basic(trade_date=trade_date)
+            if df is not None and not df.empty:
+                df = df[df['ts_code'].isin(ts_codes)]
+                return {row['ts_code']: row for row in df.to_dict('records')}
+        return {}
+    
+    def fetch_realtime_prices(self, stock_codes, executor=None):
+        """批量获取实时行情
+        
+        - 实时行情按 REALTIME_CHUNK_SIZE 分组，一次请求多只股票，
+          REALTIME_WORKERS 个线程并发请求，共享 get_realtime_quotes 的令牌桶配额
+        - 基本面数据按交易日一次获取全市场
+        - 实时接口没有价格的股票逐只降级使用日K线
+        - 传入executor时使用调用方的线程池（调度器的实时通道），否则临时创建
+        
+        Returns:
+            list: 获取到价格的实时行情字典列表
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        
+        ts_codes = list(dict.fromkeys(self.normalize_stock_code(c) for c in stock_codes))
+        if not ts_codes:
+            return []
+        results = {ts_code: self._empty_realtime_result(ts_code) for ts_code in ts_codes}
+        
+        # 实时接口只认6位代码（指数和同号股票会映射到同一行，与逐只获取时一致）
+        by_simple = {}
+        for ts_code in ts_codes:
+            by_simple.setdefault(ts_code.split('.')[0], []).append(ts_code)
+        simple_codes = list(by_simple)
+        chunk_size = config.REALTIME_CHUNK_SIZE
+        chunks = [simple_codes[i:i + chunk_size] for i in range(0, len(simple_codes), chunk_size)]
+        
+        def fetch_chunk(chunk):
+            rate_limiter.acquire('get_realtime_quotes')
+            return ts.get_realtime_quotes(chunk)
+        
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=config.REALTIME_WORKERS)
+        try:
+            futures = {executor.submit(fetch_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    df_real = future.result()
+                except Exception as e:
+                    stock_logger.warning(f"批量实时行情接口失败: {futures[future][:3]}..., {e}")
+                    continue
+                if df_real is None or df_real.empty:
+                    continue
+                for real in df_real.to_dict('records'):
+                    for ts_code in by_simple.get(real.get('code'), []):
+                        self._apply_realtime_quote(results[ts_code], real)
+        finally:
+            if own_executor:
+                executor.shutdown()
+        
+        try:
+            basics = self.fetch_daily_basic_latest(ts_codes)
+            for ts_code, basic in basics.items():
+                self._apply_daily_basic(results[ts_code], basic)
+        except Exception as e:
+            stock_logger.warning(f"批量基本面数据获取失败: {e}")
+        
+        for ts_code, result in results.items():
+            if not result['price']:
+                self._apply_latest_daily(result, ts_code, self.detect_code_type(ts_code))
+        
+        prices = [result for result in results.values() if result['price']]
+        stock_logger.info(f"批量实时行情: {len(prices)}/{len(ts_codes)}只, 实时接口请求{len(chunks)}次")
+        return prices
+    
+    def save_realtime_prices(self, price_list):
+        """批量保存实时行情到数据库（一次executemany），写入后推送给订阅了这些股票的客户端
+        
+        Returns:
+            int: 写入的行数
+        """
+        if not price_list:
+            return 0
+        
+        from config import config
+        columns = """
+            ts_code, stock_name, price, open, pre_close, high, low, 
+            volume, amount, change, change_percent, turnover_ratio, amplitude,
+            total_mv, circ_mv, pe, pe_ttm, pb, dv_ratio, trade_date, updated_at
+        """
+        placeholders = ', '.join(['%s'] * len(REALTIME_FIELDS))
+        if config.DATABASE_TYPE == 'sqlite':
+            query = f"""
+            INSERT OR REPLACE INTO stock_realtime ({columns})
+            VALUES ({placeholders})
+            """
+        else:
+            query = f"""
+            INSERT INTO stock_realtime ({columns})
+            VALUES ({placeholders})
+            ON DUPLICATE KEY UPDATE
+            stock_name=VALUES(stock_name), price=VALUES(price), open=VALUES(open), 
+            pre_close=VALUES(pre_close), high=VALUES(high), low=VALUES(low), 
+            volume=VALUES(volume), amount=VALUES(amount), change=VALUES(change), 
+            change_percent=VALUES(change_percent), turnover_ratio=VALUES(turnover_ratio), 
+            amplitude=VALUES(amplitude), total_mv=VALUES(total_mv), circ_mv=VALUES(circ_mv),
+            pe=VALUES(pe), pe_ttm=VALUES(pe_ttm), pb=VALUES(pb), dv_ratio=VALUES(dv_ratio), 
+            trade_date=VALUES(trade_date), updated_at=VALUES(updated_at)
+            """
+        
+        params_list = [
+            (price_data['ts_code'],) + tuple(price_data.get(field) for field in REALTIME_FIELDS[1:])
+            for price_data in price_list
+        ]
+        count = db_manager.execute_many(query, params_list)
+        # 通知实时行情推送（SSE订阅者）
+        quote_hub.notify(row[0] for row in params_list)
+        return count
+    
     def save_realtime_price(self, price_data):
         """保存完整实时行情到数据库"""
         if not price_data:
             return False
         
-        from config import config
         try:
-            if config.DATABASE_TYPE == 'sqlite':
-                query = """
-                INSERT OR REPLACE INTO stock_realtime (
-                    ts_code, stock_name, price, open, pre_close, high, low, 
-                    volume, amount, change, change_percent, turnover_ratio, amplitude,
-                    total_mv, circ_mv, pe, pe_ttm, pb, dv_ratio, trade_date, updated_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                params = (
-                    price_data['ts_code'],
-                    price_data.get('stock_name'),
-                    price_data.get('price'),
-                    price_data.get('open'),
-                    price_data.get('pre_close'),
-                    price_data.get('high'),
-                    price_data.get('low'),
-                    price_data.get('volume'),
-                    price_data.get('amount'),
-                    price_data.get('change'),
-                    price_data.get('change_percent'),
-                    price_data.get('turnover_ratio'),
-                    price_data.get('amplitude'),
-                    price_data.get('total_mv'),
-                    price_data.get('circ_mv'),
-                    price_data.get('pe'),
-                    price_data.get('pe_ttm'),
-                    price_data.get('pb'),
-                    price_data.get('dv_ratio'),
-                    price_data.get('trade_date'),
-                    price_data.get('trade_time')
-                )
-            else:
-                query = """
-                INSERT INTO stock_realtime (
-                    ts_code, stock_name, price, open, pre_close, high, low, 
-                    volume, amount, change, change_percent, turnover_ratio, amplitude,
-                    total_mv, circ_mv, pe, pe_ttm, pb, dv_ratio, trade_date, updated_at
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                stock_name=VALUES(stock_name), price=VALUES(price), open=VALUES(open), 
-                pre_close=VALUES(pre_close), high=VALUES(high), low=VALUES(low), 
-                volume=VALUES(volume), amount=VALUES(amount), change=VALUES(change), 
-                change_percent=VALUES(change_percent), turnover_ratio=VALUES(turnover_ratio), 
-                amplitude=VALUES(amplitude), total_mv=VALUES(total_mv), circ_mv=VALUES(circ_mv), 
-                pe=VALUES(pe), pe_ttm=VALUES(pe_ttm), pb=VALUES(pb), dv_ratio=VALUES(dv_ratio), 
-                trade_date=VALUES(trade_date), updated_at=VALUES(updated_at)
-                """
-                params = (
-                    price_data['ts_code'],
-                    price_data.get('stock_name'),
-                    price_data.get('price'),
-                    price_data.get('open'),
-                    price_data.get('pre_close'),
-                    price_data.get('high'),
-                    price_data.get('low'),
-                    price_data.get('volume'),
-                    price_data.get('amount'),
-                    price_data.get('change'),
-                    price_data.get('change_percent'),
-                    price_data.get('turnover_ratio'),
-                    price_data.get('amplitude'),
-                    price_data.get('total_mv'),
-                    price_data.get('circ_mv'),
-                    price_data.get('pe'),
-                    price_data.get('pe_ttm'),
-                    price_data.get('pb'),
-                    price_data.get('dv_ratio'),
-                    price_data.get('trade_date'),
-                    price_data.get('trade_time')
-                )
-            
-            db_manager.execute_update(query, params)
+            self.save_realtime_prices([price_data])
             stock_logger.info(f"保存实时行情成功: {price_data['ts_code']}")
             return True
         except Exception as e:
@@ -765,72 +839,342 @@ class StockService:
             stock_logger.error(f"获取实时价格失败: {stock_code}", exc_info=True)
             return None
     
-    def update_kline_data_only(self, stock_code):
-        """仅更新日K线和周K线数据（不包含分钟K）"""
+    def get_realtime_prices(self, ts_codes):
+        """从数据库批量获取实时行情（一次查询），返回 {ts_code: 行情字典}"""
+        ts_codes = list(ts_codes)
+        if not ts_codes:
+            return {}
+        query = f"""
+        SELECT ts_code, stock_name, price, open, pre_close, high, low, 
+               volume, amount, change, change_percent, turnover_ratio, amplitude,
+               total_mv, circ_mv, pe, pe_ttm, pb, dv_ratio, trade_date, updated_at
+        FROM stock_realtime
+        WHERE ts_code IN ({', '.join(['%s'] * len(ts_codes))})
+        """
+        return {row['ts_code']: row for row in db_manager.execute_query(query, tuple(ts_codes))}
+    
+    def get_kline_watermark(self, ts_code, period='daily'):
+        """获取数据库中最新一根K线的日期（水位线），无数据返回None"""
+        table, time_col = self._kline_table(period)
+        query = f"SELECT MAX({time_col}) AS latest FROM {table} WHERE ts_code = %s"
+        result = db_manager.execute_query(query, (ts_code,), fetch_one=True)
+        if not result or not result['latest']:
+            return None
+        return pd.Timestamp(result['latest']).to_pydatetime()
+    
+    def _incremental_start_date(self, ts_code, period):
+        """增量拉取的起始日期（Tushare格式），无历史数据时返回None表示全量拉取
+        
+        从水位线当天开始重拉，以便覆盖盘中写入的未完成K线
+        """
+        watermark = self.get_kline_watermark(ts_code, period)
+        if watermark is None:
+            return None
+        if period == 'weekly':
+            # 周K从上一周开始重拉，保证当周的聚合区间完整
+            watermark -= timedelta(days=7)
+        return watermark.strftime('%Y%m%d')
+    
+    def _filter_changed_bars(self, period, ts_code, bars):
+        """只保留数据库中不存在或数值有变化的K线，避免重复写入（bars 为 DataFrame，返回其子集）"""
+        if bars.empty:
+            return bars
+        
+        table, time_col = self._kline_table(period)
+        dates = _format_times(bars[time_col])
+        query = f"""
+        SELECT {time_col}, {', '.join(KLINE_VALUE_FIELDS)}
+        FROM {table}
+        WHERE ts_code = %s AND {time_col} >= %s
+        """
+        existing = db_manager.execute_query(query, (ts_code, min(dates)), row_mode='tuple')
+        stored = {str(row[0])[:10]: row[1:] for row in existing}
+        
+        new_rows = zip(*(
+            _column_values(bars[col]) if col in bars else [0] * len(bars)
+            for col in ('open', 'high', 'low', 'close', 'vol', 'amount')
+        ))
+        changed = [
+            old is None or any(self._value_changed(a, b, digits) for a, b, digits in zip(old, new, KLINE_VALUE_DIGITS))
+            for old, new in zip((stored.get(d) for d in dates), new_rows)
+        ]
+        return bars[changed]
+    
+    def _value_changed(self, old, new, digits=2):
+        """按数据库保存的精度比较数据库值和接口值
+
+        价格/成交额保留两位小数，成交量为整数（Tushare返回的成交量带小数，MySQL BIGINT写入时四舍五入）；
+        与MySQL一致按四舍五入取整，不用 round() 的银行家舍入
+        """
+        if old is None or new is None:
+            return old is not new
+        try:
+            quantum = Decimal(1).scaleb(-digits)
+            return (Decimal(repr(float(old))).quantize(quantum, ROUND_HALF_UP)
+                    != Decimal(repr(float(new))).quantize(quantum, ROUND_HALF_UP))
+        except (TypeError, ValueError):
+            return old != new
+    
+    def update_kline_data_only(self, stock_code, full=False):
+        """仅更新日K线和周K线数据（不包含分钟K）
+        
+        Args:
+            stock_code: 股票代码
+            full: True时全量回补（日K一年、周K两年）；默认按水位线增量拉取，只写入新增或变化的K线
+        """
         try:
             ts_code = self.normalize_stock_code(stock_code)
             
             # 获取日K线数据
-            daily_data = self.fetch_daily_data(stock_code)
-            if daily_data:
+            start_date = None if full else self._incremental_start_date(ts_code, 'daily')
+            daily_data = self.fetch_daily_data(stock_code, start_date=start_date)
+            if not full:
+                daily_data = self._filter_changed_bars('daily', ts_code, daily_data)
+            if not daily_data.empty:
                 self.save_daily_data(daily_data)
                 
-                # 计算并保存指标
-                df = pd.DataFrame(daily_data)
-                df = self.calculate_indicators(df)
-                self.save_indicators(ts_code, df)
+                # 计算并保存指标（增量引擎只处理新增K线）
+                from services.indicator_engine import indicator_engine
+                if full:
+                    indicator_engine.rebuild(ts_code)
+                else:
+                    changed_from = daily_data['trade_date'].min().strftime('%Y-%m-%d')
+                    indicator_engine.update(ts_code, changed_from=changed_from)
             
             # 获取周K线数据
-            weekly_data = self.fetch_weekly_data(stock_code)
-            if weekly_data:
+            start_date = None if full else self._incremental_start_date(ts_code, 'weekly')
+            weekly_data = self.fetch_weekly_data(stock_code, start_date=start_date)
+            if not full:
+                weekly_data = self._filter_changed_bars('weekly', ts_code, weekly_data)
+            if not weekly_data.empty:
                 self.save_weekly_data(weekly_data)
             
+            stock_logger.info(
+                f"K线{'全量' if full else '增量'}更新: {ts_code}, "
+                f"日K写入{len(daily_data)}条, 周K写入{len(weekly_data)}条"
+            )
             return True
         except Exception as e:
             stock_logger.error(f"更新K线数据失败: {stock_code}", exc_info=True)
             return False
     
-    def update_stock_data(self, stock_code):
+    def update_stock_data(self, stock_code, full=False):
         """更新股票数据（日K线、周K线、指标、实时价格）
         
         注意：不再获取1分钟K线数据，改为实时价格
+        
+        Args:
+            full: True时全量回补K线，否则增量更新
         """
         try:
-            ts_code = self.normalize_stock_code(stock_code)
-            
             # 获取实时价格
             price_data = self.fetch_realtime_price(stock_code)
             if price_data:
                 self.save_realtime_price(price_data)
             
-            # 获取日K线数据
-            daily_data = self.fetch_daily_data(stock_code)
-            if daily_data:
-                self.save_daily_data(daily_data)
-                
-                # 计算并保存指标
-                df = pd.DataFrame(daily_data)
-                df = self.calculate_indicators(df)
-                self.save_indicators(ts_code, df)
-            
-            # 获取周K线数据
-            weekly_data = self.fetch_weekly_data(stock_code)
-            if weekly_data:
-                self.save_weekly_data(weekly_data)
-            
-            return True
+            # 获取日K、周K和指标
+            return self.update_kline_data_only(stock_code, full=full)
         except Exception as e:
             print(f"更新股票数据失败: {e}")
             stock_logger.error(f"更新股票数据失败: {stock_code}", exc_info=True)
             return False
     
-    def get_stock_data_from_db(self, stock_code, period='daily', days=60):
+    def fetch_daily_by_trade_date(self, trade_date, code_type='stock'):
+        """按交易日获取全市场日K（一次调用返回当天所有A股或ETF）
+        
+        Args:
+            trade_date: 交易日（Tushare格式 YYYYMMDD）
+            code_type: 'stock' 或 'fund'（指数接口不支持按交易日查询全市场）
+        """
+        if code_type == 'fund':
+            df = self.pro.fund_daily(trade_date=trade_date)
+        else:
+            df = self.pro.daily(trade_date=trade_date)
+        if df is None or df.empty:
+            return pd.DataFrame()
+        return df
+    
+    def rebuild_weekly_from_daily(self, ts_code, since):
+        """用数据库中的日K聚合重建周K（从since所在周的周一开始）
+        
+        周K的trade_date取该周最后一个交易日，与Tushare周线口径一致；
+        先删除这些周的旧记录，避免周中写入的未完成周K残留
+        """
+        since = pd.Timestamp(since)
+        week_start = (since - pd.Timedelta(days=since.dayofweek)).strftime('%Y-%m-%d')
+        query = """
+        SELECT trade_date, open, high, low, close, volume, amount FROM stock_daily
+        WHERE ts_code = %s AND trade_date >= %s
+        ORDER BY trade_date
+        """
+        daily = pd.DataFrame(db_manager.execute_query(query, (ts_code, week_start), row_mode='columns'))
+        if daily.empty:
+            return 0
+        
+        daily['trade_date'] = pd.to_datetime(daily['trade_date'])
+        weekly = _aggregate_weekly(daily.rename(columns={'volume': 'vol'}))
+        weekly['ts_code'] = ts_code
+        
+        db_manager.execute_update(
+            "DELETE FROM stock_weekly WHERE ts_code = %s AND trade_date >= %s", (ts_code, week_start)
+        )
+        return self.save_weekly_data(weekly)
+    
+    def update_kline_batch(self, stock_codes, executor=None):
+        """批量更新日K/周K：按交易日一次拉取全市场日K，再分发到各股票
+        
+        - A股/ETF：从最早的水位线到今天，每个交易日（按交易日历，跳过周末和节假日）各调用一次 daily/fund_daily，
+          API调用次数与股票数量无关；周K由日K聚合，不再调用周线接口
+        - 指数、无历史数据或落后超过 KLINE_BATCH_MAX_GAP_DAYS 天的股票：逐只调用 update_kline_data_only
+        - 传入executor时，逐只的步骤（指标/周K后处理、逐只更新）在线程池中并发执行，
+          Tushare调用仍受全局限流约束
+        
+        Returns:
+            dict: {'batched': 走批量路径的股票数, 'written': 写入的日K条数,
+                   'fallback': 逐只更新的股票数, 'failed': 失败的股票代码, 'api_calls': 批量接口调用次数}
+        """
+        from services.indicator_engine import indicator_engine
+        
+        result = {'batched': 0, 'written': 0, 'fallback': 0, 'failed': [], 'api_calls': 0}
+        cutoff = datetime.now() - timedelta(days=config.KLINE_BATCH_MAX_GAP_DAYS)
+        
+        watermarks = {'stock': {}, 'fund': {}}
+        fallback = []
+        for ts_code in dict.fromkeys(self.normalize_stock_code(c) for c in stock_codes):
+            code_type = self.detect_code_type(ts_code)
+            watermark = None if code_type == 'index' else self.get_kline_watermark(ts_code, 'daily')
+            if watermark is None or watermark < cutoff:
+                fallback.append(ts_code)
+            else:
+                watermarks[code_type][ts_code] = watermark
+        
+        today = datetime.now().date()
+        for code_type, group in watermarks.items():
+            if not group:
+                continue
+            result['batched'] += len(group)
+            
+            frames = []
+            for day in pd.date_range(min(group.values()).date(), today):
+                # 周末和节假日没有日K，不调用接口
+                if not trading_calendar.is_trading_day(day, 'A'):
+                    continue
+                result['api_calls'] += 1
+                try:
+                    df = self.fetch_daily_by_trade_date(day.strftime('%Y%m%d'), code_type)
+                except Exception as e:
+                    stock_logger.error(f"按交易日获取日K失败: {code_type} {day:%Y%m%d}, {e}")
+                    continue
+                if not df.empty:
+                    frames.append(df[df['ts_code'].isin(group)])
+            if not frames:
+                continue
+            
+            bars = pd.concat(frames, ignore_index=True)
+            bars['trade_date'] = pd.to_datetime(bars['trade_date'])
+            changed = {}
+            for ts_code, rows in bars.sort_values('trade_date').groupby('ts_code'):
+                rows = self._filter_changed_bars('daily', ts_code, rows)
+                if not rows.empty:
+                    changed[ts_code] = rows
+            if not changed:
+                continue
+            
+            result['written'] += self.save_daily_data(pd.concat(changed.values(), ignore_index=True))
+            
+            def post_process(item):
+                ts_code, rows = item
+                try:
+                    changed_from = rows['trade_date'].min().strftime('%Y-%m-%d')
+                    indicator_engine.update(ts_code, changed_from=changed_from)
+                    self.rebuild_weekly_from_daily(ts_code, changed_from)
+                    return True
+                except Exception as e:
+                    stock_logger.error(f"批量更新后处理失败: {ts_code}, {e}", exc_info=True)
+                    return False
+            
+            for ts_code, ok in zip(changed, _run_each(post_process, list(changed.items()), executor)):
+                if not ok:
+                    result['failed'].append(ts_code)
+        
+        for ts_code, ok in zip(fallback, _run_each(self.update_kline_data_only, fallback, executor)):
+            if ok:
+                result['fallback'] += 1
+            else:
+                result['failed'].append(ts_code)
+        
+        stock_logger.info(
+            f"K线批量更新: 批量{result['batched']}只（接口调用{result['api_calls']}次，写入日K{result['written']}条）, "
+            f"逐只{result['fallback']}只, 失败{len(result['failed'])}只"
+        )
+        return result
+    
+    def _kline_table(self, period):
+        """返回K线周期对应的表名和时间列"""
+        if period == 'minute':
+            return 'stock_minute', 'trade_time'
+        if period == 'weekly':
+            return 'stock_weekly', 'trade_date'
+        return 'stock_daily', 'trade_date'
+    
+    def get_kline_arrays(self, ts_code, period='daily', n=60):
+        """从数据库读取最近n条K线，返回连续数组（按时间正序）
+        
+        直接从游标元组转置为列，不构建逐行字典
+        
+        Returns:
+            dict: {'trade_date'（分钟K为'trade_time'）: datetime64[ns]数组,
+                   'open'/'high'/'low'/'close'/'volume'/'amount': float64数组}
+        """
+        table, time_col = self._kline_table(period)
+        query = f"""
+        SELECT {time_col}, {', '.join(KLINE_VALUE_FIELDS)}
+        FROM {table}
+        WHERE ts_code = %s
+        ORDER BY {time_col} DESC
+        LIMIT %s
+        """
+        rows = db_manager.execute_query(query, (ts_code, n), row_mode='tuple')
+        columns = list(zip(*reversed(rows))) if rows else [()] * (len(KLINE_VALUE_FIELDS) + 1)
+        
+        arrays = {time_col: np.asarray(pd.to_datetime(list(columns[0])), dtype='datetime64[ns]')}
+        for name, values in zip(KLINE_VALUE_FIELDS, columns[1:]):
+            # None -> NaN，MySQL的Decimal也在这里统一转为float64
+            arrays[name] = np.array(values, dtype=np.float64)
+        return arrays
+    
+    def get_kline_frame(self, ts_code, period='daily', n=60):
+        """从数据库读取最近n条K线，返回以时间为索引的DataFrame"""
+        arrays = self.get_kline_arrays(ts_code, period, n)
+        time_col = self._kline_table(period)[1]
+        index = pd.DatetimeIndex(arrays.pop(time_col), name=time_col)
+        return pd.DataFrame(arrays, index=index)
+    
+    def kline_arrays_to_columns(self, arrays):
+        """将K线数组转换为可JSON序列化的列式结构（NaN转为None）"""
+        result = {}
+        for name, values in arrays.items():
+            if values.dtype.kind == 'M':
+                unit = 'D' if name == 'trade_date' else 's'
+                result[name] = np.datetime_as_string(values, unit=unit).tolist()
+            else:
+                result[name] = np.where(np.isnan(values), None, values).tolist()
+        return result
+    
+    def _reverse_rows(self, data, row_mode):
+        """将按日期倒序查询的结果翻转为正序"""
+        if row_mode == 'columns':
+            return {col: values[::-1] for col, values in data.items()}
+        return list(reversed(data))
+    
+    def get_stock_data_from_db(self, stock_code, period='daily', days=60, row_mode='dict'):
         """从数据库获取股票数据
         
         Args:
             stock_code: 股票代码
             period: 'minute', 'daily', 'weekly'
             days: 天数（对于minute，表示分钟数）
+            row_mode: 行格式，'dict'（默认）、'tuple' 或 'columns'（列式，适合大批量读取）
         """
         if period == 'minute':
             # 分钟数据，days参数表示分钟数
@@ -840,8 +1184,8 @@ class StockService:
             ORDER BY trade_time DESC
             LIMIT %s
             """
-            data = db_manager.execute_query(query, (stock_code, days))
-            return list(reversed(data))
+            data = db_manager.execute_query(query, (stock_code, days), row_mode=row_mode)
+            return self._reverse_rows(data, row_mode)
         else:
             table = 'stock_daily' if period == 'daily' else 'stock_weekly'
             query = f"""
@@ -850,11 +1194,11 @@ class StockService:
             ORDER BY trade_date DESC
             LIMIT %s
             """
-            data = db_manager.execute_query(query, (stock_code, days))
-            return list(reversed(data))
+            data = db_manager.execute_query(query, (stock_code, days), row_mode=row_mode)
+            return self._reverse_rows(data, row_mode)
     
     
-    def get_indicators_from_db(self, stock_code, days=60):
+    def get_indicators_from_db(self, stock_code, days=60, row_mode='dict'):
         """从数据库获取技术指标"""
         query = """
         SELECT * FROM stock_indicators
@@ -863,8 +1207,8 @@ class StockService:
         LIMIT %s
         """
         
-        data = db_manager.execute_query(query, (stock_code, days))
-        return list(reversed(data))
+        data = db_manager.execute_query(query, (stock_code, days), row_mode=row_mode)
+        return self._reverse_rows(data, row_mode)
 
 
 # 创建全局股票服务实例
@@ -0,0 +1,144 @@
+"""
+交易日历服务
+- 交易日来自 Tushare trade_cal（A股，上交所日历）和 hk_tradecal（港股），按年缓存
+- 接口成功后写入离线文件，接口不可用时读取离线文件；都没有时按工作日（周一至周五）估算
+- 交易时段：A股 9:30-11:30、13:00-15:00；港股 9:30-12:00、13:00-16:00
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, time as dtime
+from config import config
+from utils.logger import stock_logger
+
+
+# 市场 -> (Tushare日历接口, 交易所参数)
+CALENDAR_SOURCES = {
+    'A': ('trade_cal', 'SSE'),
+    'HK': ('hk_tradecal', None),
+}
+
+# 市场 -> 交易时段（含首尾分钟，收盘那一分钟也拉取一次收盘价）
+SESSIONS = {
+    'A': ((dtime(9, 30), dtime(11, 30)), (dtime(13, 0), dtime(15, 0))),
+    'HK': ((dtime(9, 30), dtime(12, 0)), (dtime(13, 0), dtime(16, 0))),
+}
+
+# 非接口来源（离线文件/工作日估算）的日历，隔多久重试接口（秒）
+RETRY_INTERVAL = 3600
+
+
+def market_of(ts_code):
+    """根据代码后缀判断市场"""
+    return 'HK' if ts_code.upper().endswith('.HK') else 'A'
+
+
+class TradingCalendar:
+    """交易日历"""
+
+    def __init__(self, fallback_file=None):
+        self.fallback_file = fallback_file or config.TRADE_CALENDAR_FILE
+        self._cache = {}  # (market, year) -> (交易日集合或None, 来源, 加载时间)
+        self._lock = threading.Lock()
+
+    def _fetch(self, market, year):
+        """从Tushare获取一年的交易日（YYYYMMDD集合）"""
+        from services.stock_service import stock_service
+
+        api_name, exchange = CALENDAR_SOURCES[market]
+        params = {'start_date': f'{year}0101', 'end_date': f'{year}1231', 'is_open': '1'}
+        if exchange:
+            params['exchange'] = exchange
+        df = getattr(stock_service.pro, api_name)(**params)
+        if df is None or df.empty:
+            raise ValueError(f"交易日历为空: {market} {year}")
+        if 'is_open' in df.columns:
+            df = df[df['is_open'].astype(str) == '1']
+        return set(df['cal_date'].astype(str))
+
+    def _read_fallback(self):
+        if not os.path.exists(self.fallback_file):
+            return {}
+        try:
+            with open(self.fallback_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            stock_logger.warning(f"读取离线交易日历失败: {self.fallback_file}, {e}")
+            return {}
+
+    def _write_fallback(self, market, year, dates):
+        data = self._read_fallback()
+        data.setdefault(market, {})[str(year)] = sorted(dates)
+        try:
+            os.makedirs(os.path.dirname(self.fallback_file) or '.', exist_ok=True)
+            with open(self.fallback_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+        except OSError as e:
+            stock_logger.warning(f"写入离线交易日历失败: {self.fallback_file}, {e}")
+
+    def _load(self, market, year):
+        """加载一年的交易日：接口 -> 离线文件 -> None（按工作日估算）"""
+        try:
+            dates = self._fetch(market, year)
+            self._write_fallback(market, year, dates)
+            stock_logger.info(f"交易日历已加载: {market} {year}, {len(dates)}个交易日")
+            return dates, 'api'
+        except Exception as e:
+            stock_logger.warning(f"获取交易日历失败，使用离线数据: {market} {year}, {e}")
+
+        dates = self._read_fallback().get(market, {}).get(str(year))
+        if dates:
+            return set(dates), 'file'
+        return None, 'weekday'
+
+    def _dates(self, market, year):
+        key = (market, year)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and (cached[1] == 'api' or time.monotonic() - cached[2] < RETRY_INTERVAL):
+                return cached[0]
+            dates, source = self._load(market, year)
+            self._cache[key] = (dates, source, time.monotonic())
+            return dates
+
+    def is_trading_day(self, day=None, market='A'):
+        """是否交易日"""
+        day = day or datetime.now()
+        dates = self._dates(market, day.year)
+        if dates is None:
+            return day.weekday() < 5
+        return day.strftime('%Y%m%d') in dates
+
+    def is_session_open(self, dt=None, market='A'):
+        """是否处于交易时段"""
+        dt = dt or datetime.now()
+        now = dt.time().replace(second=0, microsecond=0)
+        if not any(start <= now <= end for start, end in SESSIONS[market]):
+            return False
+        return self.is_trading_day(dt, market)
+
+    def next_session_start(self, dt=None, market='A'):
+        """dt之后最近一个交易日的开盘时间（当天尚未开盘则为当天开盘）"""
+        dt = dt or datetime.now()
+        open_time = SESSIONS[market][0][0]
+        day = dt.date() if dt.time() < open_time else dt.date() + timedelta(days=1)
+        for _ in range(366):
+            start = datetime.combine(day, open_time)
+            if self.is_trading_day(start, market):
+                return start
+            day += timedelta(days=1)
+        return datetime.combine(day, open_time)
+
+    def open_markets(self, dt=None, markets=None):
+        """当前处于交易时段的市场列表"""
+        return [m for m in (markets or SESSIONS) if self.is_session_open(dt, m)]
+
+    def source(self, market='A', year=None):
+        """日历来源：'api'、'file' 或 'weekday'，未加载时为None"""
+        cached = self._cache.get((market, year or datetime.now().year))
+        return cached[1] if cached else None
+
+
+# 创建全局交易日历实例
+trading_calendar = TradingCalendar()
@@ -0,0 +1,112 @@
+"""
+OpenRouter HTTP连接测试（本地假服务：长连接复用、429/5xx退避重试、请求统计）
+"""
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.ai_service import AIService
+from services.ai_response_cache import ai_response_cache
+
+
+class FakeEndpointHandler(BaseHTTPRequestHandler):
+    """按 server.script 依次返回状态码，记录每个请求的客户端端口（同一端口即复用了连接）"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.ports.append(self.client_address[1])
+        status = self.server.script.pop(0) if self.server.script else 200
+        if status == 200:
+            body = json.dumps({'choices': [{'message': {'content': 'ok'}}]}).encode()
+        else:
+            body = json.dumps({'error': {'message': 'busy'}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _FakeEndpoint:
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeEndpointHandler)
+        self.server.ports = []
+        self.server.script = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.service = AIService()
+        self.service.api_url = f'http://127.0.0.1:{self.server.server_port}/chat/completions'
+        self.service.retry_backoff = 0.01
+        self.cache_enabled, ai_response_cache.enabled = ai_response_cache.enabled, False  # 每次都真正发出请求
+        return self
+
+    def __exit__(self, *exc):
+        ai_response_cache.enabled = self.cache_enabled
+        self.service.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+MESSAGES = [{'role': 'user', 'content': 'hi'}]
+
+
+def test_connection_reuse():
+    """连续请求复用同一个TCP连接"""
+    with _FakeEndpoint() as fake:
+        for _ in range(3):
+            assert fake.service.chat(MESSAGES) == 'ok'
+        assert len(fake.server.ports) == 3 and len(set(fake.server.ports)) == 1
+        stats = fake.service.http_status()
+        assert stats['requests'] == 3 and stats['retries'] == 0 and stats['statuses'] == {200: 3}
+        assert all(item['elapsed_ms'] >= 0 for item in stats['recent'])
+    print("✅ 连接复用")
+
+
+def test_retry_on_429_and_5xx():
+    """429/5xx重试后成功；超过重试次数返回错误"""
+    with _FakeEndpoint() as fake:
+        fake.server.script = [429, 503]
+        assert fake.service.chat(MESSAGES) == 'ok'
+        stats = fake.service.http_status()
+        assert stats['requests'] == 1 and stats['attempts'] == 3 and stats['retries'] == 2
+        assert stats['statuses'] == {429: 1, 503: 1, 200: 1}
+        assert [item['attempt'] for item in stats['recent']] == [0, 1, 2]
+
+        fake.service.max_retries = 1
+        fake.server.script = [500, 502]
+        assert fake.service.chat(MESSAGES).startswith('AI服务暂时不可用')
+        assert len(fake.server.ports) == 5
+
+        # 非重试状态码直接返回
+        fake.server.script = [400]
+        assert fake.service.chat(MESSAGES).startswith('AI服务暂时不可用')
+        assert len(fake.server.ports) == 6
+    print("✅ 退避重试")
+
+
+def test_connection_error_retry():
+    """连接失败按次数重试后抛出，由 chat 转为错误文本"""
+    service = AIService()
+    service.api_url = 'http://127.0.0.1:9/chat/completions'
+    service.retry_backoff = 0.01
+    assert service.chat(MESSAGES, use_cache=False).startswith('AI服务暂时不可用')
+    stats = service.http_status()
+    assert stats['attempts'] == service.max_retries + 1 and stats['errors'] == service.max_retries + 1
+    print("✅ 连接失败重试")
+
+
+if __name__ == '__main__':
+    test_connection_reuse()
+    test_retry_on_429_and_5xx()
+    test_connection_error_retry()
+    print("🎉 所有测试通过！")
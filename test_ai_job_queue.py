@@ -0,0 +1,149 @@
+"""
+AI任务队列测试（有界队列与用户并发限制、轮询结果、流式输出、慢调用不阻塞其他接口）
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import app as app_module
+from services.ai_job_queue import AIJobQueue, AIJobRejected
+
+ai_module = sys.modules['services.ai_service']
+
+
+def test_limits_and_results():
+    """队列满或用户并发过多时拒绝；结果按用户可见"""
+    queue = AIJobQueue(workers=1, max_pending=3, per_user=2, result_ttl=60)
+    release = threading.Event()
+
+    first = queue.submit(1, 'chat', lambda: release.wait(5) and 'a')
+    queue.submit(1, 'chat', lambda: 'b')
+    with pytest.raises(AIJobRejected):
+        queue.submit(1, 'chat', lambda: 'c')          # 用户1已有2个未完成
+    other = queue.submit(2, 'chat', lambda: 'd')
+    with pytest.raises(AIJobRejected):
+        queue.submit(3, 'chat', lambda: 'e')          # 队列已满
+    assert queue.get(other, user_id=2)['status'] == 'queued'
+    assert queue.get(other, user_id=1) is None
+
+    release.set()
+    assert queue.wait(first, timeout=5)['result'] == 'a'
+    assert queue.wait(other, timeout=5)['result'] == 'd'
+    assert queue.submit(3, 'chat', lambda: 'e')
+    assert queue.status()['rejected'] == 2
+
+    failed = queue.submit(4, 'chat', lambda: 1 / 0)
+    assert queue.wait(failed, timeout=5)['status'] == 'failed'
+
+    # 不存在或已过期的任务
+    assert queue.wait('unknown', timeout=1) is None
+    assert list(queue.follow('unknown')) == []
+    queue.executor.shutdown(wait=True)
+    print("✅ 队列限制")
+
+
+def test_generator_jobs_follow():
+    """流式任务可逐段读取，完成前可轮询已生成部分"""
+    queue = AIJobQueue(workers=1, max_pending=2, per_user=2)
+    step = threading.Semaphore(0)
+
+    def chunks():
+        for text in ('复旦', '微电'):
+            step.acquire()
+            yield text
+
+    job_id = queue.submit(1, 'chat', chunks)
+    follow = queue.follow(job_id)
+    step.release()
+    assert next(follow) == '复旦'
+    assert queue.get(job_id)['partial'] == '复旦'
+    step.release()
+    assert list(follow) == ['微电']
+    assert queue.get(job_id)['result'] == '复旦微电' and queue.get(job_id)['partial'] is None
+    queue.executor.shutdown(wait=True)
+    print("✅ 流式任务")
+
+
+def test_async_endpoint_returns_immediately():
+    """async 请求立即返回任务ID；大模型调用期间其他接口不受影响"""
+    release = threading.Event()
+    service = ai_module.ai_service
+    original = service.chat_with_history
+    original_queue = app_module.ai_job_queue
+    app_module.ai_job_queue = AIJobQueue(workers=1, max_pending=4, per_user=1)
+    service.chat_with_history = lambda *args, **kwargs: release.wait(5) and '分析结果'
+    try:
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'tester'
+
+        start = time.perf_counter()
+        response = client.post('/api/chat/send', json={'stock_code': '688385.SH', 'message': '走势', 'async': True})
+        assert response.status_code == 202 and time.perf_counter() - start < 1
+        job_id = response.json['data']['job_id']
+
+        busy = client.post('/api/chat/send', json={'stock_code': '688385.SH', 'message': '再问', 'async': True})
+        assert busy.status_code == 429 and busy.headers['Retry-After']
+
+        assert client.get(f'/api/ai/jobs/{job_id}').json['data']['status'] in ('queued', 'running')
+        release.set()
+        app_module.ai_job_queue.wait(job_id, timeout=5)
+        job = client.get(f'/api/ai/jobs/{job_id}').json['data']
+        assert job['status'] == 'done' and job['result'] == '分析结果'
+        assert client.get('/api/ai/jobs/unknown').status_code == 404
+    finally:
+        release.set()
+        service.chat_with_history = original
+        app_module.ai_job_queue.executor.shutdown(wait=True)
+        app_module.ai_job_queue = original_queue
+    print("✅ 异步接口")
+
+
+def test_sync_request_wait_is_bounded():
+    """同步请求最多等待 AI_SYNC_WAIT_SECONDS 秒，超时返回202和任务ID"""
+    release = threading.Event()
+    service = ai_module.ai_service
+    original = service.chat_with_history
+    original_queue = app_module.ai_job_queue
+    original_wait = app_module.config.AI_SYNC_WAIT_SECONDS
+    app_module.ai_job_queue = AIJobQueue(workers=1, max_pending=4, per_user=2)
+    app_module.config.AI_SYNC_WAIT_SECONDS = 0.2
+    service.chat_with_history = lambda *args, **kwargs: release.wait(5) and '分析结果'
+    try:
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'tester'
+
+        start = time.perf_counter()
+        response = client.post('/api/chat/send', json={'stock_code': '688385.SH', 'message': '走势'})
+        assert response.status_code == 202 and time.perf_counter() - start < 1
+        job_id = response.json['data']['job_id']
+        release.set()
+        app_module.ai_job_queue.wait(job_id, timeout=5)
+        assert client.get(f'/api/ai/jobs/{job_id}').json['data']['result'] == '分析结果'
+
+        # 在等待时间内完成时直接返回结果
+        response = client.post('/api/chat/send', json={'stock_code': '688385.SH', 'message': '再问'})
+        assert response.status_code == 200 and response.json['data']['response'] == '分析结果'
+    finally:
+        release.set()
+        service.chat_with_history = original
+        app_module.config.AI_SYNC_WAIT_SECONDS = original_wait
+        app_module.ai_job_queue.executor.shutdown(wait=True)
+        app_module.ai_job_queue = original_queue
+    print("✅ 同步等待有上限")
+
+
+if __name__ == '__main__':
+    test_limits_and_results()
+    test_generator_jobs_follow()
+    test_async_endpoint_returns_immediately()
+    test_sync_request_wait_is_bounded()
+    print("🎉 所有测试通过！")
@@ -0,0 +1,112 @@
+"""
+AI响应缓存测试（规范化的缓存键、命中不调用模型、按请求绕过、到下一交易日开盘过期、流式回复缓存）
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import services.ai_response_cache as cache_module
+from services.ai_response_cache import AIResponseCache
+from services.ai_service import AIService
+from services.trading_calendar import TradingCalendar
+
+MESSAGES = [
+    {'role': 'system', 'content': ''},
+    {'role': 'user', 'content': '分析 688385.SH\n日K MACD: 0.12'},
+]
+
+
+class FakeCalendar:
+    """下一交易日开盘为一小时后"""
+
+    def next_session_start(self, dt=None, market='A'):
+        return datetime.fromtimestamp(time.time() + 3600)
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class CountingService(AIService):
+    """不发出HTTP请求的AI服务，记录实际调用模型的次数"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.fail = False
+
+    def _post(self, headers, payload, stream=False):
+        assert not stream
+        self.calls += 1
+        if self.fail:
+            return FakeResponse({'error': {'message': 'busy'}})
+        return FakeResponse({'choices': [{'message': {'content': f"回复{self.calls}"}}]})
+
+
+def test_key_normalization():
+    """空白和空的system消息不影响缓存键；模型、参数、内容不同则键不同"""
+    key = AIResponseCache.key('m', 0.7, 2000, MESSAGES)
+    spaced = [{'role': 'user', 'content': '  分析 688385.SH   日K MACD: 0.12 \n'}]
+    assert AIResponseCache.key('m', 0.7, 2000, spaced) == key
+    assert AIResponseCache.key('other', 0.7, 2000, MESSAGES) != key
+    assert AIResponseCache.key('m', 0.2, 2000, MESSAGES) != key
+    assert AIResponseCache.key('m', 0.7, 2000, [{'role': 'user', 'content': '分析 688385.SH 日K MACD: 0.13'}]) != key
+    print("✅ 缓存键")
+
+
+@pytest.fixture
+def cache_db(temp_db, monkeypatch):
+    """临时数据库中的AI响应缓存，下一交易日开盘为一小时后"""
+    monkeypatch.setattr(cache_module, 'trading_calendar', FakeCalendar())
+    monkeypatch.setattr(cache_module.ai_response_cache, 'enabled', True)
+    return temp_db
+
+
+def test_cached_chat(cache_db):
+    """相同提示词第二次直接返回；no_cache绕过；过期后重新调用"""
+    service = CountingService()
+    assert service.chat(MESSAGES) == '回复1'
+    assert service.chat(MESSAGES) == '回复1' and service.calls == 1
+    assert service.chat(MESSAGES, use_cache=False) == '回复2' and service.calls == 2
+
+    # 流式请求命中同一缓存
+    assert list(service.chat_stream(MESSAGES)) == ['回复1']
+
+    cache_db.execute_update("UPDATE ai_response_cache SET expires_at = %s", (time.time() - 1,))
+    assert service.chat(MESSAGES) == '回复3' and service.calls == 3
+    status = cache_module.ai_response_cache.status()
+    assert status['entries'] == 1 and status['hits'] >= 2
+
+    # 错误回复不缓存
+    service.fail = True
+    other = [{'role': 'user', 'content': '另一个问题'}]
+    assert service.chat(other).startswith('AI响应错误')
+    assert cache_module.ai_response_cache.get(AIResponseCache.key(service.default_model, 0.7, 2000, other)) is None
+    print("✅ 缓存命中与绕过")
+
+
+def test_expires_at_next_session():
+    """有效期到下一个交易日开盘"""
+    calendar = TradingCalendar()
+    calendar._dates = lambda market, year: {'20240105', '20240108'}   # 周五、下周一
+    assert calendar.next_session_start(datetime(2024, 1, 5, 8, 0)) == datetime(2024, 1, 5, 9, 30)
+    assert calendar.next_session_start(datetime(2024, 1, 5, 15, 30)) == datetime(2024, 1, 8, 9, 30)
+    print("✅ 交易日过期")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
@@ -0,0 +1,163 @@
+"""
+AI流式对话测试（本地假的OpenAI兼容服务：首段文本先于生成结束到达、接口SSE转发、结束后保存对话记录、中断的流不缓存）
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import app as app_module
+import services.ai_response_cache as cache_module
+from services.ai_response_cache import ai_response_cache
+
+ai_module = sys.modules['services.ai_service']
+
+TS_CODE = '688385.SH'
+CHUNKS = ['复旦', '微电', '短期', '震荡', '偏强']
+CHUNK_DELAY = 0.2
+
+
+class FakeCompletionsHandler(BaseHTTPRequestHandler):
+    """OpenAI兼容的 /chat/completions：stream 时以分块传输每隔 CHUNK_DELAY 秒发送一段"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(payload)
+        if not payload.get('stream'):
+            body = json.dumps({'choices': [{'message': {'content': ''.join(CHUNKS)}}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._write_chunk(b': OPENROUTER PROCESSING\n\n')
+        for i, text in enumerate(CHUNKS):
+            if i == self.server.truncate_at:
+                # 模拟上游超时/断开：没有 finish_reason 和 [DONE] 就结束
+                self._write_chunk(b'')
+                return
+            if i:
+                time.sleep(CHUNK_DELAY)
+            chunk = {'choices': [{'delta': {'content': text}}]}
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        self._write_chunk(b'data: {"choices": [], "usage": {"total_tokens": 5}}\n\ndata: [DONE]\n\n')
+        self._write_chunk(b'')
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeAI:
+    """本地假服务和临时数据库"""
+
+    def __init__(self, server, manager):
+        self.server = server
+        self.manager = manager
+
+    def history(self):
+        return [(row['role'], row['content']) for row in self.manager.execute_query(
+            "SELECT role, content FROM chat_history WHERE stock_code = %s ORDER BY id", (TS_CODE,))]
+
+
+@pytest.fixture
+def fake(temp_db, tmp_path, monkeypatch):
+    """启动本地假服务，并把AI服务指向它和临时数据库"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCompletionsHandler)
+    server.requests = []
+    server.truncate_at = None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    service = ai_module.ai_service
+    monkeypatch.setattr(service, 'api_url', f'http://127.0.0.1:{server.server_port}/chat/completions')
+    monkeypatch.setattr(service, 'prompt_history_dir', str(tmp_path))
+    monkeypatch.setattr(ai_response_cache, 'enabled', False)
+    yield FakeAI(server, temp_db)
+    server.shutdown()
+    server.server_close()
+
+
+def test_chat_stream_first_token(fake):
+    """首段文本在整体生成结束前到达；结束后才保存对话记录"""
+    start = time.perf_counter()
+    stream = ai_module.ai_service.chat_with_history_stream(1, 'tester', TS_CODE, '走势如何')
+    first = next(stream)
+    first_latency = time.perf_counter() - start
+    assert first == CHUNKS[0]
+    assert fake.history() == []
+
+    rest = list(stream)
+    total = time.perf_counter() - start
+    assert first + ''.join(rest) == ''.join(CHUNKS)
+    assert first_latency < CHUNK_DELAY < total - first_latency
+    assert fake.server.requests[0]['stream'] is True
+    assert fake.history() == [('user', '走势如何'), ('assistant', ''.join(CHUNKS))]
+    print(f"✅ 首段耗时 {first_latency * 1000:.0f} ms / 总耗时 {total * 1000:.0f} ms")
+
+
+def test_chat_send_stream_endpoint(fake):
+    """/api/chat/send 以SSE转发增量文本，非流式请求保持原有JSON响应"""
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'tester'
+
+    response = client.post('/api/chat/send', json={'stock_code': TS_CODE, 'message': '走势如何', 'stream': True})
+    assert response.mimetype == 'text/event-stream'
+    events = [block for block in response.get_data(as_text=True).split('\n\n') if block]
+    assert events[0].startswith('event: job\n') and events[-1].startswith('event: done')
+    deltas = [json.loads(block.split('data: ', 1)[1])['content'] for block in events[1:-1]]
+    assert all(block.startswith('event: delta\n') for block in events[1:-1])
+    assert deltas == CHUNKS
+
+    plain = client.post('/api/chat/send', json={'stock_code': TS_CODE, 'message': '再说说'})
+    assert plain.json['data']['response'] == ''.join(CHUNKS)
+    assert [role for role, _ in fake.history()] == ['user', 'assistant', 'user', 'assistant']
+    print("✅ 流式接口")
+
+
+class FakeCalendar:
+    """下一交易日开盘为一小时后"""
+
+    def next_session_start(self, dt=None, market='A'):
+        return datetime.fromtimestamp(time.time() + 3600)
+
+
+def test_truncated_stream_not_cached(fake, monkeypatch):
+    """流在 [DONE] 之前中断时不缓存残缺的回复；完整结束后才缓存"""
+    monkeypatch.setattr(ai_response_cache, 'enabled', True)
+    monkeypatch.setattr(cache_module, 'trading_calendar', FakeCalendar())
+    messages = [{'role': 'user', 'content': '走势如何'}]
+    service = ai_module.ai_service
+
+    fake.server.truncate_at = 2
+    assert ''.join(service.chat_stream(messages)) == ''.join(CHUNKS[:2])
+    assert fake.manager.execute_query("SELECT COUNT(*) AS c FROM ai_response_cache", fetch_one=True)['c'] == 0
+
+    fake.server.truncate_at = None
+    assert ''.join(service.chat_stream(messages)) == ''.join(CHUNKS)
+    assert list(service.chat_stream(messages)) == [''.join(CHUNKS)]  # 命中缓存
+    assert len(fake.server.requests) == 2
+    print("✅ 中断的流不缓存")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
@@ -0,0 +1,178 @@
+"""
+按交易日批量更新K线测试（使用假的Tushare接口和临时数据库）
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import pytest
+
+from services.stock_service import stock_service
+import services.indicator_engine  # noqa: F401
+
+stock_module = sys.modules['services.stock_service']
+
+STOCKS = ['600519.SH', '002594.SZ', '300058.SZ']
+FUND = '510300.SH'
+INDEX = '000300.SH'
+
+
+class FakePro:
+    """全市场日K的假Tushare接口，记录调用"""
+
+    def __init__(self, days=120):
+        today = datetime.now().date()
+        dates = [(today - timedelta(days=i)).strftime('%Y%m%d') for i in range(days)][::-1]
+        rows = []
+        # 全市场还包含不在自选股中的代码
+        for n, ts_code in enumerate(STOCKS + [FUND, INDEX, '601127.SH']):
+            for i, d in enumerate(dates):
+                close = 10 + n + i * 0.01
+                rows.append({'ts_code': ts_code, 'trade_date': d, 'open': close - 0.1, 'high': close + 0.2,
+                             'low': close - 0.2, 'close': close, 'vol': 1000.0 + i, 'amount': 10000.0 + i})
+        self.bars = pd.DataFrame(rows)
+        self.calls = []
+
+    def _query(self, name, codes, ts_code=None, trade_date=None, start_date=None, end_date=None):
+        self.calls.append((name, ts_code, trade_date))
+        df = self.bars[self.bars['ts_code'].isin(codes)]
+        if ts_code:
+            df = df[df['ts_code'] == ts_code]
+        if trade_date:
+            df = df[df['trade_date'] == trade_date]
+        if start_date:
+            df = df[df['trade_date'] >= start_date]
+        if end_date:
+            df = df[df['trade_date'] <= end_date]
+        return df.copy()
+
+    def daily(self, **kwargs):
+        return self._query('daily', STOCKS + ['601127.SH'], **kwargs)
+
+    def fund_daily(self, **kwargs):
+        return self._query('fund_daily', [FUND], **kwargs)
+
+    def index_daily(self, **kwargs):
+        return self._query('index_daily', [INDEX], **kwargs)
+
+    def weekly(self, **kwargs):
+        df = self._query('weekly', STOCKS, **kwargs)
+        return df[pd.to_datetime(df['trade_date']).dt.dayofweek == 4]
+
+    def index_weekly(self, **kwargs):
+        df = self._query('index_weekly', [INDEX], **kwargs)
+        return df[pd.to_datetime(df['trade_date']).dt.dayofweek == 4]
+
+
+class FakeCalendar:
+    """closed 中的日期休市，其余都是交易日（假行情每天都有K线）"""
+
+    def __init__(self):
+        self.closed = set()
+
+    def is_trading_day(self, day=None, market='A'):
+        return day.strftime('%Y%m%d') not in self.closed
+
+
+@pytest.fixture
+def env(temp_db, monkeypatch):
+    """临时数据库、假的Tushare接口和交易日历"""
+    monkeypatch.setattr(stock_service, 'pro', FakePro())
+    monkeypatch.setattr(stock_module, 'trading_calendar', FakeCalendar())
+    return SimpleNamespace(manager=temp_db, pro=stock_service.pro, calendar=stock_module.trading_calendar)
+
+
+def test_batch_uses_constant_api_calls(env):
+    """有历史数据的股票按交易日批量拉取，调用次数与股票数量无关"""
+    codes = STOCKS + [FUND]
+    first = stock_service.update_kline_batch(codes)
+    # 首次无历史数据，全部逐只回补
+    assert first['fallback'] == len(codes) and first['batched'] == 0
+
+    # 新的一天：全市场数据多出一根K线
+    today = datetime.now().date()
+    env.pro.bars.loc[env.pro.bars['trade_date'] == today.strftime('%Y%m%d'), 'close'] += 1
+    env.pro.calls.clear()
+    result = stock_service.update_kline_batch(codes)
+
+    assert result['batched'] == len(codes) and result['fallback'] == 0 and not result['failed']
+    assert all(call[1] is None and call[2] for call in env.pro.calls), env.pro.calls
+    assert result['api_calls'] == len(env.pro.calls) == 2  # 今天的 daily + fund_daily
+    assert result['written'] == len(codes)
+
+    latest = stock_service.get_stock_data_from_db('600519.SH', 'daily', 1)[0]
+    assert abs(latest['close'] - (10 + 119 * 0.01 + 1)) < 1e-9
+    # 不在自选股中的代码不写入
+    assert stock_service.get_kline_watermark('601127.SH') is None
+    print("✅ 按交易日批量拉取")
+
+
+def test_non_trading_days_skipped(env):
+    """水位线之后的休市日不调用接口"""
+    stock_service.update_kline_batch(['600519.SH'])
+    watermark = stock_service.get_kline_watermark('600519.SH')
+    env.manager.execute_update("DELETE FROM stock_daily WHERE trade_date > %s",
+                               ((watermark - timedelta(days=5)).strftime('%Y-%m-%d'),))
+    env.calendar.closed = {(watermark - timedelta(days=i)).strftime('%Y%m%d') for i in (1, 2)}
+    env.pro.calls.clear()
+
+    result = stock_service.update_kline_batch(['600519.SH'])
+    called = {call[2] for call in env.pro.calls}
+    assert result['api_calls'] == len(env.pro.calls) == 4
+    assert not called & env.calendar.closed
+    print("✅ 跳过休市日")
+
+
+def test_index_and_new_symbols_fall_back(env):
+    """指数和无历史数据的股票逐只更新（传入线程池时并发执行）"""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        stock_service.update_kline_batch(['600519.SH'])
+        env.pro.calls.clear()
+        result = stock_service.update_kline_batch(['600519.SH', INDEX, '002594.SZ'], executor=executor)
+        assert result['batched'] == 1 and result['fallback'] == 2
+        per_symbol = {call[1] for call in env.pro.calls if call[1]}
+        assert per_symbol == {INDEX, '002594.SZ'}
+    print("✅ 指数与新股票逐只回补")
+
+
+def test_weekly_rebuilt_from_daily(env):
+    """周K由日K聚合，当周的未完成周K被替换"""
+    stock_service.update_kline_batch(['600519.SH'])
+    today = pd.Timestamp(datetime.now().date())
+    week_start = today - pd.Timedelta(days=today.dayofweek)
+    stale = (week_start - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+
+    stock_service.rebuild_weekly_from_daily('600519.SH', today)
+    weekly = stock_service.get_stock_data_from_db('600519.SH', 'weekly', 2)
+    daily = pd.DataFrame(stock_service.get_stock_data_from_db('600519.SH', 'daily', 10))
+    this_week = daily[pd.to_datetime(daily['trade_date']) >= week_start]
+
+    assert weekly[-1]['trade_date'] == today.strftime('%Y-%m-%d')
+    assert weekly[-1]['open'] == this_week['open'].iloc[0]
+    assert weekly[-1]['high'] == this_week['high'].max()
+    assert weekly[-1]['volume'] == this_week['volume'].sum()
+    # 上一周的记录不受影响
+    assert weekly[0]['trade_date'] <= stale
+    print("✅ 周K由日K聚合")
+
+
+def test_fund_weekly_labels_match_rebuild(env):
+    """ETF周线（日线聚合）与日K重建的周K日期一致，同一周不会出现两条记录"""
+    stock_service.update_kline_data_only(FUND, full=True)
+    fetched = stock_service.get_stock_data_from_db(FUND, 'weekly', 100)
+
+    stock_service.rebuild_weekly_from_daily(FUND, fetched[0]['trade_date'])
+    rebuilt = stock_service.get_stock_data_from_db(FUND, 'weekly', 100)
+
+    assert [row['trade_date'] for row in rebuilt] == [row['trade_date'] for row in fetched]
+    assert rebuilt[-1]['trade_date'] == datetime.now().strftime('%Y-%m-%d')
+    print("✅ ETF周K口径一致")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
@@ -0,0 +1,130 @@
+"""
+K线增量更新测试（使用假的Tushare接口和临时数据库）
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import pytest
+
+from services.stock_service import stock_service
+import services.indicator_engine  # noqa: F401
+
+TS_CODE = '600519.SH'
+
+
+class FakePro:
+    """按日期范围返回K线的假Tushare接口"""
+
+    def __init__(self, days=300):
+        today = datetime.now().date()
+        dates = [today - timedelta(days=i) for i in range(days)][::-1]
+        self.bars = pd.DataFrame({
+            'ts_code': TS_CODE,
+            'trade_date': [d.strftime('%Y%m%d') for d in dates],
+            'open': [10 + i * 0.01 for i in range(days)],
+            'high': [11 + i * 0.01 for i in range(days)],
+            'low': [9 + i * 0.01 for i in range(days)],
+            'close': [10.5 + i * 0.01 for i in range(days)],
+            'vol': [1000.0 + i for i in range(days)],
+            'amount': [10000.0 + i for i in range(days)],
+        })
+        self.calls = []
+
+    def _query(self, name, ts_code=None, start_date=None, end_date=None):
+        self.calls.append((name, start_date, end_date))
+        df = self.bars
+        if start_date:
+            df = df[df['trade_date'] >= start_date]
+        if end_date:
+            df = df[df['trade_date'] <= end_date]
+        return df.copy()
+
+    def daily(self, **kwargs):
+        return self._query('daily', **kwargs)
+
+    def weekly(self, **kwargs):
+        # 周线简化为每周五的日线
+        df = self._query('weekly', **kwargs)
+        return df[pd.to_datetime(df['trade_date']).dt.dayofweek == 4]
+
+
+@pytest.fixture
+def env(temp_db, monkeypatch):
+    """临时数据库和假的Tushare接口"""
+    monkeypatch.setattr(stock_service, 'pro', FakePro())
+    return SimpleNamespace(manager=temp_db, pro=stock_service.pro)
+
+
+def _count(manager, table):
+    return manager.execute_query(f"SELECT COUNT(*) AS c FROM {table}", fetch_one=True)['c']
+
+
+def test_incremental_fetch_uses_watermark(env):
+    """首次全量，之后只从水位线开始拉取"""
+    assert stock_service.update_kline_data_only(TS_CODE)
+    first_call = env.pro.calls[0]
+    daily_rows = _count(env.manager, 'stock_daily')
+    assert daily_rows > 200
+
+    env.pro.calls.clear()
+    assert stock_service.update_kline_data_only(TS_CODE)
+    watermark = stock_service.get_kline_watermark(TS_CODE, 'daily').strftime('%Y%m%d')
+    assert env.pro.calls[0] == ('daily', watermark, first_call[2])
+    assert _count(env.manager, 'stock_daily') == daily_rows
+    print("✅ 水位线增量拉取")
+
+
+def test_only_changed_rows_written(env):
+    """无变化时不写入，最新K线变化时只写入该行"""
+    stock_service.update_kline_data_only(TS_CODE)
+    assert stock_service._filter_changed_bars(
+        'daily', TS_CODE, stock_service.fetch_daily_data(TS_CODE)
+    ).empty
+
+    env.pro.bars.loc[env.pro.bars.index[-1], 'close'] = 99.99
+    changed = stock_service._filter_changed_bars('daily', TS_CODE, stock_service.fetch_daily_data(TS_CODE))
+    assert len(changed) == 1 and changed['close'].iloc[0] == 99.99
+
+    stock_service.update_kline_data_only(TS_CODE)
+    latest = stock_service.get_stock_data_from_db(TS_CODE, 'daily', 1)[0]
+    assert latest['close'] == 99.99
+    print("✅ 只写入变化的K线")
+
+
+def test_integer_volume_matches_fractional_vol(env):
+    """MySQL把成交量存为整数：接口返回带小数的成交量时，按整数比较不算变化"""
+    env.pro.bars['vol'] += 0.5
+    stock_service.update_kline_data_only(TS_CODE)
+    # 模拟MySQL BIGINT写入时的四舍五入
+    env.manager.execute_update("UPDATE stock_daily SET volume = CAST(volume + 0.5 AS INTEGER)")
+    assert env.manager.execute_query("SELECT volume FROM stock_daily LIMIT 1", fetch_one=True)['volume'] % 1 == 0
+
+    assert stock_service._filter_changed_bars('daily', TS_CODE, stock_service.fetch_daily_data(TS_CODE)).empty
+
+    env.pro.bars.loc[env.pro.bars.index[-1], 'vol'] += 1
+    changed = stock_service._filter_changed_bars('daily', TS_CODE, stock_service.fetch_daily_data(TS_CODE))
+    assert len(changed) == 1
+
+    # 与MySQL一致四舍五入（不是银行家舍入）
+    assert not stock_service._value_changed(1001, 1000.5, 0)
+    assert not stock_service._value_changed(10.13, 10.125)
+    print("✅ 成交量按整数比较")
+
+
+def test_full_backfill(env):
+    """full=True 时忽略水位线"""
+    stock_service.update_kline_data_only(TS_CODE)
+    env.pro.calls.clear()
+    stock_service.update_kline_data_only(TS_CODE, full=True)
+    expected_start = (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
+    assert env.pro.calls[0][1] == expected_start
+    print("✅ 全量回补")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
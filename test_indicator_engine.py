@@ -0,0 +1,107 @@
+"""
+增量指标引擎测试
+以 StockService.calculate_indicators 的批量计算结果为基准（golden）
+"""
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.indicator_engine import IndicatorState
+from services.stock_service import stock_service
+
+engine_module = sys.modules['services.indicator_engine']
+
+TS_CODE = '688385.SH'
+COLUMNS = ['macd', 'macd_signal', 'macd_hist', 'ema_12', 'ema_26', 'rsi_6', 'rsi_12', 'rsi_24']
+
+
+def _random_bars(n=300, seed=7):
+    rng = np.random.default_rng(seed)
+    closes = 50 + np.cumsum(rng.normal(0, 1, n)).round(2)
+    start = date(2023, 1, 2)
+    dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(n)]
+    return pd.DataFrame({'trade_date': dates, 'close': closes})
+
+
+def test_golden_against_batch():
+    """逐根增量更新的结果与批量计算一致"""
+    bars = _random_bars()
+    batch = stock_service.calculate_indicators(bars.copy())
+
+    state = IndicatorState()
+    rows = [state.update(d, c) for d, c in zip(bars['trade_date'], bars['close'])]
+    incremental = pd.DataFrame(rows)
+
+    for col in COLUMNS:
+        assert np.allclose(incremental[col], batch[col], rtol=1e-9, atol=1e-9, equal_nan=True), col
+    print("✅ 与批量计算一致")
+
+
+def test_state_roundtrip_and_rollback():
+    """状态序列化后继续计算结果不变，最新K线可回退重算"""
+    bars = _random_bars(60)
+    state = IndicatorState()
+    for d, c in zip(bars['trade_date'][:-1], bars['close'][:-1]):
+        state.update(d, c)
+
+    restored = IndicatorState.from_json(state.to_json())
+    last_date, last_close = bars['trade_date'].iloc[-1], bars['close'].iloc[-1]
+    expected = state.update(last_date, last_close)
+    assert restored.update(last_date, last_close) == expected
+
+    # 最新K线被修正：回退后用新收盘价重算
+    assert restored.rollback()
+    corrected = restored.update(last_date, last_close + 1)
+    assert corrected['ema_12'] > expected['ema_12']
+    print("✅ 状态序列化与回退")
+
+
+def test_engine_writes_only_new_rows(temp_db):
+    """引擎只读取水位之后的K线并写入新增指标行"""
+    bars = _random_bars(80)
+    rows = [(TS_CODE, d, c, c, c, c, 100, 1000) for d, c in zip(bars['trade_date'], bars['close'])]
+    insert = ("INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, volume, amount) "
+              "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+    temp_db.execute_many(insert, rows[:-1])
+
+    engine = engine_module.IndicatorEngine()
+    engine.update(TS_CODE)  # 无状态时全量重建
+    count = temp_db.execute_query("SELECT COUNT(*) AS c FROM stock_indicators", fetch_one=True)['c']
+    assert count == 79 - 5  # 前5行RSI(6)未就绪，不保存
+
+    temp_db.execute_many(insert, rows[-1:])
+    assert engine.update(TS_CODE, changed_from=bars['trade_date'].iloc[-1]) == 1
+
+    stored = stock_service.get_indicators_from_db(TS_CODE, 1)[0]
+    batch = stock_service.calculate_indicators(bars.copy()).iloc[-1]
+    for col in COLUMNS:
+        assert abs(stored[col] - batch[col]) < 1e-9, col
+    print("✅ 引擎增量写入")
+
+
+def test_single_bar_correction(temp_db):
+    """状态中只有一根K线时修正该K线：回退后为空状态，重建后使用修正后的收盘价"""
+    insert = ("INSERT OR REPLACE INTO stock_daily (ts_code, trade_date, open, high, low, close, volume, amount) "
+              "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+    temp_db.execute_many(insert, [(TS_CODE, '2024-01-02', 10, 10, 10, 10, 100, 1000)])
+
+    engine = engine_module.IndicatorEngine()
+    engine.update(TS_CODE)
+    assert engine.load_state(TS_CODE).last_close == 10
+
+    temp_db.execute_many(insert, [(TS_CODE, '2024-01-02', 10, 12, 10, 12, 100, 1000)])
+    engine.update(TS_CODE, changed_from='2024-01-02')
+    state = engine.load_state(TS_CODE)
+    assert state.last_trade_date == '2024-01-02' and state.last_close == 12
+    assert state.ema_12 == 12
+    print("✅ 单根K线修正")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
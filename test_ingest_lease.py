@@ -0,0 +1,113 @@
+"""
+采集分片租约测试（份额分配、新进程加入后再平衡、进程停止后接手、丢失的租约不续约、调度器只处理持有的股票）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from services.scheduler_service import SchedulerService
+import services.ingest_lease_service as lease_module
+
+scheduler_module = sys.modules['services.scheduler_service']
+
+CODES = [f'{600000 + i}.SH' for i in range(10)]
+
+
+def _owners(manager):
+    rows = manager.execute_query("SELECT ts_code, worker_id FROM ingest_leases", row_mode='tuple')
+    return dict(rows)
+
+
+def _lease_counts():
+    return {row['worker_id']: row['leases'] for row in lease_module.IngestLeaseService.cluster_status()}
+
+
+def test_rebalance_on_join(temp_db):
+    """单进程持有全部股票；新进程加入后两边各持有一半，且没有重复"""
+    a = lease_module.IngestLeaseService('worker-a', ttl=60)
+    b = lease_module.IngestLeaseService('worker-b', ttl=60)
+
+    assert a.sync(CODES) == set(CODES)
+
+    # b加入时a尚未释放，b只能拿到空闲股票
+    assert b.sync(CODES) == set()
+    owned_a = a.sync(CODES)   # a发现存活进程为2，释放超出份额的股票
+    owned_b = b.sync(CODES)
+    assert len(owned_a) == len(owned_b) == 5
+    assert owned_a | owned_b == set(CODES) and not owned_a & owned_b
+
+    owners = _owners(temp_db)
+    assert all(owners[code] == 'worker-a' for code in owned_a)
+    assert _lease_counts() == {'worker-a': 5, 'worker-b': 5}
+    print("✅ 新进程加入后再平衡")
+
+
+def test_takeover_after_stop_and_expiry(temp_db):
+    """进程正常停止时立即释放；进程失联时租约过期后被接手"""
+    a = lease_module.IngestLeaseService('worker-a', ttl=60)
+    b = lease_module.IngestLeaseService('worker-b', ttl=60)
+    a.sync(CODES)
+    b.sync(CODES)
+    a.sync(CODES)
+
+    a.stop()
+    assert b.sync(CODES) == set(CODES)
+
+    # b失联：租约和心跳过期后c接手全部股票
+    temp_db.execute_update("UPDATE ingest_leases SET expires_at = 0")
+    temp_db.execute_update("UPDATE ingest_workers SET heartbeat_at = 0")
+    c = lease_module.IngestLeaseService('worker-c', ttl=60)
+    assert c.sync(CODES) == set(CODES)
+    assert set(_owners(temp_db).values()) == {'worker-c'}
+
+    # 移出自选股的股票释放租约
+    assert c.sync(CODES[:3]) == set(CODES[:3])
+    assert set(_owners(temp_db)) == set(CODES[:3])
+    print("✅ 停止/失联后接手")
+
+
+def test_lost_lease_not_renewed(temp_db, monkeypatch):
+    """读取租约后被其他进程抢占的股票续约失败，不再计入本进程持有"""
+    a = lease_module.IngestLeaseService('worker-a', ttl=60)
+    a.sync(CODES)
+    query = temp_db.execute_query
+
+    def stale_read(sql, *args, **kwargs):
+        rows = query(sql, *args, **kwargs)
+        if 'FROM ingest_leases' in sql:
+            temp_db.execute_update("UPDATE ingest_leases SET worker_id = 'worker-b' WHERE ts_code = %s", (CODES[0],))
+        return rows
+
+    monkeypatch.setattr(temp_db, 'execute_query', stale_read)
+    assert a.sync(CODES) == set(CODES[1:])
+    assert _owners(temp_db)[CODES[0]] == 'worker-b'
+    print("✅ 丢失的租约不再续约")
+
+
+def test_scheduler_filters_owned_stocks(temp_db):
+    """分片模式下调度任务只处理本进程持有的股票"""
+    other = lease_module.IngestLeaseService('worker-other', ttl=60)
+    other.sync(CODES)
+    shard = lease_module.IngestLeaseService('worker-self', ttl=60)
+    scheduler = SchedulerService(shard=shard)
+
+    original = scheduler_module.watchlist_service.get_all_unique_stocks
+    scheduler_module.watchlist_service.get_all_unique_stocks = \
+        lambda: [{'stock_code': code, 'stock_name': ''} for code in CODES]
+    try:
+        assert scheduler._watchlist() == []   # other仍持有全部租约
+        other.sync(CODES)
+        watchlist = scheduler._watchlist()
+    finally:
+        scheduler_module.watchlist_service.get_all_unique_stocks = original
+
+    assert {stock['stock_code'] for stock in watchlist} == shard.owned()
+    assert len(watchlist) == 5 and not shard.owned() & other.owned()
+    print("✅ 调度器只处理持有的股票")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
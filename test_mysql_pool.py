@@ -0,0 +1,172 @@
+"""
+MySQL连接池测试（使用假连接工厂，无需MySQL服务）
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pymysql
+from database.db_manager import DatabaseManager, PoolTimeoutError
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.conn.executed.append((query, params))
+        self.rowcount = 1
+
+    def executemany(self, query, params_list):
+        self.conn.executed.append((query, params_list))
+        self.rowcount = len(params_list)
+
+    def fetchall(self):
+        return [{'id': 1}]
+
+    def fetchone(self):
+        return {'id': 1}
+
+
+class FakeConnection:
+    def __init__(self, factory):
+        self.factory = factory
+        self.alive = True
+        self.closed = False
+        self.executed = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+
+class FakeFactory:
+    def __init__(self):
+        self.created = []
+
+    def __call__(self):
+        conn = FakeConnection(self)
+        self.created.append(conn)
+        return conn
+
+
+def test_connection_reused():
+    """连续查询只建立一次连接"""
+    factory = FakeFactory()
+    manager = DatabaseManager(connection_factory=factory, pool_size=2, max_overflow=0)
+    for _ in range(10):
+        manager.execute_query("SELECT 1")
+    manager.execute_update("UPDATE t SET v = %s", (1,))
+    manager.execute_many("INSERT INTO t VALUES (%s)", [(1,), (2,)])
+    assert len(factory.created) == 1
+    assert factory.created[0].commits == 12
+    print("✅ 连接复用")
+
+
+def test_ping_on_checkout():
+    """失效连接在取出时被丢弃重建"""
+    factory = FakeFactory()
+    manager = DatabaseManager(connection_factory=factory, pool_size=2, max_overflow=0)
+    manager.execute_query("SELECT 1")
+    factory.created[0].alive = False
+    manager.execute_query("SELECT 1")
+    assert len(factory.created) == 2
+    assert factory.created[0].closed
+    print("✅ 取出时ping检测")
+
+
+def test_idle_timeout():
+    """空闲超时的连接被回收"""
+    factory = FakeFactory()
+    manager = DatabaseManager(connection_factory=factory, pool_size=2, max_overflow=0, idle_timeout=0.05)
+    manager.execute_query("SELECT 1")
+    time.sleep(0.1)
+    manager.execute_query("SELECT 1")
+    assert len(factory.created) == 2
+    assert factory.created[0].closed
+    print("✅ 空闲超时回收")
+
+
+def test_overflow_and_timeout():
+    """超过 pool_size + max_overflow 时等待，超时抛出PoolTimeoutError"""
+    factory = FakeFactory()
+    manager = DatabaseManager(connection_factory=factory, pool_size=1, max_overflow=1, checkout_timeout=0.1)
+    pool = manager.pool
+    conn1 = pool.acquire()
+    conn2 = pool.acquire()
+    try:
+        pool.acquire()
+        assert False, '应该超时'
+    except PoolTimeoutError:
+        pass
+
+    # 归还后：常驻连接保留，溢出连接关闭
+    pool.release(conn1)
+    pool.release(conn2)
+    assert pool.status()['idle'] == 1
+    assert conn2.closed and not conn1.closed
+    print("✅ 溢出上限与等待超时")
+
+
+def test_waiter_wakes_on_release():
+    """连接归还后唤醒等待的线程"""
+    factory = FakeFactory()
+    manager = DatabaseManager(connection_factory=factory, pool_size=1, max_overflow=0, checkout_timeout=2)
+    pool = manager.pool
+    conn = pool.acquire()
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool.acquire()))
+    t.start()
+    time.sleep(0.05)
+    pool.release(conn)
+    t.join(timeout=1)
+    assert got and got[0] is conn
+    print("✅ 归还唤醒等待者")
+
+
+def test_broken_connection_discarded():
+    """OperationalError 后连接不再放回池中"""
+    factory = FakeFactory()
+    manager = DatabaseManager(connection_factory=factory, pool_size=2, max_overflow=0)
+    try:
+        with manager.get_connection():
+            raise pymysql.err.OperationalError(2013, 'Lost connection')
+    except pymysql.err.OperationalError:
+        pass
+    assert factory.created[0].closed
+    assert manager.pool.status()['opened'] == 0
+    print("✅ 断开的连接被丢弃")
+
+
+if __name__ == '__main__':
+    test_connection_reused()
+    test_ping_on_checkout()
+    test_idle_timeout()
+    test_overflow_and_timeout()
+    test_waiter_wakes_on_release()
+    test_broken_connection_discarded()
+    print("🎉 所有测试通过！")
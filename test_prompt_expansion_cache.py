@@ -0,0 +1,143 @@
+"""
+提示词变量展开缓存测试（重复展开不查库、K线/持仓写入后失效（含其他进程的持仓写入）、变量解析记忆）
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from services.ai_service import AIService
+from services.data_versions import DataVersions, position_versions
+from services.prompt_template import parse_kline_variable
+
+ai_module = sys.modules['services.ai_service']
+stock_module = sys.modules['services.stock_service']
+position_module = sys.modules['services.position_service']
+
+
+class FakeVersions:
+    def __init__(self):
+        self.versions = {}
+
+    def get(self, ts_code):
+        return self.versions.get(ts_code, 0.0)
+
+    def bump(self, ts_codes):
+        for ts_code in ts_codes:
+            self.versions[ts_code] = self.versions.get(ts_code, 0.0) + 1
+
+
+class _Stubs:
+    """替换行情、持仓查询，记录实际查询次数"""
+
+    def __enter__(self):
+        self.calls = {'kline': 0, 'indicators': 0, 'positions': 0, 'cash': 0}
+        stock = stock_module.stock_service
+        position = position_module.position_service
+        self.original = (ai_module.data_versions, stock.get_kline_arrays, stock.get_indicators_from_db,
+                         stock.get_stock_info, position.get_portfolio_summary, position.get_cash_balance)
+        self.versions = ai_module.data_versions = FakeVersions()
+
+        def kline(ts_code, period='daily', n=60):
+            self.calls['kline'] += 1
+            return {'trade_date': ['20240105'], 'open': [1.0], 'close': [1.1],
+                    'high': [1.2], 'low': [0.9], 'volume': [100.0]}
+
+        def indicators(stock_code, days=60, row_mode='dict'):
+            self.calls['indicators'] += 1
+            return [{'trade_date': '20240105', 'macd_dif': 0.1, 'macd_dea': 0.05, 'macd': 0.1}]
+
+        def summary(user_id):
+            self.calls['positions'] += 1
+            return {'cash': 1000.0, 'positions': []}
+
+        def cash(user_id):
+            self.calls['cash'] += 1
+            return 1000.0
+
+        stock.get_kline_arrays = kline
+        stock.get_indicators_from_db = indicators
+        stock.get_stock_info = lambda code: {'ts_code': '600000.SH'} if code == '浦发银行' else None
+        position.get_portfolio_summary = summary
+        position.get_cash_balance = cash
+        return self
+
+    def __exit__(self, *exc):
+        stock = stock_module.stock_service
+        position = position_module.position_service
+        (ai_module.data_versions, stock.get_kline_arrays, stock.get_indicators_from_db,
+         stock.get_stock_info, position.get_portfolio_summary, position.get_cash_balance) = self.original
+
+
+def test_parse_kline_variable():
+    """变量解析：股票、窗口、指标"""
+    assert parse_kline_variable('日K_复旦微电_30天_MACD&EMA') == ('日K', '复旦微电', 30, ('MACD', 'EMA'))
+    assert parse_kline_variable('周K') == ('周K', None, 360, ())
+    assert parse_kline_variable('1分钟K_10天') == ('1分钟K', None, 10, ())
+    print("✅ 变量解析")
+
+
+def test_repeat_expansion_hits_cache(temp_db):
+    """相同模版重复展开不再查库；K线数据写入后重新查询"""
+    with _Stubs() as stubs:
+        service = AIService()
+        template = '分析 日K_30天_MACD 和 日K_浦发银行_10天 ，结合 持仓 和 可用资金'
+        first, used = service._replace_variables(1, '688385.SH', template)
+        assert stubs.calls == {'kline': 2, 'indicators': 1, 'positions': 1, 'cash': 0}
+        assert '日K_30天_MACD' in used and '持仓' in used
+
+        second, _ = service._replace_variables(1, '688385.SH', template)
+        assert second == first
+        assert stubs.calls == {'kline': 2, 'indicators': 1, 'positions': 1, 'cash': 0}
+
+        # 换一只当前股票，只有默认股票的变量需要重新查询
+        service._replace_variables(1, '000001.SZ', template)
+        assert stubs.calls['kline'] == 3 and stubs.calls['indicators'] == 2
+
+        stubs.versions.bump(['688385.SH'])
+        service._replace_variables(1, '688385.SH', template)
+        assert stubs.calls['kline'] == 4 and stubs.calls['indicators'] == 3
+
+        start = time.perf_counter()
+        for _ in range(100):
+            service._replace_variables(1, '688385.SH', template)
+        elapsed = (time.perf_counter() - start) / 100
+        assert stubs.calls['kline'] == 4
+        assert elapsed < 0.001, elapsed
+        assert service.expansion_cache.stats()['hits'] > 0
+    print(f"✅ 展开缓存命中（每次 {elapsed * 1e6:.0f} 微秒）")
+
+
+def test_position_write_invalidates(temp_db, monkeypatch):
+    """持仓或资金变化后重新查询，其他用户不受影响；其他进程的写入同步后同样失效"""
+    monkeypatch.setattr(position_versions, 'sync_interval', 0)
+    with _Stubs() as stubs:
+        service = AIService()
+        position = position_module.position_service
+        service._replace_variables(1, '688385.SH', '持仓 可用资金')
+        service._replace_variables(2, '688385.SH', '持仓 可用资金')
+        assert stubs.calls['positions'] == 2
+
+        position._bump(1)
+        service._replace_variables(1, '688385.SH', '持仓 可用资金')
+        service._replace_variables(2, '688385.SH', '持仓 可用资金')
+        assert stubs.calls['positions'] == 3 and stubs.calls['cash'] == 0
+
+        # 其他进程（另一个Web进程或独立调度进程）修改了用户2的持仓
+        time.sleep(0.01)
+        DataVersions(table='position_versions', key_column='user_id').bump([2])
+        service._replace_variables(2, '688385.SH', '持仓 可用资金')
+        assert stubs.calls['positions'] == 4
+
+        # 只有可用资金时单独查询余额
+        service._replace_variables(1, '688385.SH', '可用资金')
+        service._replace_variables(1, '688385.SH', '可用资金')
+        assert stubs.calls['cash'] == 1
+    print("✅ 持仓写入失效")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
@@ -0,0 +1,87 @@
+"""
+提示词模版引擎测试（独立词才替换、花括号形式、编译缓存、一次拼接、数据源去重与并行查询）
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.ai_service import AIService
+from services.prompt_template import Variable, compile_template, render
+
+stock_module = sys.modules['services.stock_service']
+
+
+def test_compile():
+    """正文中的普通文字不是变量；花括号一并替换；重复变量只出现一次"""
+    template = compile_template('分析持仓结构，日K线走势 {持仓} 与 持仓，结合 日K__30天_MACD。')
+    assert template.nodes[0] == '分析持仓结构，日K线走势 '
+    assert [v.text for v in template.variables] == ['持仓', '日K__30天_MACD']
+    assert template.variables[1] == Variable('kline', '日K__30天_MACD', ('日K', '', 30, ('MACD',)))
+    assert template.nodes[-1] == '。'
+
+    assert compile_template('日K_688385.SH_30天').variables[0].kline == ('日K', '688385.SH', 30, ())
+    assert compile_template('没有变量的普通问题').variables == ()
+
+    hits = compile_template.cache_info().hits
+    compile_template('分析持仓结构，日K线走势 {持仓} 与 持仓，结合 日K__30天_MACD。')
+    assert compile_template.cache_info().hits == hits + 1
+    print("✅ 模版编译")
+
+
+def test_render_single_pass():
+    """替换结果中出现变量名不会被再次替换"""
+    template = compile_template('持仓 和 可用资金')
+    assert render(template, {'持仓': '持仓: 可用资金', '可用资金': '100'}) == '持仓: 可用资金 和 100'
+    print("✅ 一次拼接")
+
+
+def test_shared_and_parallel_sources():
+    """当前价格与实时行情共用一次查询；多个K线数据源并行查询"""
+    stock = stock_module.stock_service
+    original = (stock.get_realtime_price, stock.get_kline_arrays, stock.get_stock_info)
+    calls = {'price': 0, 'kline': 0}
+    threads = set()
+    lock = threading.Lock()
+
+    def price(stock_code):
+        calls['price'] += 1
+        return {'price': 10.5, 'trade_date': '20240105'}
+
+    def kline(ts_code, period='daily', n=60):
+        with lock:
+            calls['kline'] += 1
+            threads.add(threading.current_thread().name)
+        time.sleep(0.2)
+        return {'trade_date': ['20240105'], 'open': [1.0], 'close': [1.1],
+                'high': [1.2], 'low': [0.9], 'volume': [100.0]}
+
+    stock.get_realtime_price = price
+    stock.get_kline_arrays = kline
+    stock.get_stock_info = lambda code: {'ts_code': code}
+    try:
+        service = AIService()
+        message, used = service._replace_variables(1, '688385.SH', '当前价格 和 实时行情')
+        assert calls['price'] == 1 and set(used) == {'当前价格', '实时行情'}
+        assert '当前价格: 10.50 元' in message
+
+        start = time.perf_counter()
+        message, used = service._replace_variables(
+            1, '688385.SH', '对比 日K_600000.SH_10天 、 日K_000001.SZ_10天 和 周K_10天')
+        elapsed = time.perf_counter() - start
+        assert calls['kline'] == 3 and len(used) == 3
+        assert elapsed < 0.5, elapsed
+        assert all(name.startswith('ai-variables') for name in threads)
+        assert message.startswith('对比 \n"""') and '日K_' not in message
+    finally:
+        stock.get_realtime_price, stock.get_kline_arrays, stock.get_stock_info = original
+    print(f"✅ 数据源并行查询（3个K线 {elapsed:.2f}秒）")
+
+
+if __name__ == '__main__':
+    test_compile()
+    test_render_single_pass()
+    test_shared_and_parallel_sources()
+    print("🎉 所有测试通过！")
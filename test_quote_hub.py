@@ -0,0 +1,116 @@
+"""
+实时行情推送测试（写入后推送给订阅者、只推变化的行情、快照不重复推送、其他进程写入由轮询发现、SSE接口）
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import app as app_module
+from services.quote_hub import QuoteHub
+
+stock_module = sys.modules['services.stock_service']
+
+TS_CODE = '688385.SH'
+OTHER_CODE = '000001.SZ'
+
+
+def _quote(ts_code, price):
+    return {'ts_code': ts_code, 'stock_name': '测试', 'price': price, 'trade_date': '20240102',
+            'updated_at': f'2024-01-02 10:00:{int(price) % 60:02d}'}
+
+
+def test_publish_to_subscribers(temp_db):
+    """写入后推送给订阅了该股票的客户端；内容不变不重复推送"""
+    hub = QuoteHub(poll_interval=3600)
+    original_hub = stock_module.quote_hub
+    stock_module.quote_hub = hub
+    try:
+        sub = hub.subscribe([TS_CODE])
+        other = hub.subscribe([OTHER_CODE])
+
+        stock_module.stock_service.save_realtime_prices([_quote(TS_CODE, 10.5), _quote('600000.SH', 8.0)])
+        quote = sub.get(timeout=5)
+        assert quote['ts_code'] == TS_CODE and quote['price'] == 10.5
+        assert other.get(timeout=0.2) is None
+
+        # 未变化的行情不推送
+        assert hub.dispatch() == 0
+
+        # 其他进程直接写库：分发时查库发现
+        stock_module.db_manager.execute_update(
+            "INSERT OR REPLACE INTO stock_realtime (ts_code, stock_name, price, updated_at) VALUES (%s, %s, %s, %s)",
+            (OTHER_CODE, '平安银行', 12.3, '2024-01-02 10:00:05'))
+        assert hub.dispatch() == 1
+        assert other.get(timeout=1)['price'] == 12.3 and sub.get(timeout=0.2) is None
+
+        hub.unsubscribe(sub)
+        hub.unsubscribe(other)
+        assert hub.status() == {'subscribers': 0, 'codes': 0}
+    finally:
+        stock_module.quote_hub = original_hub
+    print("✅ 行情推送")
+
+
+def test_snapshot_not_pushed_again(temp_db):
+    """订阅时已发送的快照不再由分发线程推送；新订阅者的快照不影响已有订阅者收到变化"""
+    hub = QuoteHub(poll_interval=3600)
+    stock_module.stock_service.save_realtime_prices([_quote(TS_CODE, 10.5)])
+    first = hub.subscribe([TS_CODE])
+    assert hub.snapshot([TS_CODE], first)[TS_CODE]['price'] == 10.5
+    assert hub.dispatch() == 0
+
+    # 价格变化后、分发之前有新客户端订阅：新客户端从快照拿到新价格，老客户端仍由分发收到
+    stock_module.db_manager.execute_update(
+        "UPDATE stock_realtime SET price = %s, updated_at = %s WHERE ts_code = %s",
+        (11.0, '2024-01-02 10:00:11', TS_CODE))
+    second = hub.subscribe([TS_CODE])
+    hub.snapshot([TS_CODE], second)
+    assert hub.dispatch() == 1
+    assert first.get(timeout=1)['price'] == 11.0 and second.get(timeout=0.2) is None
+
+    hub.unsubscribe(first)
+    hub.unsubscribe(second)
+    print("✅ 快照不重复推送")
+
+
+def test_slow_subscriber_keeps_latest():
+    """客户端处理不过来时丢弃最旧的行情"""
+    hub = QuoteHub(poll_interval=3600)
+    sub = hub.subscribe([TS_CODE])
+    for i in range(300):
+        sub.put(_quote(TS_CODE, i))
+    received = []
+    while (quote := sub.get(timeout=0)) is not None:
+        received.append(quote['price'])
+    assert len(received) == 200 and received[-1] == 299
+    hub.unsubscribe(sub)
+    print("✅ 慢客户端")
+
+
+def test_stream_endpoint(temp_db):
+    """SSE接口先推送当前行情"""
+    stock_module.stock_service.save_realtime_prices([_quote(TS_CODE, 10.5)])
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    assert client.get('/api/stock/realtime/stream').status_code == 400
+
+    response = client.get(f'/api/stock/realtime/stream?codes={TS_CODE}')
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    chunks = response.response
+    assert next(chunks).startswith(b'retry:')
+    event = next(chunks).decode()
+    assert event.startswith('event: quote\ndata: ')
+    assert json.loads(event.split('data: ', 1)[1])['price'] == 10.5
+    response.close()
+    assert app_module.quote_hub.status()['subscribers'] == 0
+    print("✅ SSE接口")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
@@ -0,0 +1,192 @@
+"""
+Tushare接口令牌桶限流测试
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import pytest
+
+from config import _parse_rate_limits
+from utils.rate_limiter import RateLimiter, RateLimitedClient, RateLimitExceeded, TokenBucket
+
+
+def test_bucket_burst_and_refill():
+    """桶容量内立即放行，之后按配额匀速补充"""
+    bucket = TokenBucket(per_minute=600, burst=3)  # 每秒10个
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = bucket.take()
+    assert 0.05 < wait <= 0.1
+    time.sleep(wait)
+    assert bucket.take() == 0.0
+    print("✅ 令牌桶突发与补充")
+
+
+def test_acquire_waits_and_records_stats():
+    """取不到令牌时等待，并统计等待时长"""
+    limiter = RateLimiter({'daily': 1200}, default_quota=60)  # daily 每秒20个，容量200
+    limiter._bucket('daily')[0].tokens = 0
+
+    threads = [threading.Thread(target=limiter.acquire, args=('daily',)) for _ in range(4)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    stats = limiter.stats()['daily']
+    assert stats['calls'] == 4 and stats['waits'] == 4
+    assert 0.15 <= elapsed < 1.0  # 4个令牌约0.2秒
+    assert stats['wait_max'] >= stats['wait_avg'] > 0
+    print("✅ 阻塞等待与统计")
+
+
+def test_try_acquire_and_non_blocking():
+    """try_acquire不等待；non_blocking上下文内配额不足时抛出并记录"""
+    limiter = RateLimiter({'pro_bar': 2})
+    assert limiter.try_acquire('pro_bar')
+    assert not limiter.try_acquire('pro_bar')
+
+    with limiter.non_blocking() as quota:
+        try:
+            limiter.acquire('pro_bar')
+            assert False, '应该抛出RateLimitExceeded'
+        except RateLimitExceeded as e:
+            assert e.endpoint == 'pro_bar' and 25 < e.retry_after <= 30
+    assert len(quota.rejected) == 1 and quota.retry_after == quota.rejected[0].retry_after
+
+    # 超时参数：等待时间超过timeout时抛出
+    try:
+        limiter.acquire('pro_bar', timeout=0.1)
+        assert False, '应该超时'
+    except RateLimitExceeded:
+        pass
+    assert limiter.stats()['pro_bar']['rejected'] == 3
+    print("✅ 非阻塞获取")
+
+
+def test_client_proxy():
+    """代理按接口名取令牌，非接口属性直接透传"""
+
+    class FakePro:
+        token = 'abc'
+
+        def daily(self, **kwargs):
+            return kwargs
+
+    limiter = RateLimiter({'daily': 60})
+    pro = RateLimitedClient(FakePro(), limiter)
+    assert pro.token == 'abc'
+    assert pro.daily(trade_date='20240102') == {'trade_date': '20240102'}
+    limiter._bucket('daily')[0].tokens = 1
+    with limiter.non_blocking() as quota:
+        pro.daily()
+        try:
+            pro.daily()
+            assert False, '应该抛出RateLimitExceeded'
+        except RateLimitExceeded:
+            pass
+    stats = limiter.stats()['daily']
+    assert stats['calls'] == 2 and stats['rejected'] == 1
+    assert len(quota.rejected) == 1
+    print("✅ pro接口代理")
+
+
+def test_web_handler_returns_429():
+    """Web请求在配额不足时返回429"""
+    import app as app_module
+    from services.stock_service import stock_service
+
+    limiter = app_module.rate_limiter
+    bucket = limiter._bucket('stock_basic')[0]
+    original_pro = stock_service.pro
+    bucket_tokens = bucket.tokens
+
+    class FakePro:
+        def stock_basic(self, **kwargs):
+            raise AssertionError('不应调用')
+
+    stock_service.pro = RateLimitedClient(FakePro(), limiter)
+    bucket.tokens = 0
+    try:
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = client.get('/api/stock/info/600519')
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+    finally:
+        stock_service.pro = original_pro
+        bucket.tokens = bucket_tokens
+    print("✅ Web请求限流返回429")
+
+
+def test_non_positive_quota_rejected():
+    """配额为0或负数时在解析配置/创建限流器时报错，而不是调用时除零"""
+    assert _parse_rate_limits('daily:500, pro_bar:2', {}) == {'daily': 500, 'pro_bar': 2}
+    for text in ('daily:0', 'daily:-1'):
+        with pytest.raises(ValueError):
+            _parse_rate_limits(text, {})
+    with pytest.raises(ValueError):
+        RateLimiter({'daily': 0})
+    with pytest.raises(ValueError):
+        RateLimiter(default_quota=0)
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+    print("✅ 非正配额")
+
+
+def test_write_endpoint_checks_quota_first(temp_db, monkeypatch):
+    """添加自选股：配额不足时在写库前返回429；写库后的K线拉取被限流不影响结果"""
+    import app as app_module
+    from services.stock_service import stock_service
+
+    class FakePro:
+        def stock_basic(self, ts_code, fields):
+            return pd.DataFrame([{'ts_code': ts_code, 'name': '测试股票'}])
+
+    def update_stock_data(ts_code):
+        """与真实实现一样，接口失败时记录并返回False"""
+        try:
+            limiter.acquire('daily')
+            return True
+        except RateLimitExceeded:
+            return False
+
+    limiter = RateLimiter({'stock_basic': 60, 'daily': 60})
+    monkeypatch.setattr(app_module, 'rate_limiter', limiter)
+    monkeypatch.setattr(stock_service, 'pro', RateLimitedClient(FakePro(), limiter))
+    monkeypatch.setattr(stock_service, 'update_stock_data', update_stock_data)
+    stock_service.info_cache.invalidate()
+
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    limiter._bucket('stock_basic')[0].tokens = 0
+    response = client.post('/api/watchlist', json={'stock_code': '600999'})
+    assert response.status_code == 429 and response.headers['Retry-After']
+    assert temp_db.execute_query("SELECT COUNT(*) AS c FROM watchlist", fetch_one=True)['c'] == 0
+
+    limiter._bucket('stock_basic')[0].tokens = 1
+    limiter._bucket('daily')[0].tokens = 0
+    response = client.post('/api/watchlist', json={'stock_code': '600999'})
+    assert response.status_code == 200, response.get_json()
+    assert temp_db.execute_query("SELECT stock_code FROM watchlist", fetch_one=True)['stock_code'] == '600999.SH'
+    assert limiter.stats()['daily']['rejected'] == 1
+    print("✅ 写库前检查配额")
+
+
+if __name__ == '__main__':
+    test_bucket_burst_and_refill()
+    test_acquire_waits_and_records_stats()
+    test_try_acquire_and_non_blocking()
+    test_client_proxy()
+    test_web_handler_returns_429()
+    test_non_positive_quota_rejected()
+    print("🎉 所有测试通过！")
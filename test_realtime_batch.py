@@ -0,0 +1,108 @@
+"""
+批量实时行情刷新测试（使用假的行情接口和临时数据库）
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import pytest
+
+from config import config
+from services.stock_service import stock_service
+
+stock_service_module = sys.modules['services.stock_service']
+
+CODES = [f'60{i:04d}.SH' for i in range(120)]
+
+
+class FakeTs:
+    """假的旧版实时行情接口：支持多代码，记录并发数"""
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def get_realtime_quotes(self, codes):
+        with self.lock:
+            self.requests.append(list(codes))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        rows = [{'code': code, 'name': f'股票{code}', 'price': '10.50', 'open': '10.00', 'pre_close': '10.00',
+                 'high': '11.00', 'low': '9.90', 'volume': '1000', 'amount': '10500', 'change': '0.50',
+                 'changepercent': '5.0'} for code in codes if code not in self.missing]
+        return pd.DataFrame(rows)
+
+
+class FakePro:
+    """daily_basic 按交易日返回全市场；今天尚未发布"""
+
+    def __init__(self):
+        self.calls = []
+
+    def daily_basic(self, trade_date=None, ts_code=None, limit=None):
+        self.calls.append(('daily_basic', trade_date, ts_code))
+        if trade_date == datetime.now().strftime('%Y%m%d'):
+            return pd.DataFrame()
+        return pd.DataFrame({'ts_code': CODES + ['000001.SZ'], 'trade_date': trade_date,
+                             'total_mv': 100.0, 'circ_mv': 80.0, 'pe': 12.0, 'pe_ttm': 11.0,
+                             'pb': 1.5, 'dv_ratio': 2.0})
+
+    def daily(self, ts_code=None, **kwargs):
+        self.calls.append(('daily', None, ts_code))
+        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+        return pd.DataFrame([{'ts_code': ts_code, 'trade_date': yesterday, 'close': 9.0, 'open': 8.8,
+                              'pre_close': 8.9, 'high': 9.1, 'low': 8.7, 'vol': 100.0, 'amount': 900.0}])
+
+
+@pytest.fixture
+def env(temp_db, monkeypatch):
+    """临时数据库和假的行情接口"""
+    monkeypatch.setattr(stock_service_module, 'ts', FakeTs())
+    monkeypatch.setattr(stock_service, 'pro', FakePro())
+    return SimpleNamespace(manager=temp_db, ts=stock_service_module.ts, pro=stock_service.pro)
+
+
+def test_batched_refresh(env):
+    """分组并发请求，基本面一次获取，一次写入"""
+    prices = stock_service.fetch_realtime_prices(CODES)
+    assert len(prices) == len(CODES)
+
+    chunks = env.ts.requests
+    assert len(chunks) == -(-len(CODES) // config.REALTIME_CHUNK_SIZE)
+    assert sorted(code for chunk in chunks for code in chunk) == [c[:6] for c in CODES]
+    assert env.ts.max_active > 1
+
+    # 今天无数据，回退到昨天，共两次按交易日调用
+    assert [c[2] for c in env.pro.calls] == [None, None]
+    assert prices[0]['pe'] == 12.0 and prices[0]['price'] == 10.5
+
+    assert stock_service.save_realtime_prices(prices) == len(CODES)
+    stored = stock_service.get_realtime_price(CODES[-1])
+    assert stored['price'] == 10.5 and stored['total_mv'] == 100.0
+    print("✅ 批量实时行情")
+
+
+def test_missing_quote_falls_back_to_daily(env):
+    """实时接口没有返回的股票降级使用日K线"""
+    env.ts.missing = {CODES[0][:6]}
+    prices = {p['ts_code']: p for p in stock_service.fetch_realtime_prices(CODES[:3])}
+    assert prices[CODES[0]]['price'] == 9.0
+    assert prices[CODES[1]]['price'] == 10.5
+    assert ('daily', None, CODES[0]) in env.pro.calls
+    print("✅ 缺失行情降级")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
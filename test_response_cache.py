@@ -0,0 +1,96 @@
+"""
+K线/指标接口响应缓存测试（缓存命中、写入新数据后失效、ETag/Last-Modified 304、跨进程版本同步）
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+import services.data_versions as versions_module
+
+TS_CODE = '688385.SH'
+
+
+class FakeVersions:
+    def __init__(self):
+        self.versions = {}
+
+    def get(self, ts_code):
+        return self.versions.get(ts_code, 0.0)
+
+    def bump(self, ts_codes):
+        for ts_code in ts_codes:
+            self.versions[ts_code] = self.versions.get(ts_code, 1700000000.0) + 1
+
+
+def _client():
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    return client
+
+
+def test_cache_hit_invalidation_and_304():
+    """重复请求不查库；数据写入后重新查询；条件请求返回304"""
+    calls = []
+    service = app_module.stock_service
+    original_get = service.get_indicators_from_db
+    original_versions = app_module.data_versions
+    versions = FakeVersions()
+    versions.bump([TS_CODE])
+    app_module.data_versions = versions
+    app_module.response_cache.invalidate()
+    service.get_indicators_from_db = lambda code, days: calls.append((code, days)) or [{'macd': len(calls)}]
+    try:
+        client = _client()
+        first = client.get(f'/api/stock/indicators/{TS_CODE}?days=30')
+        assert first.status_code == 200 and first.json['data'] == [{'macd': 1}]
+        etag = first.headers['ETag']
+        assert first.headers['Last-Modified'] and 'no-cache' in first.headers['Cache-Control']
+
+        again = client.get(f'/api/stock/indicators/{TS_CODE}?days=30')
+        assert again.json['data'] == [{'macd': 1}] and len(calls) == 1
+
+        # 浏览器重复加载：带ETag或Last-Modified时返回304，不查库
+        assert client.get(f'/api/stock/indicators/{TS_CODE}?days=30',
+                          headers={'If-None-Match': etag}).status_code == 304
+        assert client.get(f'/api/stock/indicators/{TS_CODE}?days=30',
+                          headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+        assert len(calls) == 1
+
+        # 不同参数分别缓存
+        client.get(f'/api/stock/indicators/{TS_CODE}?days=60')
+        assert len(calls) == 2
+
+        # 写入新数据后：旧ETag失效，重新查询
+        versions.bump([TS_CODE])
+        fresh = client.get(f'/api/stock/indicators/{TS_CODE}?days=30', headers={'If-None-Match': etag})
+        assert fresh.status_code == 200 and fresh.json['data'] == [{'macd': 3}]
+        assert fresh.headers['ETag'] != etag
+    finally:
+        service.get_indicators_from_db = original_get
+        app_module.data_versions = original_versions
+        app_module.response_cache.invalidate()
+    print("✅ 响应缓存与304")
+
+
+def test_versions_sync_across_processes(temp_db):
+    """其他进程写入的版本在同步间隔后可见"""
+    writer = versions_module.DataVersions(sync_interval=0)
+    reader = versions_module.DataVersions(sync_interval=3600)
+    assert reader.get(TS_CODE) == 0.0          # 首次同步
+
+    writer.bump([TS_CODE, TS_CODE])
+    assert writer.get(TS_CODE) > 0
+    assert reader.get(TS_CODE) == 0.0          # 同步间隔内不查库
+
+    reader._synced_at = None
+    assert reader.get(TS_CODE) == writer.get(TS_CODE)
+    print("✅ 跨进程版本同步")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
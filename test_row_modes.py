@@ -0,0 +1,106 @@
+"""
+查询行格式（row_mode）测试
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pytest
+
+from database.db_manager_sqlite import DatabaseManager
+from services.ai_service import AIService
+from services.stock_service import stock_service
+
+ROWS = [
+    ('688385.SH', '2024-01-02', 10.0, 10.5, 9.8, 10.2, 12345),
+    ('688385.SH', '2024-01-03', 10.2, 10.8, 10.1, 10.6, 23456),
+]
+
+
+def _make_manager(tmp_dir):
+    manager = DatabaseManager(db_path=os.path.join(tmp_dir, 'test.db'))
+    manager.execute_update("""
+    CREATE TABLE stock_daily (ts_code TEXT, trade_date DATE, open REAL, high REAL,
+                              low REAL, close REAL, volume INTEGER, amount REAL)
+    """)
+    manager.execute_many(
+        "INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, volume) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        ROWS
+    )
+    return manager
+
+
+def test_row_modes():
+    """三种行格式返回同样的数据"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = _make_manager(tmp_dir)
+        query = "SELECT * FROM stock_daily ORDER BY trade_date"
+
+        dict_rows = manager.execute_query(query)
+        tuple_rows = manager.execute_query(query, row_mode='tuple')
+        columns = manager.execute_query(query, row_mode='columns')
+
+        assert [row[:7] for row in tuple_rows] == ROWS
+        assert [tuple(d.values())[:7] for d in dict_rows] == ROWS
+        assert columns['close'] == [10.2, 10.6]
+        assert columns['trade_date'] == ['2024-01-02', '2024-01-03']
+
+        # 空结果仍保留列名
+        empty = manager.execute_query("SELECT * FROM stock_daily WHERE ts_code = %s", ('x',), row_mode='columns')
+        assert empty['close'] == []
+
+        # 默认行格式不受影响
+        assert manager.execute_query(query, fetch_one=True)['ts_code'] == '688385.SH'
+        manager.close_all()
+    print("✅ 行格式一致")
+
+
+def test_format_kline_columns():
+    """列式数据与行字典的K线格式化结果一致"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = _make_manager(tmp_dir)
+        query = "SELECT * FROM stock_daily ORDER BY trade_date"
+        dict_rows = manager.execute_query(query)
+        columns = manager.execute_query(query, row_mode='columns')
+        manager.close_all()
+
+    ai = AIService.__new__(AIService)
+    assert ai._format_kline_data(dict_rows) == ai._format_kline_data(columns)
+    assert ai._format_kline_data({'trade_date': []}) == "暂无数据"
+    print("✅ K线格式化一致")
+
+
+def test_kline_arrays(temp_db):
+    """get_kline_arrays 返回正序的连续数组，格式化结果与行字典一致"""
+    temp_db.execute_many(
+        "INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, volume) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        ROWS
+    )
+    arrays = stock_service.get_kline_arrays('688385.SH', 'daily', 10)
+    frame = stock_service.get_kline_frame('688385.SH', 'daily', 10)
+    dict_rows = stock_service.get_stock_data_from_db('688385.SH', 'daily', 10)
+    empty = stock_service.get_kline_arrays('000000.SZ', 'daily', 10)
+
+    assert arrays['trade_date'].dtype == np.dtype('datetime64[ns]')
+    assert arrays['close'].dtype == np.float64 and arrays['close'].flags['C_CONTIGUOUS']
+    assert arrays['close'].tolist() == [10.2, 10.6]
+    assert np.isnan(arrays['amount']).all()
+    assert list(frame.index.strftime('%Y-%m-%d')) == ['2024-01-02', '2024-01-03']
+    assert len(empty['close']) == 0 and len(empty['trade_date']) == 0
+
+    ai = AIService.__new__(AIService)
+    assert ai._format_kline_data(arrays) == ai._format_kline_data(dict_rows)
+
+    columns = stock_service.kline_arrays_to_columns(arrays)
+    assert columns['trade_date'] == ['2024-01-02', '2024-01-03']
+    assert columns['amount'] == [None, None]
+    print("✅ K线数组")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
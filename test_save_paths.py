@@ -0,0 +1,84 @@
+"""
+批量保存路径测试（按列转换参数）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.stock_service import stock_service
+
+stock_service_module = sys.modules['services.stock_service']
+
+
+class RecordingManager:
+    """记录execute_many收到的参数"""
+
+    def __init__(self):
+        self.calls = []
+
+    def execute_many(self, query, params_list):
+        self.calls.append((query, params_list))
+        return len(params_list)
+
+
+def _with_manager(manager, func, *args):
+    original = stock_service_module.db_manager
+    stock_service_module.db_manager = manager
+    try:
+        return func(*args)
+    finally:
+        stock_service_module.db_manager = original
+
+
+def test_kline_params(temp_db):
+    """字典列表和DataFrame生成相同的参数元组，日期按列格式化，NaN转为None
+
+    只替换 stock_service 的 db_manager，数据版本写入临时库
+    """
+    df = pd.DataFrame({
+        'ts_code': ['600519.SH', '600519.SH'],
+        'trade_date': pd.to_datetime(['20240102', '20240103']),
+        'open': [10.0, 10.2], 'high': [10.5, 10.8], 'low': [9.8, 10.1],
+        'close': [10.2, 10.6], 'vol': [100.0, np.nan], 'amount': [1000.0, 2000.0]
+    })
+    recorder = RecordingManager()
+    _with_manager(recorder, stock_service.save_daily_data, df.to_dict('records'))
+    _with_manager(recorder, stock_service.save_daily_data, df)
+    from_list, from_frame = recorder.calls[0][1], recorder.calls[1][1]
+
+    assert from_list == from_frame
+    assert from_list[0] == ('600519.SH', '2024-01-02', 10.0, 10.5, 9.8, 10.2, 100.0, 1000.0)
+    assert from_list[1][6] is None
+    assert all(type(v) is float for v in from_list[0][2:])
+
+    # 缺少vol/amount列时填0；分钟K的时间精确到秒
+    minute = df.drop(columns=['vol', 'amount']).rename(columns={'trade_date': 'trade_time'})
+    minute['trade_time'] += pd.Timedelta(hours=9, minutes=31)
+    _with_manager(recorder, stock_service.save_minute_data, minute)
+    assert recorder.calls[2][1][0][1:] == ('2024-01-02 09:31:00', 10.0, 10.5, 9.8, 10.2, 0, 0)
+    print("✅ K线参数构建")
+
+
+def test_indicator_roundtrip(temp_db):
+    """批量计算的指标写入后与原值一致，未就绪的行不写入"""
+    closes = 50 + np.cumsum(np.random.default_rng(3).normal(0, 1, 40))
+    bars = pd.DataFrame({'trade_date': pd.date_range('2024-01-01', periods=40), 'close': closes})
+    indicators = stock_service.calculate_indicators(bars)
+
+    saved = stock_service.save_indicators('688385.SH', indicators)
+    stored = temp_db.execute_query("SELECT * FROM stock_indicators ORDER BY trade_date", row_mode='columns')
+
+    assert saved == 40 - 5  # 前5行RSI(6)未就绪
+    assert stored['trade_date'][0] == '2024-01-06'
+    assert np.allclose(stored['rsi_24'][-1], indicators['rsi_24'].iloc[-1])
+    assert stored['rsi_24'][0] is None
+    print("✅ 指标写入")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
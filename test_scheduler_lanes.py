@@ -0,0 +1,85 @@
+"""
+定时任务通道测试（任务合并、通道隔离、单股任务并发）
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.scheduler_service import JobLane, SchedulerService
+
+
+def _wait_idle(lane, job_name, timeout=2):
+    deadline = time.monotonic() + timeout
+    while lane.is_active(job_name) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_overlapping_runs_coalesced():
+    """同一任务未结束时再次触发被合并"""
+    lane = JobLane('kline', 2)
+    release = threading.Event()
+    runs = []
+
+    def job(executor):
+        runs.append(1)
+        release.wait(1)
+
+    assert lane.submit('kline_data', job)
+    assert not lane.submit('kline_data', job)
+    assert not lane.submit('kline_data', job)
+    release.set()
+    _wait_idle(lane, 'kline_data')
+
+    assert lane.submit('kline_data', job)
+    _wait_idle(lane, 'kline_data')
+    stats = lane.status()['jobs']['kline_data']
+    assert len(runs) == 2 and stats['runs'] == 2 and stats['coalesced'] == 2
+    lane.shutdown()
+    print("✅ 重叠触发合并")
+
+
+def test_lanes_do_not_block_each_other():
+    """K线任务运行中，实时任务照常执行"""
+    scheduler = SchedulerService()
+    scheduler.lanes = {'realtime': JobLane('realtime', 2), 'kline': JobLane('kline', 2)}
+    release = threading.Event()
+    done = threading.Event()
+
+    scheduler.submit('kline', 'kline_data', lambda executor: release.wait(2))
+    scheduler.submit('realtime', 'realtime_price', lambda executor: done.set())
+    assert done.wait(1)
+    assert scheduler.status()['lanes']['kline']['active'] == ['kline_data']
+
+    release.set()
+    for lane in scheduler.lanes.values():
+        lane.shutdown(wait=True)
+    print("✅ 通道互不阻塞")
+
+
+def test_per_stock_tasks_concurrent():
+    """任务内的单股步骤在通道线程池中并发执行，失败计入统计"""
+    lane = JobLane('kline', 4)
+    result = {}
+
+    def job(executor):
+        start = time.monotonic()
+        list(executor.map(lambda code: time.sleep(0.1), range(4)))
+        result['elapsed'] = time.monotonic() - start
+        raise RuntimeError('boom')
+
+    lane.submit('kline_data', job)
+    _wait_idle(lane, 'kline_data')
+    assert result['elapsed'] < 0.3
+    assert lane.status()['jobs']['kline_data']['failures'] == 1
+    lane.shutdown()
+    print("✅ 单股任务并发")
+
+
+if __name__ == '__main__':
+    test_overlapping_runs_coalesced()
+    test_lanes_do_not_block_each_other()
+    test_per_stock_tasks_concurrent()
+    print("🎉 所有测试通过！")
@@ -0,0 +1,128 @@
+"""
+定时调度测试（Cron表达式、精确唤醒、错过触发补跑）
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.scheduler_service import JobLane, ScheduledJob, SchedulerService
+from utils.cron import CronExpression
+
+
+class Every:
+    """测试用触发器：固定间隔"""
+
+    def __init__(self, seconds):
+        self.interval = timedelta(seconds=seconds)
+        self.expression = f'every {seconds}s'
+
+    def next_after(self, dt):
+        return dt + self.interval
+
+
+def _scheduler():
+    """不带默认任务的调度器"""
+    scheduler = SchedulerService()
+    scheduler.jobs = {}
+    return scheduler
+
+
+def test_cron_next_after():
+    """Cron表达式计算下次触发时间"""
+    base = datetime(2024, 1, 5, 14, 59, 30)  # 周五
+    assert CronExpression('* * * * *').next_after(base) == datetime(2024, 1, 5, 15, 0)
+    assert CronExpression('0 * * * *').next_after(base) == datetime(2024, 1, 5, 15, 0)
+    assert CronExpression('@daily').next_after(base) == datetime(2024, 1, 6, 0, 0)
+    # 工作日9:30-11:30每5分钟：周五15点之后下一次是周一9:30
+    cron = CronExpression('30-59/5 9 * * 1-5')
+    assert cron.next_after(base) == datetime(2024, 1, 8, 9, 30)
+    assert cron.next_after(datetime(2024, 1, 8, 9, 30)) == datetime(2024, 1, 8, 9, 35)
+    # 跨月、跨年
+    assert CronExpression('0 0 1 * *').next_after(datetime(2024, 12, 15)) == datetime(2025, 1, 1)
+    # 日和周同时限定时满足其一即可；周日可写作0或7
+    cron = CronExpression('0 12 13 * 7')
+    assert cron.next_after(datetime(2024, 1, 5)) == datetime(2024, 1, 7, 12, 0)
+    assert cron.next_after(datetime(2024, 1, 8)) == datetime(2024, 1, 13, 12, 0)
+
+    for bad in ['* * * *', '60 * * * *', '*/0 * * * *', '5-1 * * * *']:
+        try:
+            CronExpression(bad)
+            assert False, bad
+        except ValueError:
+            pass
+    print("✅ Cron表达式")
+
+
+def test_fires_on_time_without_polling():
+    """任务在计划时间约100ms内触发"""
+    scheduler = _scheduler()
+    fired = []
+    done = threading.Event()
+
+    def job(executor):
+        fired.append(datetime.now())
+        if len(fired) == 3:
+            done.set()
+
+    scheduler.add_job(ScheduledJob('tick', Every(0.2), 'realtime', job))
+    scheduler.start()
+    try:
+        assert done.wait(2)
+        status = scheduler.status()['jobs']['tick']
+        assert status['fired'] >= 3 and status['next_run']
+        assert status['last_lag_ms'] < 100
+        gaps = [(b - a).total_seconds() for a, b in zip(fired, fired[1:])]
+        assert all(0.1 < gap < 0.3 for gap in gaps), gaps
+    finally:
+        scheduler.stop()
+    print("✅ 精确唤醒")
+
+
+def test_added_job_wakes_scheduler():
+    """调度线程空闲时新增任务会被立即排期"""
+    scheduler = _scheduler()
+    done = threading.Event()
+    scheduler.start()
+    try:
+        time.sleep(0.05)
+        scheduler.add_job(ScheduledJob('late', Every(0.05), 'kline', lambda executor: done.set()))
+        assert done.wait(1)
+    finally:
+        scheduler.stop()
+    print("✅ 新增任务唤醒")
+
+
+def test_missed_runs_recorded_and_caught_up():
+    """延迟期间错过的触发合并为一次补跑；不补跑的任务直接跳过"""
+    scheduler = _scheduler()
+    scheduler.lanes = {'kline': JobLane('kline', 1)}
+    runs = []
+    catch_up = ScheduledJob('hourly', '0 * * * *', 'kline', lambda executor: runs.append('hourly'))
+    skip = ScheduledJob('minutely', '* * * * *', 'kline', lambda executor: runs.append('minutely'),
+                        catch_up=False)
+
+    now = datetime.now()
+    due = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    scheduler._fire(catch_up, due)
+    assert catch_up.missed == 3
+    assert catch_up.next_run > now
+
+    scheduler._fire(skip, now.replace(second=0, microsecond=0) - timedelta(minutes=2))
+    assert skip.missed == 3
+
+    scheduler.lanes['kline'].shutdown(wait=True)
+    assert catch_up.fired == 1 and skip.fired == 0
+    assert runs == ['hourly']
+    print("✅ 错过触发与补跑")
+
+
+if __name__ == '__main__':
+    test_cron_next_after()
+    test_fires_on_time_without_polling()
+    test_added_job_wakes_scheduler()
+    test_missed_runs_recorded_and_caught_up()
+    print("🎉 所有测试通过！")
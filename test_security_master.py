@@ -0,0 +1,95 @@
+"""
+证券主表测试（批量拉取、过期刷新、代码标准化与名称解析走本地索引）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import pytest
+
+from services.stock_service import stock_service
+import services.security_master as master_module
+
+
+class FakePro:
+    """假的基本信息接口，记录调用"""
+
+    def __init__(self):
+        self.calls = []
+
+    def stock_basic(self, **kwargs):
+        self.calls.append('stock_basic')
+        return pd.DataFrame([
+            {'ts_code': '688385.SH', 'symbol': '688385', 'name': '复旦微电', 'area': '上海',
+             'industry': '半导体', 'list_date': '20210804', 'cnspell': 'FDWD'},
+            {'ts_code': '000001.SZ', 'symbol': '000001', 'name': '平安银行', 'area': '深圳',
+             'industry': '银行', 'list_date': '19910403', 'cnspell': 'PAYH'},
+            {'ts_code': '830799.BJ', 'symbol': '830799', 'name': '艾融软件', 'area': '上海',
+             'industry': '软件服务', 'list_date': '20191227', 'cnspell': 'ARRJ'},
+        ])
+
+    def index_basic(self, market=None, **kwargs):
+        self.calls.append(f'index_basic:{market}')
+        if market != 'SSE':
+            return pd.DataFrame()
+        return pd.DataFrame([{'ts_code': '000001.SH', 'name': '上证指数', 'market': 'SSE',
+                              'publisher': '中证公司', 'category': '综合指数'}])
+
+    def fund_basic(self, **kwargs):
+        self.calls.append('fund_basic')
+        return pd.DataFrame([{'ts_code': '510300.SH', 'name': '沪深300ETF', 'management': '华泰柏瑞',
+                              'fund_type': '股票型', 'issue_date': '20120504', 'list_date': None}])
+
+
+def test_bulk_refresh_and_staleness(temp_db):
+    """一次刷新拉取全部类型；有效期内不再调用接口"""
+    master = master_module.SecurityMaster()
+    pro = FakePro()
+    assert master.is_stale()
+    assert master.refresh_if_stale(pro) == 5
+    assert pro.calls == ['stock_basic', 'index_basic:SSE', 'index_basic:SZSE', 'fund_basic']
+
+    assert master.refresh_if_stale(pro) == 0
+    assert len(pro.calls) == 4
+
+    count = temp_db.execute_query("SELECT COUNT(*) AS c FROM securities", fetch_one=True)['c']
+    assert count == 5
+    assert master.get('510300.SH') == {'ts_code': '510300.SH', 'name': '沪深300ETF', 'management': '华泰柏瑞',
+                                       'fund_type': '股票型', 'issue_date': '20120504',
+                                       'list_date': None, 'type': 'fund'}
+
+    temp_db.execute_update("UPDATE securities SET updated_at = '2000-01-01 00:00:00'")
+    assert master.is_stale()
+    print("✅ 批量刷新与过期判断")
+
+
+def test_local_resolution(temp_db):
+    """名称、拼音缩写和数字代码解析不调用接口"""
+    master = master_module.SecurityMaster()
+    master.refresh(FakePro())
+
+    original_master = sys.modules['services.stock_service'].security_master
+    original_pro = stock_service.pro
+    sys.modules['services.stock_service'].security_master = master
+    stock_service.pro = None  # 任何接口调用都会失败
+    try:
+        assert stock_service.normalize_stock_code('复旦微电') == '688385.SH'
+        assert stock_service.normalize_stock_code('fdwd') == '688385.SH'
+        assert stock_service.normalize_stock_code('000001') == '000001.SH'   # 规则优先（上证指数）
+        assert stock_service.normalize_stock_code('830799') == '830799.BJ'   # 规则推断不存在，以主表为准
+        assert stock_service.normalize_stock_code('600000') == '600000.SH'   # 主表中没有，按规则
+
+        info = stock_service.get_stock_info('复旦微电')
+        assert info['ts_code'] == '688385.SH' and info['type'] == 'stock' and info['industry'] == '半导体'
+        assert stock_service.get_stock_info('000001.SZ')['name'] == '平安银行'
+        assert stock_service.get_stock_info('000001')['name'] == '上证指数'
+    finally:
+        sys.modules['services.stock_service'].security_master = original_master
+        stock_service.pro = original_pro
+    print("✅ 本地解析")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
@@ -0,0 +1,118 @@
+"""
+SQLite连接池测试
+"""
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database.db_manager_sqlite import DatabaseManager
+
+
+def _make_manager(tmp_dir, pool_size=2):
+    manager = DatabaseManager(db_path=os.path.join(tmp_dir, 'test.db'), pool_size=pool_size)
+    manager.execute_update("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+    return manager
+
+
+def test_connection_reused():
+    """连续查询复用同一个连接"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = _make_manager(tmp_dir)
+        with manager.get_connection() as conn1:
+            pass
+        with manager.get_connection() as conn2:
+            pass
+        assert conn1 is conn2
+        manager.close_all()
+    print("✅ 连接复用")
+
+
+def test_pragmas():
+    """WAL和synchronous在连接创建时配置"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = _make_manager(tmp_dir)
+        mode = manager.execute_query("PRAGMA journal_mode", fetch_one=True)
+        sync = manager.execute_query("PRAGMA synchronous", fetch_one=True)
+        assert mode['journal_mode'] == 'wal'
+        assert sync['synchronous'] == 1  # NORMAL
+        manager.close_all()
+    print("✅ PRAGMA配置")
+
+
+def test_wal_set_once_under_concurrency(monkeypatch):
+    """多个线程同时创建第一批连接时，只有一个连接执行切换WAL"""
+    import database.db_manager_sqlite as sqlite_module
+    statements = []
+    connect = sqlite_module.sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(sqlite_module.sqlite3, 'connect', traced_connect)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = DatabaseManager(db_path=os.path.join(tmp_dir, 'test.db'), pool_size=8)
+        barrier = threading.Barrier(8)
+
+        def worker():
+            barrier.wait()
+            manager.execute_query("SELECT 1")
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert statements.count("PRAGMA journal_mode=WAL") == 1
+        manager.close_all()
+    print("✅ WAL只设置一次")
+
+
+def test_nested_and_rollback():
+    """嵌套调用复用外层连接，异常时整体回滚"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = _make_manager(tmp_dir)
+        try:
+            with manager.get_connection() as conn:
+                conn.execute("INSERT INTO t (v) VALUES ('a')")
+                manager.execute_update("INSERT INTO t (v) VALUES (%s)", ('b',))
+                raise RuntimeError('rollback')
+        except RuntimeError:
+            pass
+        count = manager.execute_query("SELECT COUNT(*) AS c FROM t", fetch_one=True)
+        assert count['c'] == 0
+        manager.close_all()
+    print("✅ 嵌套与回滚")
+
+
+def test_concurrent_threads():
+    """多线程并发读写，空闲连接数不超过池大小"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = _make_manager(tmp_dir, pool_size=2)
+
+        def worker(n):
+            for i in range(20):
+                manager.execute_update("INSERT INTO t (v) VALUES (%s)", (f'{n}-{i}',))
+                manager.execute_query("SELECT * FROM t WHERE v = %s", (f'{n}-{i}',))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        count = manager.execute_query("SELECT COUNT(*) AS c FROM t", fetch_one=True)
+        assert count['c'] == 120
+        assert len(manager._idle) <= 2
+        manager.close_all()
+    print("✅ 多线程并发")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
@@ -0,0 +1,91 @@
+"""
+股票基本信息缓存测试（TTL过期、LRU淘汰、负缓存、接口异常不缓存）
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from services.stock_service import stock_service
+from utils.ttl_cache import TTLCache
+
+
+class FakePro:
+    """假的基本信息接口，记录调用次数"""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def stock_basic(self, ts_code=None, fields=None):
+        self.calls.append(('stock_basic', ts_code))
+        if self.fail:
+            raise ConnectionError('network down')
+        if ts_code == '688999.SH':
+            return pd.DataFrame()
+        return pd.DataFrame([{'ts_code': ts_code, 'symbol': ts_code[:6], 'name': f'股票{ts_code[:6]}',
+                              'area': '上海', 'industry': '半导体', 'list_date': '20200101'}])
+
+    def index_basic(self, ts_code=None, fields=None):
+        self.calls.append(('index_basic', ts_code))
+        return pd.DataFrame([{'ts_code': ts_code, 'name': '上证指数', 'market': 'SSE',
+                              'publisher': '中证公司', 'category': '综合指数'}])
+
+
+def test_ttl_and_lru():
+    """过期条目视为未命中，超出容量时淘汰最久未使用的条目"""
+    cache = TTLCache(maxsize=2, ttl=0.05, negative_ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1          # a变为最近使用
+    cache.set('c', 3)                   # 淘汰b
+    assert cache.missing(cache.get('b'))
+    assert cache.get('c') == 3
+
+    cache.set('none', None)             # 负缓存使用negative_ttl
+    time.sleep(0.06)
+    assert cache.missing(cache.get('a'))
+    assert cache.get('none', 'x') is None
+
+    stats = cache.stats()
+    assert stats['hits'] == 3 and stats['misses'] == 2 and stats['evictions'] == 2
+    print("✅ TTL与LRU")
+
+
+def test_get_stock_info_cached():
+    """重复查询只调用一次接口；不存在的代码负缓存；接口异常不缓存"""
+    original_pro = stock_service.pro
+    original_cache = stock_service.info_cache
+    stock_service.info_cache = TTLCache(maxsize=16, ttl=60, negative_ttl=60)
+    try:
+        stock_service.pro = FakePro()
+        info = stock_service.get_stock_info('688385')
+        info['name'] = 'changed'        # 修改返回值不影响缓存
+        assert stock_service.get_stock_info('688385.SH')['name'] == '股票688385'
+        assert stock_service.get_stock_info('000001.SH')['type'] == 'index'
+        assert stock_service.get_stock_info('000001.SH')['name'] == '上证指数'
+        assert stock_service.get_stock_info('688999.SH') is None
+        assert stock_service.get_stock_info('688999') is None
+        assert stock_service.pro.calls == [('stock_basic', '688385.SH'), ('index_basic', '000001.SH'),
+                                           ('stock_basic', '688999.SH')]
+
+        stock_service.pro = FakePro(fail=True)
+        assert stock_service.get_stock_info('600000') is None
+        assert stock_service.get_stock_info('600000') is None
+        assert len(stock_service.pro.calls) == 2
+
+        stats = stock_service.info_cache.stats()
+        assert stats['hits'] == 3 and stats['size'] == 3
+    finally:
+        stock_service.pro = original_pro
+        stock_service.info_cache = original_cache
+    print("✅ get_stock_info缓存")
+
+
+if __name__ == '__main__':
+    test_ttl_and_lru()
+    test_get_stock_info_cached()
+    print("🎉 所有测试通过！")
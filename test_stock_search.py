@@ -0,0 +1,88 @@
+"""
+股票模糊搜索测试（排序、名称片段、增量更新、查询耗时）
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.stock_search import StockSearchIndex, RANK_EXACT, RANK_CODE, RANK_NAME, RANK_CNSPELL, RANK_CONTAINS
+
+
+ROWS = [
+    {'ts_code': '688385.SH', 'symbol': '688385', 'name': '复旦微电', 'cnspell': 'FDWD', 'type': 'stock'},
+    {'ts_code': '000001.SZ', 'symbol': '000001', 'name': '平安银行', 'cnspell': 'PAYH', 'type': 'stock'},
+    {'ts_code': '000001.SH', 'symbol': '000001', 'name': '上证指数', 'cnspell': None, 'type': 'index'},
+    {'ts_code': '510300.SH', 'symbol': '510300', 'name': '沪深300ETF', 'cnspell': None, 'type': 'fund'},
+    {'ts_code': '600000.SH', 'symbol': '600000', 'name': '浦发银行', 'cnspell': 'PFYH', 'type': 'stock'},
+]
+
+
+def _codes(results):
+    return [item['ts_code'] for item in results]
+
+
+def test_ranking():
+    """完全匹配优先，同级A股优先；支持代码、名称、拼音缩写前缀和名称片段"""
+    index = StockSearchIndex()
+    assert index.update(ROWS) == (5, 0)
+
+    assert _codes(index.search('000001')) == ['000001.SZ', '000001.SH']
+    assert index.search('000001')[0]['match'] == RANK_EXACT
+    assert _codes(index.search('6883')) == ['688385.SH']
+    assert index.search('6883')[0]['match'] == RANK_CODE
+    assert index.search('复旦')[0]['match'] == RANK_NAME
+    assert _codes(index.search('pf')) == ['600000.SH'] and index.search('pf')[0]['match'] == RANK_CNSPELL
+
+    # "银行"不是任何名称的前缀，按名称包含匹配
+    results = index.search('银行')
+    assert set(_codes(results)) == {'000001.SZ', '600000.SH'}
+    assert all(item['match'] == RANK_CONTAINS for item in results)
+    assert _codes(index.search('300etf')) == ['510300.SH']
+
+    assert index.search('') == [] and index.search('不存在') == []
+    assert len(index.search('6', limit=1)) == 1
+    print("✅ 搜索排序")
+
+
+def test_incremental_update():
+    """证券列表变化时只增删变化的证券"""
+    index = StockSearchIndex()
+    index.update(ROWS)
+
+    renamed = dict(ROWS[4], name='浦发银行A', cnspell='PFYHA')
+    assert index.update(ROWS[1:4] + [renamed]) == (1, 2)
+    assert index.search('复旦') == []
+    assert index.search('浦发银行a')[0]['match'] == RANK_EXACT
+    assert len(index) == 4
+
+    # 只有返回字段变化（类型）时不重建索引，但结果更新
+    retyped = [dict(row, type='stock') if row['ts_code'] == '510300.SH' else row for row in ROWS[1:4]]
+    assert index.update(retyped + [renamed]) == (0, 0)
+    assert index.search('510300')[0]['type'] == 'stock'
+    print("✅ 增量更新")
+
+
+def test_lookup_latency():
+    """上万只证券时平均单次查询在毫秒级以内"""
+    rows = [{'ts_code': f'{600000 + i}.SH', 'symbol': str(600000 + i), 'name': f'测试股份{i}',
+             'cnspell': f'CSGF{i}', 'type': 'stock'} for i in range(12000)]
+    index = StockSearchIndex()
+    index.update(rows)
+
+    queries = ['6001', '测试股份11', 'csgf99', '股份1']
+    start = time.perf_counter()
+    for _ in range(100):
+        for q in queries:
+            index.search(q)
+    per_query = (time.perf_counter() - start) / (100 * len(queries))
+    assert per_query < 0.002, per_query
+    print(f"✅ 查询耗时 {per_query * 1000:.3f} ms")
+
+
+if __name__ == '__main__':
+    test_ranking()
+    test_incremental_update()
+    test_lookup_latency()
+    print("🎉 所有测试通过！")
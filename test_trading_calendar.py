@@ -0,0 +1,173 @@
+"""
+交易日历与按交易时段调度测试（使用假的日历接口和临时文件）
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import pytest
+
+from services.scheduler_service import JobLane, ScheduledJob, SchedulerService
+from services.stock_service import stock_service
+from services.trading_calendar import TradingCalendar, market_of
+
+# 2024-02-09（周五）A股春节休市，港股正常交易
+A_HOLIDAY = '20240209'
+
+
+class CronAt:
+    """测试用触发器：在指定时间触发，之后每天一次"""
+
+    def __init__(self, first):
+        self.first = first
+        self.expression = f'at {first:%H:%M:%S}'
+
+    def next_after(self, dt):
+        run = self.first
+        while run <= dt:
+            run += timedelta(days=1)
+        return run
+
+
+class FakePro:
+    """假的交易日历接口：工作日开市，A股春节一天休市"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def _calendar(self, start_date, end_date, closed=()):
+        days = pd.date_range(start_date, end_date).strftime('%Y%m%d')
+        return pd.DataFrame({'cal_date': days,
+                             'is_open': [int(pd.Timestamp(d).weekday() < 5 and d not in closed) for d in days]})
+
+    def trade_cal(self, exchange=None, start_date=None, end_date=None, is_open=None):
+        self.calls.append(('trade_cal', exchange, start_date))
+        if self.fail:
+            raise ConnectionError('接口不可用')
+        return self._calendar(start_date, end_date, closed={A_HOLIDAY})
+
+    def hk_tradecal(self, start_date=None, end_date=None, is_open=None):
+        self.calls.append(('hk_tradecal', None, start_date))
+        if self.fail:
+            raise ConnectionError('接口不可用')
+        return self._calendar(start_date, end_date)
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    """假的交易日历接口和临时离线文件"""
+    monkeypatch.setattr(stock_service, 'pro', FakePro())
+    file = str(tmp_path / 'calendar' / 'trade_calendar.json')
+    return SimpleNamespace(pro=stock_service.pro, file=file, calendar=lambda: TradingCalendar(fallback_file=file))
+
+
+def test_calendar_from_api_is_cached(env):
+    """接口日历按年缓存，并写入离线文件"""
+    calendar = env.calendar()
+    assert calendar.is_trading_day(datetime(2024, 2, 8))
+    assert not calendar.is_trading_day(datetime(2024, 2, 9))
+    assert not calendar.is_trading_day(datetime(2024, 2, 10))
+    assert calendar.is_trading_day(datetime(2024, 2, 9), 'HK')
+    assert calendar.source('A', 2024) == 'api'
+    assert [c[0] for c in env.pro.calls] == ['trade_cal', 'hk_tradecal']
+    assert env.pro.calls[0][1] == 'SSE'
+    assert os.path.exists(env.file)
+    print("✅ 接口日历与缓存")
+
+
+def test_fallback_file_and_weekdays(env):
+    """接口失败时读取离线文件，没有文件时按工作日估算"""
+    env.calendar().is_trading_day(datetime(2024, 2, 9))
+
+    env.pro.fail = True
+    calendar = env.calendar()
+    assert not calendar.is_trading_day(datetime(2024, 2, 9))
+    assert calendar.source('A', 2024) == 'file'
+
+    # 离线文件没有该年份：按工作日
+    assert calendar.is_trading_day(datetime(2023, 2, 10))
+    assert not calendar.is_trading_day(datetime(2023, 2, 11))
+    assert calendar.source('A', 2023) == 'weekday'
+
+    # 非接口来源的日历在重试间隔内不重复请求接口
+    calls = len(env.pro.calls)
+    calendar.is_trading_day(datetime(2023, 3, 1))
+    assert len(env.pro.calls) == calls
+    print("✅ 离线文件与工作日降级")
+
+
+def test_sessions(env):
+    """A股/港股交易时段，含收盘那一分钟"""
+    calendar = env.calendar()
+    day = datetime(2024, 2, 8)
+    assert calendar.open_markets(day.replace(hour=9, minute=29)) == []
+    assert calendar.open_markets(day.replace(hour=9, minute=30)) == ['A', 'HK']
+    assert calendar.open_markets(day.replace(hour=11, minute=45)) == ['HK']
+    assert calendar.open_markets(day.replace(hour=12, minute=30)) == []
+    assert calendar.open_markets(day.replace(hour=15, minute=0, second=30)) == ['A', 'HK']
+    assert calendar.open_markets(day.replace(hour=15, minute=1)) == ['HK']
+    assert calendar.open_markets(day.replace(hour=16, minute=1)) == []
+    # A股休市日只有港股开市
+    assert calendar.open_markets(datetime(2024, 2, 9, 10, 0)) == ['HK']
+    assert market_of('00700.HK') == 'HK' and market_of('600519.SH') == 'A'
+    print("✅ 交易时段")
+
+
+def test_condition_skips_without_running():
+    """条件不满足的触发被跳过，不提交到执行通道"""
+    scheduler = SchedulerService()
+    scheduler.jobs = {}
+    scheduler.lanes = {'kline': JobLane('kline', 1)}
+    runs = []
+    job = ScheduledJob('close', '30 16 * * *', 'kline', lambda executor: runs.append(1),
+                       condition=lambda due: due.weekday() < 5)
+
+    now = datetime.now()
+    due = now.replace(second=0, microsecond=0)
+    saturday = due - timedelta(days=(due.weekday() - 5) % 7)
+    scheduler._fire(job, saturday)
+    friday = due - timedelta(days=(due.weekday() - 4) % 7)
+    scheduler._fire(job, friday)
+
+    scheduler.lanes['kline'].shutdown(wait=True)
+    assert job.skipped == 1 and job.fired == 1 and runs == [1]
+    assert job.to_dict()['skipped'] == 1 and job.next_run > now
+    print("✅ 非交易时段跳过")
+
+
+def test_slow_condition_does_not_block_scheduler():
+    """触发条件（交易日历接口）很慢时，调度器的 status/add_job 不被阻塞"""
+    scheduler = SchedulerService()
+    scheduler.jobs = {}
+    release = threading.Event()
+    checking = threading.Event()
+
+    def slow_condition(due):
+        checking.set()
+        return release.wait(5)
+
+    first = datetime.now().replace(microsecond=0) + timedelta(seconds=1)
+    scheduler.add_job(ScheduledJob('slow', CronAt(first), 'kline', lambda executor: None,
+                                   condition=slow_condition))
+    scheduler.start()
+    try:
+        assert checking.wait(3)
+        start = time.perf_counter()
+        assert scheduler.status()['jobs']['slow']['skipped'] == 0
+        scheduler.add_job(ScheduledJob('other', CronAt(first + timedelta(days=1)), 'kline', lambda executor: None))
+        assert time.perf_counter() - start < 0.5
+    finally:
+        release.set()
+        scheduler.stop()
+    print("✅ 慢条件不阻塞调度器")
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main(['-q', '-s', __file__]))
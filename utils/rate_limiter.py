@@ -0,0 +1,213 @@
+"""
+Tushare接口限流（令牌桶）
+
+每个接口一个令牌桶，按每分钟配额匀速补充令牌：
+- acquire(): 取不到令牌时阻塞等待（后台任务使用）
+- try_acquire(): 不等待，立即返回是否取到
+- non_blocking(): 上下文内的 acquire() 不等待，配额不足时抛出 RateLimitExceeded，
+  并记录在上下文中，供Web请求返回429
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from config import config
+from utils.logger import stock_logger
+
+
+class RateLimitExceeded(Exception):
+    """接口配额不足"""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"接口调用过于频繁: {endpoint}，请{retry_after:.1f}秒后重试")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶
+
+    Args:
+        per_minute: 每分钟配额（必须为正数）
+        burst: 桶容量（允许的瞬时突发次数），默认为10秒的配额，至少为1
+    """
+
+    def __init__(self, per_minute, burst=None):
+        if per_minute <= 0:
+            raise ValueError(f"每分钟配额必须为正数: {per_minute}")
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or max(1, per_minute // 6))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """尝试取一个令牌，返回 0（取到）或需要等待的秒数"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class _Stats:
+    """单个接口的限流统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.rejected = 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'waits': self.waits,
+            'wait_total': round(self.wait_total, 3),
+            'wait_avg': round(self.wait_total / self.waits, 3) if self.waits else 0.0,
+            'wait_max': round(self.wait_max, 3),
+            'rejected': self.rejected
+        }
+
+
+class _NonBlockingContext:
+    """non_blocking() 的上下文，记录被拒绝的调用"""
+
+    def __init__(self):
+        self.rejected = []
+
+    @property
+    def retry_after(self):
+        return max((e.retry_after for e in self.rejected), default=0.0)
+
+
+class RateLimiter:
+    """按接口名限流
+
+    Args:
+        quotas: {接口名: 每分钟配额}
+        default_quota: 未配置接口的每分钟配额
+
+    配额必须为正数，在创建时检查（令牌桶按需创建，不能等到第一次调用才报错）
+    """
+
+    def __init__(self, quotas=None, default_quota=200):
+        self.quotas = dict(quotas or {})
+        self.default_quota = default_quota
+        invalid = {name: quota for name, quota in self.quotas.items() if quota <= 0}
+        if default_quota <= 0:
+            invalid['默认配额'] = default_quota
+        if invalid:
+            raise ValueError(f"每分钟配额必须为正数: {invalid}")
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _bucket(self, endpoint):
+        with self._lock:
+            bucket = self._buckets.get(endpoint)
+            if bucket is None:
+                bucket = TokenBucket(self.quotas.get(endpoint, self.default_quota))
+                self._buckets[endpoint] = bucket
+                self._stats[endpoint] = _Stats()
+            return bucket, self._stats[endpoint]
+
+    def try_acquire(self, endpoint):
+        """不等待地取令牌，返回是否成功"""
+        bucket, stats = self._bucket(endpoint)
+        wait = bucket.take()
+        with self._lock:
+            if wait:
+                stats.rejected += 1
+            else:
+                stats.calls += 1
+        return not wait
+
+    def acquire(self, endpoint, timeout=None):
+        """取令牌，配额不足时等待
+
+        在 non_blocking() 上下文中不等待，直接抛出 RateLimitExceeded
+
+        Returns:
+            float: 等待的秒数
+        """
+        bucket, stats = self._bucket(endpoint)
+        context = getattr(self._local, 'context', None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = 0.0
+
+        while True:
+            wait = bucket.take()
+            if not wait:
+                break
+            if context is not None or (deadline is not None and time.monotonic() + wait > deadline):
+                error = RateLimitExceeded(endpoint, wait)
+                with self._lock:
+                    stats.rejected += 1
+                if context is not None:
+                    context.rejected.append(error)
+                raise error
+            time.sleep(wait)
+            waited += wait
+
+        with self._lock:
+            stats.calls += 1
+            if waited:
+                stats.waits += 1
+                stats.wait_total += waited
+                stats.wait_max = max(stats.wait_max, waited)
+        if waited >= 1:
+            stock_logger.info(f"API限流: {endpoint} 等待 {waited:.1f} 秒")
+        return waited
+
+    @contextmanager
+    def non_blocking(self):
+        """当前线程内的调用不等待令牌（用于Web请求）"""
+        previous = getattr(self._local, 'context', None)
+        context = _NonBlockingContext()
+        self._local.context = context
+        try:
+            yield context
+        finally:
+            self._local.context = previous
+
+    def limited(self, endpoint):
+        """装饰器：调用前先取令牌"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                self.acquire(endpoint)
+                return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        """各接口的调用次数、等待次数/时长和拒绝次数"""
+        with self._lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self._stats.items()}
+
+
+class RateLimitedClient:
+    """Tushare pro_api 的代理：每次接口调用前按接口名取令牌"""
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        return self._limiter.limited(name)(attr)
+
+
+# 创建全局限流器实例
+rate_limiter = RateLimiter(config.TUSHARE_RATE_LIMITS, config.TUSHARE_DEFAULT_RATE)
@@ -0,0 +1,84 @@
+"""
+进程内 TTL + LRU 缓存
+
+- 容量有上限，超出时淘汰最久未使用的条目
+- 每个条目带过期时间，过期后视为未命中
+- 支持缓存None（负缓存，如不存在的股票代码），可单独设置较短的有效期
+- 统计命中、未命中、淘汰次数
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """线程安全的 TTL + LRU 缓存
+
+    Args:
+        maxsize: 最多缓存的条目数
+        ttl: 正常条目的有效期（秒）
+        negative_ttl: 值为None的条目的有效期（秒），默认与ttl相同
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=_MISSING):
+        """取缓存值，未命中或已过期时返回default（未提供时返回模块级哨兵，用 cache.missing() 判断）"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    @staticmethod
+    def missing(value):
+        """get() 的返回值是否表示未命中"""
+        return value is _MISSING
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """删除一个条目，key为None时清空"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'negative_ttl': self.negative_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }